@@ -12,6 +12,8 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Automatically discover tasks in all installed Django apps
 app.autodiscover_tasks()
+# The main app keeps its tasks in main/task.py
+app.autodiscover_tasks(related_name='task')
 
 @app.task(bind=True)
 def debug_task(self):
@@ -185,6 +185,40 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'  # Adjust to your time zone
 
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-tokens': {
+        'task': 'main.task.purge_expired_tokens',
+        'schedule': 60 * 60,  # Every hour
+    },
+}
+
+# Shared cache on the broker's Redis (database 1), so cached payloads and
+# their generation counters are coherent across all web and worker processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'{CELERY_BROKER_URL}/1',
+    }
+}
+
+# Leaderboard storage: sorted sets on the same Redis as the Celery broker.
+# Use 'main.leaderboard.DatabaseBackend' for the materialized table or
+# 'main.leaderboard.InMemoryBackend' for tests and local development.
+LEADERBOARD_BACKEND = 'main.leaderboard.RedisBackend'
+LEADERBOARD_REDIS_URL = CELERY_BROKER_URL
+
+# Live events (main.events): pub/sub on the broker's Redis. Use
+# 'main.events.InMemoryBroker' for tests and local development.
+EVENTS_BACKEND = 'main.events.RedisBroker'
+EVENTS_REDIS_URL = CELERY_BROKER_URL
+
+# Homework submissions (main.uploads): files larger than this are refused
+# while they are streamed, and only these extensions are accepted
+HOMEWORK_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+HOMEWORK_UPLOAD_EXTENSIONS = [
+    '.pdf', '.doc', '.docx', '.odt', '.rtf', '.txt',
+    '.ppt', '.pptx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png', '.zip',
+]
 
 # Internationalization
 LANGUAGE_CODE = 'ru'
@@ -204,7 +238,7 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'main.authentication.ExpiringTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',  # Useful for Browsable API in development
     ],
     'DEFAULT_PERMISSION_CLASSES': [
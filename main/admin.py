@@ -113,9 +113,9 @@ class UserAchievementAdmin(admin.ModelAdmin):
 # Leaderboard Admin
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
-    list_display = ('id', 'get_username', 'rank')
+    list_display = ('id', 'get_username', 'metric', 'score', 'rank')
     list_display_links = ('id', 'get_username')
-    list_filter = ('rank',)
+    list_filter = ('metric',)
     search_fields = ('user_profile__user__username',)
 
     def get_username(self, obj):
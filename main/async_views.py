@@ -0,0 +1,267 @@
+# main/async_views.py
+
+"""
+Async variants of the read-heavy endpoints, routed under ``async/``.
+
+Under ASGI (see the Procfile) these views run on the event loop. Token
+checks, throttling and cache lookups use the async cache API, and rows are
+read with the async ORM, so a request waiting on Redis or the database does
+not hold a worker thread. The views reuse the querysets, filters,
+serializers and cache keys of the DRF views in ``main.views`` and return
+the same payloads; ``manage.py benchmark_endpoints`` compares both paths.
+
+Only token authentication is supported here; browser sessions keep using
+the DRF endpoints.
+"""
+
+import logging
+import math
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, NotFound, PermissionDenied, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import caching, leaderboard
+from .authentication import ExpiringTokenAuthentication
+from .models import UserProfile
+from .profiles import get_profile
+from .serializers import UserSerializer, UserProfileSerializer
+from .views import (
+    UserMeView, ScheduleViewSet, HomeworkViewSet, AttendanceViewSet,
+    LeaderboardViewSet, LEADERBOARD_CACHE_DEPENDENCIES,
+)
+
+logger = logging.getLogger(__name__)
+
+renderer = JSONRenderer()
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    """
+    Renders ``data`` exactly like the DRF endpoints do.
+    """
+    return HttpResponse(renderer.render(data), content_type=renderer.media_type, status=status)
+
+
+def _unauthorized(detail):
+    response = JsonResponse({"detail": detail}, status=status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+def _bind_view(view_class, request, user, token, action):
+    """
+    Returns an instance of a DRF view set up for ``request`` as if DRF had
+    dispatched it, so its queryset, filter and serializer methods can be used.
+    """
+    view = view_class()
+    view.action = action
+    view.args, view.kwargs = (), {}
+    view.format_kwarg = None
+    view.headers = {}
+    view.request = Request(request, parsers=view.get_parsers())
+    view.request.user = user
+    view.request.auth = token
+    return view
+
+
+async def _allow_request(throttle, request, view):
+    """
+    ``SimpleRateThrottle.allow_request`` on the async cache API.
+    """
+    if throttle.rate is None:
+        return True
+    throttle.key = throttle.get_cache_key(request, view)
+    if throttle.key is None:
+        return True
+
+    throttle.history = await throttle.cache.aget(throttle.key, [])
+    throttle.now = throttle.timer()
+    while throttle.history and throttle.history[-1] <= throttle.now - throttle.duration:
+        throttle.history.pop()
+    if len(throttle.history) >= throttle.num_requests:
+        return False
+    throttle.history.insert(0, throttle.now)
+    await throttle.cache.aset(throttle.key, throttle.history, throttle.duration)
+    return True
+
+
+def async_api_view(view_class, action='list'):
+    """
+    Turns ``handler(view)`` into an async GET view that authenticates the
+    token and applies the throttles of ``view_class``.
+    """
+    def decorator(handler):
+        @require_GET
+        @wraps(handler)
+        async def wrapped(request):
+            keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+            if keyword != 'Token' or not key.strip():
+                return _unauthorized("Authentication credentials were not provided.")
+            try:
+                user, token = await ExpiringTokenAuthentication().aauthenticate_credentials(key.strip())
+            except AuthenticationFailed as e:
+                return _unauthorized(str(e.detail))
+
+            view = _bind_view(view_class, request, user, token, action)
+            for throttle in view.get_throttles():
+                if not await _allow_request(throttle, view.request, view):
+                    exc = Throttled(throttle.wait())
+                    logger.warning(f"User {user.username} was throttled on {request.path}.")
+                    response = json_response({"detail": exc.detail}, status=exc.status_code)
+                    if exc.wait is not None:
+                        response['Retry-After'] = str(math.ceil(exc.wait))
+                    return response
+            return await handler(view)
+        return wrapped
+    return decorator
+
+
+async def paginate(view, queryset):
+    """
+    Returns the page requested with ?page= and ?page_size= in the format of
+    the view's paginator. Raises NotFound for an invalid page.
+    """
+    paginator = view.paginator
+    request = view.request
+    django_paginator = paginator.django_paginator_class(queryset, paginator.get_page_size(request))
+    # Counted with the async ORM, so Paginator never queries
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+    page.object_list = [obj async for obj in page.object_list]
+    paginator.page, paginator.request = page, request
+    return paginator.get_paginated_response(view.get_serializer(page.object_list, many=True).data).data
+
+
+async def conditional_list(view):
+    """
+    The list action of a view with ``ConditionalGetMixin``: 304 while its
+    data is unchanged, otherwise one page of the filtered queryset.
+    """
+    request = view.request
+    etag, last_modified = await view.aget_conditional_state(request)
+    if view.is_not_modified(request, etag):
+        return view.set_validators(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+    try:
+        page = await paginate(view, view.filter_queryset(view.get_queryset()))
+    except NotFound as e:
+        return json_response({"detail": e.detail}, status=status.HTTP_404_NOT_FOUND)
+    return view.set_validators(json_response(page), etag, last_modified)
+
+
+def _profile_data(user):
+    return UserProfileSerializer(get_profile(user)).data
+
+
+@async_api_view(UserMeView, action='get')
+async def me(view):
+    """
+    Async variant of ``me/``.
+    """
+    user = view.request.user
+    try:
+        profile = await UserProfile.objects.prefetch_related('achievements').filter(user_id=user.pk).afirst()
+        if profile is not None:
+            profile.user = user
+            profile_data = UserProfileSerializer(profile).data
+        else:
+            # Users written in bulk may have no profile yet
+            profile_data = await sync_to_async(_profile_data)(user)
+
+        response_data = UserSerializer(user).data
+        response_data.update(profile_data)
+        logger.info(f"User {user.username} retrieved their information.")
+        return json_response(response_data)
+    except Exception as e:
+        logger.error(f"Error processing /api/async/me/ request for user {user.username}: {e}")
+        return json_response({"error": "Failed to retrieve user information."},
+                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(ScheduleViewSet)
+async def schedules(view):
+    """
+    Async variant of the ``schedules/`` list.
+    """
+    return await conditional_list(view)
+
+
+@async_api_view(HomeworkViewSet)
+async def homeworks(view):
+    """
+    Async variant of the ``homeworks/`` list.
+    """
+    return await conditional_list(view)
+
+
+@async_api_view(AttendanceViewSet, action='today')
+async def attendance_today(view):
+    """
+    Async variant of ``attendances/today/``.
+    """
+    user = view.request.user
+    try:
+        attendance_records = view.get_today_queryset(user)
+        if attendance_records is None:
+            return json_response({"error": "You do not have access to this endpoint."},
+                                 status=status.HTTP_403_FORBIDDEN)
+
+        records = [record async for record in view.expand_queryset(attendance_records)]
+        return json_response(view.get_serializer(records, many=True).data)
+    except Exception as e:
+        logger.error(f"Error retrieving today's attendance for user {user.username}: {e}")
+        return json_response({"error": "Failed to retrieve attendance."},
+                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(LeaderboardViewSet)
+async def leaderboard_list(view):
+    """
+    Async variant of the ``leaderboard/`` list. Pages are shared with the
+    sync endpoint through the versioned cache; only a miss builds the page
+    in a thread.
+    """
+    params = view.request.query_params
+    metric = view.get_metric()
+    try:
+        if params.get('scope', leaderboard.GLOBAL) == leaderboard.GLOBAL:
+            scope_key = view.get_scope_key()
+        else:
+            # The default class and the access check read from the database
+            scope_key = await sync_to_async(view.get_scope_key)()
+        page, page_size = view.get_page_bounds()
+    except ValueError as e:
+        return json_response({"error": str(e) or "Invalid leaderboard parameters."},
+                             status=status.HTTP_400_BAD_REQUEST)
+    except PermissionDenied as e:
+        return json_response({"detail": e.detail}, status=e.status_code)
+
+    async def build():
+        return await sync_to_async(view.build_page)(metric, scope_key, page, page_size)
+
+    try:
+        leaderboard_data = await caching.aget_or_set(
+            view.get_page_cache_key(metric, scope_key, page, page_size),
+            build,
+            depends_on=LEADERBOARD_CACHE_DEPENDENCIES,
+        )
+    except leaderboard.UnsupportedScope as e:
+        return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error retrieving leaderboard for metric {metric}: {e}")
+        return json_response({"error": "Failed to retrieve leaderboard."},
+                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return json_response(leaderboard_data)
@@ -1,33 +1,217 @@
 # main/authentication.py
 
-from rest_framework.authentication import TokenAuthentication
-from rest_framework import exceptions
-from django.utils import timezone
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
 
-# Настройка времени истечения токена (24 часа)
+User = get_user_model()
+
+# Настройка времени истечения токена (24 часа с последнего использования)
 TOKEN_EXPIRATION_TIME = timedelta(hours=24)
 
+# Скользящее продление: дата токена сдвигается в БД не чаще, чем раз в этот интервал
+TOKEN_REFRESH_INTERVAL = timedelta(hours=1)
+
+# Время жизни записей в локальном (внутрипроцессном) кэше, в секундах
+LOCAL_CACHE_TTL = 30
+LOCAL_CACHE_SIZE = 4096
+
+# Время жизни записей в общем кэше, в секундах
+SHARED_CACHE_TTL = 300
+
+# Поля пользователя, которые хранятся в кэше. Остальные поля (в том числе
+# пароль) загружаются отложенно при первом обращении.
+USER_CACHE_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'role', 'school_id',
+    'is_active', 'is_staff', 'is_superuser',
+)
+
+
+def token_is_expired(created):
+    """
+    Checks if a token created (or last refreshed) at ``created`` has expired.
+    """
+    return timezone.now() > created + TOKEN_EXPIRATION_TIME
+
+
+class LocalTTLCache:
+    """
+    Small thread-safe LRU cache with a per-entry time to live.
+    """
+
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_token_cache = LocalTTLCache()
+
+
+def _shared_key(key):
+    return f'auth_token:{key}'
+
+
+def cache_token_entry(entry):
+    local_token_cache.set(entry['key'], entry)
+    cache.set(_shared_key(entry['key']), entry, SHARED_CACHE_TTL)
+
+
+async def acache_token_entry(entry):
+    local_token_cache.set(entry['key'], entry)
+    await cache.aset(_shared_key(entry['key']), entry, SHARED_CACHE_TTL)
+
+
+def evict_tokens(*keys):
+    """
+    Removes tokens from both cache tiers. Other processes drop their local
+    copy within LOCAL_CACHE_TTL seconds.
+    """
+    for key in keys:
+        local_token_cache.delete(key)
+    cache.delete_many([_shared_key(key) for key in keys])
+
+
+def evict_user_tokens(*user_ids):
+    """
+    Removes the tokens of users from both cache tiers, with one query.
+    """
+    keys = Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True)
+    if keys:
+        evict_tokens(*keys)
+
 
 class ExpiringTokenAuthentication(TokenAuthentication):
     """
     Кастомный класс аутентификации, который проверяет срок действия токена.
-    Токен считается просроченным, если с момента его создания прошло более 24 часов.
+    Токен считается просроченным, если с момента его последнего использования
+    прошло более 24 часов (скользящее продление).
+
+    Токен вместе с ролью и школой пользователя хранится в двух уровнях кэша:
+    в локальном LRU-кэше процесса с коротким временем жизни и в общем кэше.
+    При попадании в кэш запрос не обращается к базе данных.
     """
 
-    def authenticate_credentials(self, key):
+    def load_entry(self, key):
         try:
             token = Token.objects.select_related('user').get(key=key)
         except Token.DoesNotExist:
             raise exceptions.AuthenticationFailed('Токен не действителен.')
 
-        if not token.user.is_active:
+        entry = {
+            'key': token.key,
+            'created': token.created,
+            'user': {field: getattr(token.user, field) for field in USER_CACHE_FIELDS},
+        }
+        cache_token_entry(entry)
+        return entry
+
+    def get_entry(self, key):
+        entry = local_token_cache.get(key)
+        if entry is None:
+            entry = cache.get(_shared_key(key))
+            if entry is not None:
+                local_token_cache.set(key, entry)
+        if entry is None:
+            entry = self.load_entry(key)
+        return entry
+
+    async def aget_entry(self, key):
+        entry = local_token_cache.get(key)
+        if entry is None:
+            entry = await cache.aget(_shared_key(key))
+            if entry is not None:
+                local_token_cache.set(key, entry)
+        if entry is None:
+            entry = await sync_to_async(self.load_entry)(key)
+        return entry
+
+    def build_user(self, data):
+        """
+        Builds a User from cached fields. The remaining fields are deferred,
+        so saving it only writes the fields that were loaded.
+        """
+        fields = [f.attname for f in User._meta.concrete_fields if f.attname in data]
+        return User.from_db('default', fields, [data[field] for field in fields])
+
+    def check_entry(self, key, entry):
+        if not entry['user']['is_active']:
             raise exceptions.AuthenticationFailed('Пользователь неактивен.')
 
-        # Проверяем, не истек ли токен
-        if timezone.now() > token.created + TOKEN_EXPIRATION_TIME:
-            token.delete()  # Удаляем просроченный токен
+        # Проверяем, не истек ли токен. Просроченные токены удаляются
+        # пакетно периодической задачей purge_expired_tokens.
+        if token_is_expired(entry['created']):
+            evict_tokens(key)
             raise exceptions.AuthenticationFailed('Токен истек.')
 
-        return (token.user, token)
\ No newline at end of file
+    def build_credentials(self, key, entry):
+        user = self.build_user(entry['user'])
+        token = Token(key=key, user=user, created=entry['created'])
+        token._state.adding = False
+        return (user, token)
+
+    def authenticate_credentials(self, key):
+        entry = self.get_entry(key)
+        self.check_entry(key, entry)
+
+        now = timezone.now()
+        if now - entry['created'] > TOKEN_REFRESH_INTERVAL:
+            Token.objects.filter(key=key).update(created=now)
+            entry = dict(entry, created=now)
+            cache_token_entry(entry)
+
+        return self.build_credentials(key, entry)
+
+    async def aauthenticate_credentials(self, key):
+        """
+        Async variant for async views: a cached token is checked without
+        leaving the event loop.
+        """
+        entry = await self.aget_entry(key)
+        if not entry['user']['is_active'] or token_is_expired(entry['created']):
+            await sync_to_async(self.check_entry)(key, entry)
+
+        now = timezone.now()
+        if now - entry['created'] > TOKEN_REFRESH_INTERVAL:
+            await Token.objects.filter(key=key).aupdate(created=now)
+            entry = dict(entry, created=now)
+            await acache_token_entry(entry)
+
+        return self.build_credentials(key, entry)
@@ -0,0 +1,186 @@
+# main/caching.py
+
+"""
+Versioned cache for derived data.
+
+Every cached payload declares the models (or free-form tags) it depends on.
+Each tag has a generation counter in the shared cache, and the payload is
+stored under a key that embeds the current generation of all of its tags.
+Writes bump the generation (see the receivers in ``main.signals``), so
+invalidation is a single O(1) increment and readers can never look up a
+payload built from older data.
+"""
+
+import datetime
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Model
+
+GENERATION_KEY_PREFIX = 'cache_gen'
+MODIFIED_KEY_PREFIX = 'cache_mtime'
+
+# Default lifetime of cached payloads in seconds
+DEFAULT_TIMEOUT = 300
+
+
+def tag_for(dependency):
+    """
+    Returns the cache tag of a model class, model instance or plain string tag.
+    """
+    if isinstance(dependency, str):
+        return dependency
+    if isinstance(dependency, Model) or (isinstance(dependency, type) and issubclass(dependency, Model)):
+        return f'model:{dependency._meta.label_lower}'
+    raise TypeError(f"Unsupported cache dependency: {dependency!r}")
+
+
+def _generation_key(tag):
+    return f'{GENERATION_KEY_PREFIX}:{tag}'
+
+
+def _modified_key(tag):
+    return f'{MODIFIED_KEY_PREFIX}:{tag}'
+
+
+def _fresh_generation():
+    # A time-based start value: if a counter is evicted, it restarts above the
+    # old value instead of colliding with payloads cached under it.
+    return time.time_ns() // 1000
+
+
+def get_state(dependencies):
+    """
+    Returns ``({tag: generation}, last_modified)`` for the given dependencies
+    with one cache round trip. ``last_modified`` is the most recent bump time
+    of any dependency, or None if none of them has been bumped yet.
+    """
+    tags = [tag_for(dependency) for dependency in dependencies]
+    keys = [_generation_key(tag) for tag in tags] + [_modified_key(tag) for tag in tags]
+    found = cache.get_many(keys)
+
+    generations = {}
+    for tag in tags:
+        key = _generation_key(tag)
+        generation = found.get(key)
+        if generation is None:
+            cache.add(key, _fresh_generation(), timeout=None)
+            generation = cache.get(key)
+        generations[tag] = generation
+
+    modified = [found[_modified_key(tag)] for tag in tags if _modified_key(tag) in found]
+    last_modified = None
+    if modified:
+        last_modified = datetime.datetime.fromtimestamp(max(modified), tz=datetime.timezone.utc)
+    return generations, last_modified
+
+
+async def aget_state(dependencies):
+    """
+    Async variant of ``get_state()`` for async views.
+    """
+    tags = [tag_for(dependency) for dependency in dependencies]
+    keys = [_generation_key(tag) for tag in tags] + [_modified_key(tag) for tag in tags]
+    found = await cache.aget_many(keys)
+
+    generations = {}
+    for tag in tags:
+        key = _generation_key(tag)
+        generation = found.get(key)
+        if generation is None:
+            await cache.aadd(key, _fresh_generation(), timeout=None)
+            generation = await cache.aget(key)
+        generations[tag] = generation
+
+    modified = [found[_modified_key(tag)] for tag in tags if _modified_key(tag) in found]
+    last_modified = None
+    if modified:
+        last_modified = datetime.datetime.fromtimestamp(max(modified), tz=datetime.timezone.utc)
+    return generations, last_modified
+
+
+def get_generations(dependencies):
+    """
+    Returns {tag: generation} for the given dependencies with one cache round trip.
+    """
+    return get_state(dependencies)[0]
+
+
+def bump(*dependencies):
+    """
+    Invalidates every payload that depends on any of the given dependencies.
+    """
+    modified = {}
+    for tag in {tag_for(dependency) for dependency in dependencies}:
+        key = _generation_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_generation(), timeout=None)
+        modified[_modified_key(tag)] = time.time()
+    cache.set_many(modified, timeout=None)
+
+
+def bump_on_commit(*dependencies):
+    """
+    Bumps once the current transaction commits (immediately outside of one),
+    so that a reader cannot cache pre-commit data under the new generation.
+    """
+    transaction.on_commit(lambda: bump(*dependencies))
+
+
+def _versioned(key, generations):
+    version = '.'.join(str(generations[tag]) for tag in sorted(generations))
+    return f'{key}:{version}'
+
+
+def versioned_key(key, dependencies):
+    return _versioned(key, get_generations(dependencies))
+
+
+def get_or_set(key, builder, depends_on, timeout=DEFAULT_TIMEOUT):
+    """
+    Returns the payload cached under ``key`` for the current generations of
+    ``depends_on``, building and storing it with ``builder()`` on a miss.
+    """
+    full_key = versioned_key(key, depends_on)
+    payload = cache.get(full_key)
+    if payload is None:
+        payload = builder()
+        cache.set(full_key, payload, timeout)
+    return payload
+
+
+async def aget_or_set(key, builder, depends_on, timeout=DEFAULT_TIMEOUT):
+    """
+    Async variant of ``get_or_set()``; ``builder`` is a coroutine function.
+    Both share the cached payloads.
+    """
+    generations, _ = await aget_state(depends_on)
+    full_key = _versioned(key, generations)
+    payload = await cache.aget(full_key)
+    if payload is None:
+        payload = await builder()
+        await cache.aset(full_key, payload, timeout)
+    return payload
+
+
+def get_many_or_set(keys, builder, depends_on, timeout=DEFAULT_TIMEOUT):
+    """
+    Batched ``get_or_set()``: returns {key: payload} for ``keys`` with one
+    cache read, building every missing payload with a single call to
+    ``builder(missing keys)``, which returns {key: payload}.
+    """
+    if not keys:
+        return {}
+    generations = get_generations(depends_on)
+    full_keys = {key: _versioned(key, generations) for key in keys}
+    found = cache.get_many(list(full_keys.values()))
+    payloads = {key: found[full_key] for key, full_key in full_keys.items() if full_key in found}
+    missing = [key for key in full_keys if key not in payloads]
+    if missing:
+        built = builder(missing)
+        cache.set_many({full_keys[key]: built[key] for key in missing}, timeout)
+        payloads.update(built)
+    return payloads
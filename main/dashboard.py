@@ -0,0 +1,271 @@
+# main/dashboard.py
+
+"""
+Home screen data in one response.
+
+``build_dashboard()`` assembles today's lessons, upcoming homework, recent
+grades and today's attendance for the scope of a user: the student, every
+child of a parent, or every class of a teacher. Each section is read with
+one batched query for the whole scope, so the number of queries does not
+depend on the number of children, classes or rows.
+
+Payloads are cached per user and day in the versioned cache (see
+``main.caching``) until one of the models they are built from changes,
+a displayed user field changes or attendance of that day is written. The
+unread notification count changes far more often and is read from its own
+counter on every request.
+"""
+
+import datetime
+
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.utils.timezone import localtime, make_aware, now
+from rest_framework import serializers
+
+from . import caching, notifications
+from .signals import USER_DISPLAY_TAG, attendance_day_tag
+from .models import (
+    User, SchoolClass, Subject, Schedule, Homework, SubmittedHomework,
+    Grade, Attendance, ParentChild,
+)
+
+# Homework is listed if it is due between the start of today and this many days later
+HOMEWORK_WINDOW_DAYS = 7
+
+# Latest grades listed per student, and per teacher for the grades they gave
+RECENT_GRADES = 5
+TEACHER_RECENT_GRADES = 10
+
+# Models whose changes invalidate cached dashboards; users only through
+# their displayed fields, attendance only through the day shown (see
+# ``get_dashboard()``)
+DASHBOARD_CACHE_DEPENDENCIES = [
+    USER_DISPLAY_TAG, SchoolClass, Subject, Schedule, Homework, SubmittedHomework, Grade, ParentChild,
+]
+
+# Dates and times are rendered like the other endpoints render them
+_datetime_field = serializers.DateTimeField()
+_decimal_field = serializers.DecimalField(max_digits=3, decimal_places=1)
+
+
+def _full_name(first_name, last_name, username):
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def _homework_window(today):
+    start = make_aware(datetime.datetime.combine(today, datetime.time.min))
+    return start, start + datetime.timedelta(days=HOMEWORK_WINDOW_DAYS + 1)
+
+
+def _lessons(queryset, weekday):
+    """
+    Lessons of ``weekday`` in ``queryset``, in the order of the day.
+    """
+    rows = queryset.filter(weekday=weekday).order_by('start_time', 'pk').values(
+        'id', 'school_class_id', 'school_class__name', 'subject_id', 'subject__name',
+        'teacher_id', 'teacher__username', 'teacher__first_name', 'teacher__last_name',
+        'start_time', 'end_time',
+    )
+    return [{
+        'id': row['id'],
+        'school_class_id': row['school_class_id'],
+        'school_class': row['school_class__name'],
+        'subject_id': row['subject_id'],
+        'subject': row['subject__name'],
+        'teacher_id': row['teacher_id'],
+        'teacher': _full_name(row['teacher__first_name'], row['teacher__last_name'], row['teacher__username']),
+        'start_time': row['start_time'].isoformat(),
+        'end_time': row['end_time'].isoformat(),
+    } for row in rows]
+
+
+def _homework(row):
+    return {
+        'id': str(row['id']),
+        'school_class_id': row['school_class_id'],
+        'subject': row['subject__name'],
+        'description': row['description'],
+        'due_date': _datetime_field.to_representation(row['due_date']),
+    }
+
+
+def _grade(row):
+    return {
+        'id': row['id'],
+        'subject': row['subject__name'],
+        'grade': _decimal_field.to_representation(row['grade']),
+        'date': row['date'].isoformat(),
+        'comments': row['comments'],
+    }
+
+
+def _students_dashboard(students, today):
+    """
+    Per-student sections for ``students``: {id: (username, first name, last name)}.
+    """
+    student_ids = list(students)
+    sections = {
+        student_id: {
+            'id': student_id,
+            'name': _full_name(first_name, last_name, username),
+            'classes': [],
+            'lessons': [],
+            'homework': [],
+            'grades': [],
+            'attendance': [],
+        }
+        for student_id, (username, first_name, last_name) in students.items()
+    }
+    if not sections:
+        return []
+
+    memberships = SchoolClass.students.through.objects.filter(user_id__in=student_ids).values_list(
+        'user_id', 'schoolclass_id', 'schoolclass__name'
+    )
+    classes_of = {}
+    for student_id, class_id, class_name in memberships:
+        sections[student_id]['classes'].append({'id': class_id, 'name': class_name})
+        classes_of.setdefault(class_id, []).append(student_id)
+
+    if classes_of:
+        for lesson in _lessons(Schedule.objects.filter(school_class_id__in=classes_of), today.isoweekday()):
+            for student_id in classes_of[lesson['school_class_id']]:
+                sections[student_id]['lessons'].append(lesson)
+
+        start, end = _homework_window(today)
+        homework = list(
+            Homework.objects.filter(school_class_id__in=classes_of, due_date__gte=start, due_date__lt=end)
+            .order_by('due_date', 'pk')
+            .values('id', 'school_class_id', 'subject__name', 'description', 'due_date')
+        )
+        submitted = set(
+            SubmittedHomework.objects.filter(
+                student_id__in=student_ids, homework_id__in=[row['id'] for row in homework]
+            ).values_list('student_id', 'homework_id')
+        ) if homework else set()
+        for row in homework:
+            for student_id in classes_of[row['school_class_id']]:
+                item = _homework(row)
+                item['submitted'] = (student_id, row['id']) in submitted
+                sections[student_id]['homework'].append(item)
+
+    # The latest grades of every student with one query
+    grades = (
+        Grade.objects.filter(student_id__in=student_ids)
+        .annotate(position=Window(
+            RowNumber(), partition_by=[F('student_id')], order_by=[F('date').desc(), F('id').desc()]
+        ))
+        .filter(position__lte=RECENT_GRADES)
+        .order_by('student_id', '-date', '-id')
+        .values('id', 'student_id', 'subject__name', 'grade', 'date', 'comments')
+    )
+    for row in grades:
+        sections[row['student_id']]['grades'].append(_grade(row))
+
+    attendance = Attendance.objects.filter(student_id__in=student_ids, date=today).order_by('pk').values_list(
+        'student_id', 'school_class_id', 'status'
+    )
+    for student_id, class_id, status in attendance:
+        sections[student_id]['attendance'].append({'school_class_id': class_id, 'status': status})
+
+    return [sections[student_id] for student_id in student_ids]
+
+
+def _teacher_dashboard(user, today):
+    classes = {
+        row['id']: {
+            'id': row['id'], 'name': row['name'], 'students': row['student_count'], 'homework': [], 'attendance': {},
+        }
+        for row in SchoolClass.objects.filter(teachers=user)
+        .annotate(student_count=Count('students', distinct=True))
+        .order_by('name', 'pk')
+        .values('id', 'name', 'student_count')
+    }
+
+    start, end = _homework_window(today)
+    homework = (
+        Homework.objects.filter(teacher=user, due_date__gte=start, due_date__lt=end)
+        .annotate(submissions=Count('submitted_homeworks'))
+        .order_by('due_date', 'pk')
+        .values('id', 'school_class_id', 'subject__name', 'description', 'due_date', 'submissions')
+    )
+    unlisted_homework = []
+    for row in homework:
+        item = _homework(row)
+        item['submissions'] = row['submissions']
+        school_class = classes.get(row['school_class_id'])
+        (school_class['homework'] if school_class else unlisted_homework).append(item)
+
+    if classes:
+        attendance = (
+            Attendance.objects.filter(school_class_id__in=classes, date=today)
+            .order_by()
+            .values_list('school_class_id', 'status')
+            .annotate(count=Count('pk'))
+        )
+        for class_id, status, count in attendance:
+            classes[class_id]['attendance'][status] = count
+
+    grades = (
+        Grade.objects.filter(teacher=user)
+        .order_by('-date', '-id')
+        .values(
+            'id', 'student_id', 'student__username', 'student__first_name', 'student__last_name',
+            'subject__name', 'grade', 'date', 'comments',
+        )[:TEACHER_RECENT_GRADES]
+    )
+    recent_grades = []
+    for row in grades:
+        item = _grade(row)
+        item['student_id'] = row['student_id']
+        item['student'] = _full_name(row['student__first_name'], row['student__last_name'], row['student__username'])
+        recent_grades.append(item)
+
+    return {
+        'lessons': _lessons(Schedule.objects.filter(teacher=user), today.isoweekday()),
+        'classes': list(classes.values()),
+        # Homework of classes the teacher no longer teaches
+        'other_homework': unlisted_homework,
+        'recent_grades': recent_grades,
+    }
+
+
+def build_dashboard(user, today):
+    """
+    Returns the dashboard of ``user`` for ``today`` without the unread count,
+    or None for a role without a dashboard.
+    """
+    data = {'role': user.role, 'date': today.isoformat()}
+    if user.role == User.STUDENT:
+        students = {user.pk: (user.username, user.first_name, user.last_name)}
+        data['student'] = _students_dashboard(students, today)[0]
+    elif user.role == User.PARENT:
+        children = ParentChild.objects.filter(parent=user).order_by('child_id').values_list(
+            'child_id', 'child__username', 'child__first_name', 'child__last_name'
+        ).distinct()
+        data['children'] = _students_dashboard(
+            {child_id: (username, first_name, last_name) for child_id, username, first_name, last_name in children},
+            today,
+        )
+    elif user.role == User.TEACHER:
+        data.update(_teacher_dashboard(user, today))
+    else:
+        return None
+    return data
+
+
+def get_dashboard(user):
+    """
+    Returns the cached dashboard of ``user`` with the current unread count,
+    or None for a role without a dashboard.
+    """
+    today = localtime(now()).date()
+    data = caching.get_or_set(
+        f'dashboard:{user.pk}:{user.role}:{today.isoformat()}',
+        lambda: build_dashboard(user, today) or {},
+        depends_on=DASHBOARD_CACHE_DEPENDENCIES + [attendance_day_tag(today)],
+    )
+    if not data:
+        return None
+    return dict(data, unread_notifications=notifications.unread_count(user.pk))
@@ -0,0 +1,299 @@
+# main/events.py
+
+"""
+Live events for the server-sent events stream (``main.streams``).
+
+Producers publish on channels: ``user:<id>`` carries the notifications of a
+user, ``class:<id>:attendance`` carries today's attendance changes of a
+class. Every message is a ready-to-send SSE frame, so a message published
+once is written to any number of streams without being encoded again.
+
+The broker comes from ``settings.EVENTS_BACKEND``:
+
+- ``RedisBroker`` publishes through Redis pub/sub. Each worker process holds
+  a single subscriber connection, shared by all of its streams, and it
+  subscribes to a channel only while a local stream listens to it.
+- ``InMemoryBroker`` delivers inside the current process, for tests and
+  local development.
+
+Publishing is best effort: a failure is logged and never breaks the write
+that produced the event.
+"""
+
+import asyncio
+import json
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from django.utils.timezone import localtime, now
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION = 'notification'
+ATTENDANCE = 'attendance'
+
+# Frames buffered per stream; a client that falls further behind loses frames
+STREAM_QUEUE_SIZE = 100
+
+# Delivered to a stream when the broker loses its connection: the stream ends
+# and the client reconnects
+CLOSED = None
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def class_attendance_channel(school_class_id):
+    return f'class:{school_class_id}:attendance'
+
+
+def format_event(event, data):
+    """
+    Returns one SSE frame.
+    """
+    payload = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+class Subscription:
+    """
+    The frames of a set of channels for one stream, queued on the event loop
+    of that stream.
+    """
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = list(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.active = True
+        self.ended = False
+
+    def put(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            logger.warning(f"Event stream of {self.channels} is full, a frame was dropped.")
+
+    def end(self):
+        """
+        Ends the stream after the frames already queued. CLOSED may not fit
+        in a full queue, so the flag makes ``get()`` return it once the
+        queue is drained.
+        """
+        self.ended = True
+        try:
+            self.queue.put_nowait(CLOSED)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout):
+        """
+        Returns the next frame, or raises TimeoutError after ``timeout`` seconds.
+        Returns CLOSED once the stream has ended and its frames were sent.
+        """
+        if self.ended and self.queue.empty():
+            return CLOSED
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        """
+        Unsubscribes from any thread, e.g. when the response is closed.
+        """
+        if self.active:
+            asyncio.run_coroutine_threadsafe(self.broker.unsubscribe(self), self.loop)
+
+
+class InMemoryBroker:
+    """
+    Delivers published frames to the streams of the current process.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+
+    async def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        for channel in subscription.channels:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        if not subscription.active:
+            return
+        subscription.active = False
+        for channel in subscription.channels:
+            listeners = self._subscriptions.get(channel)
+            if listeners is not None:
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._subscriptions[channel]
+
+    def deliver(self, channel, frame):
+        # Producers run in other threads: frames are handed over to the loop of each stream
+        for subscription in list(self._subscriptions.get(channel, ())):
+            subscription.loop.call_soon_threadsafe(subscription.put, frame)
+
+    def publish_many(self, messages):
+        for channel, frame in messages:
+            self.deliver(channel, frame)
+
+
+class RedisBroker(InMemoryBroker):
+    """
+    Publishes on Redis channels ``<prefix>:<channel>``; a single pub/sub
+    connection per process feeds all local streams.
+    """
+
+    def __init__(self, client=None, url=None, prefix='events'):
+        super().__init__()
+        self._client = client
+        self._url = url or getattr(settings, 'EVENTS_REDIS_URL', None)
+        self.prefix = prefix
+        self._pubsub = None
+        # Channels subscribed on the current pub/sub connection
+        self._subscribed = set()
+        self._reader = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self._url, decode_responses=True)
+        return self._client
+
+    def key(self, channel):
+        return f'{self.prefix}:{channel}'
+
+    def connect(self):
+        """
+        Returns a new pub/sub connection.
+        """
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self._url, decode_responses=True)
+        return client.pubsub(ignore_subscribe_messages=True)
+
+    def publish_many(self, messages):
+        pipe = self.client.pipeline(transaction=False)
+        for channel, frame in messages:
+            pipe.publish(self.key(channel), frame)
+        pipe.execute()
+
+    async def subscribe(self, channels):
+        subscription = await super().subscribe(channels)
+        new_channels = [channel for channel in subscription.channels if channel not in self._subscribed]
+        if new_channels:
+            try:
+                if self._pubsub is None:
+                    self._pubsub = self.connect()
+                await self._pubsub.subscribe(*[self.key(channel) for channel in new_channels])
+                self._subscribed.update(new_channels)
+            except Exception:
+                await self.unsubscribe(subscription)
+                raise
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        if not subscription.active:
+            return
+        await super().unsubscribe(subscription)
+        idle = [
+            channel for channel in subscription.channels
+            if channel not in self._subscriptions and channel in self._subscribed
+        ]
+        if idle and self._pubsub is not None:
+            self._subscribed.difference_update(idle)
+            try:
+                await self._pubsub.unsubscribe(*[self.key(channel) for channel in idle])
+            except Exception as e:
+                logger.error(f"Error unsubscribing from events: {e}")
+
+    async def _read(self):
+        offset = len(self.prefix) + 1
+        pubsub = self._pubsub
+        try:
+            while self._subscriptions:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None and message['type'] == 'message':
+                    self.deliver(message['channel'][offset:], message['data'])
+        except Exception as e:
+            logger.error(f"Event subscriber connection lost: {e}")
+            # The streams of the lost connection end and are forgotten at once:
+            # when their clients reconnect, they subscribe on a new connection
+            ended = {subscription for listeners in self._subscriptions.values() for subscription in listeners}
+            self._subscriptions = {}
+            self._subscribed = set()
+            self._pubsub = None
+            self._reader = None
+            for subscription in ended:
+                subscription.active = False
+                subscription.end()
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        finally:
+            if self._reader is asyncio.current_task():
+                self._reader = None
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    path = getattr(settings, 'EVENTS_BACKEND', 'main.events.RedisBroker')
+    return import_string(path)()
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    if setting in ('EVENTS_BACKEND', 'EVENTS_REDIS_URL'):
+        get_broker.cache_clear()
+
+
+def publish_many(messages):
+    """
+    Publishes (channel, event, data) messages in one round trip.
+    """
+    messages = [(channel, format_event(event, data)) for channel, event, data in messages]
+    if not messages:
+        return
+    try:
+        get_broker().publish_many(messages)
+    except Exception as e:
+        logger.error(f"Error publishing {len(messages)} events: {e}")
+
+
+def publish_notifications(notifications):
+    publish_many(
+        (user_channel(notification.user_id), NOTIFICATION, {
+            'id': notification.pk,
+            'message': notification.message,
+            'created_at': notification.created_at,
+            'is_read': notification.is_read,
+        })
+        for notification in notifications
+    )
+
+
+def publish_attendance(records):
+    """
+    Publishes today's records to the teachers of their classes; records of
+    other days are not live data.
+    """
+    today = localtime(now()).date()
+    publish_many(
+        (class_attendance_channel(record.school_class_id), ATTENDANCE, {
+            'student': record.student_id,
+            'school_class': record.school_class_id,
+            'date': record.date,
+            'status': record.status,
+        })
+        for record in records if record.date == today
+    )
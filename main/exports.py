@@ -0,0 +1,135 @@
+# main/exports.py
+
+"""
+Streaming CSV/XLSX exports.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` and written
+out as they arrive, so memory use does not depend on the number of rows.
+CSV is generated chunk by chunk straight into the response. XLSX is written
+by an openpyxl write-only workbook into a temporary file, which is then
+streamed and removed once the response is closed.
+
+Exported text comes from users (names, comments, notes). A value that a
+spreadsheet would evaluate as a formula is neutralized: prefixed with a
+quote in CSV and written as a plain string cell in XLSX.
+"""
+
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+# Rows fetched from the database per round trip
+EXPORT_CHUNK_SIZE = 2000
+
+CSV = 'csv'
+XLSX = 'xlsx'
+FORMATS = [CSV, XLSX]
+
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Leading characters that make Excel and LibreOffice read a cell as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# (values_list lookup, column header)
+GRADE_COLUMNS = [
+    ('date', 'Date'),
+    ('student__username', 'Student'),
+    ('student__last_name', 'Last name'),
+    ('student__first_name', 'First name'),
+    ('subject__name', 'Subject'),
+    ('grade', 'Grade'),
+    ('teacher__username', 'Teacher'),
+    ('comments', 'Comments'),
+]
+
+ATTENDANCE_COLUMNS = [
+    ('date', 'Date'),
+    ('student__username', 'Student'),
+    ('student__last_name', 'Last name'),
+    ('student__first_name', 'First name'),
+    ('school_class__name', 'Class'),
+    ('status', 'Status'),
+    ('notes', 'Notes'),
+]
+
+
+class Echo:
+    """
+    File-like object for csv.writer that returns each line instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def is_formula(value):
+    return isinstance(value, str) and value.startswith(FORMULA_PREFIXES)
+
+
+def escape_csv_value(value):
+    # The quote makes spreadsheets read the cell as text
+    return f"'{value}"
+
+
+def iter_rows(queryset, columns, escape):
+    """
+    Yields the rows of the queryset with ``escape`` applied to every text
+    value a spreadsheet would evaluate as a formula.
+    """
+    lookups = [lookup for lookup, _ in columns]
+    for row in queryset.values_list(*lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        if any(is_formula(value) for value in row):
+            row = [escape(value) if is_formula(value) else value for value in row]
+        yield row
+
+
+def stream_csv(queryset, columns):
+    writer = csv.writer(Echo())
+    # The BOM lets Excel detect UTF-8 (Cyrillic names)
+    yield '\ufeff' + writer.writerow([header for _, header in columns])
+    for row in iter_rows(queryset, columns, escape_csv_value):
+        yield writer.writerow(row)
+
+
+def write_xlsx(queryset, columns, title):
+    """
+    Writes the rows into a temporary XLSX file and returns it rewound.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append([header for _, header in columns])
+
+    def string_cell(value):
+        # openpyxl stores any string starting with "=" as a formula
+        cell = WriteOnlyCell(sheet, value)
+        cell.data_type = 's'
+        return cell
+
+    for row in iter_rows(queryset, columns, string_cell):
+        sheet.append(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def export_response(queryset, columns, file_format, filename):
+    """
+    Returns a streaming response with the queryset rows in the given format.
+    """
+    if file_format == XLSX:
+        output = write_xlsx(queryset, columns, title=filename[:31])
+        return FileResponse(
+            output, as_attachment=True, filename=f'{filename}.xlsx', content_type=CONTENT_TYPES[XLSX],
+        )
+
+    response = StreamingHttpResponse(stream_csv(queryset, columns), content_type=CONTENT_TYPES[CSV])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
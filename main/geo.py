@@ -0,0 +1,202 @@
+# main/geo.py
+
+"""
+Geofencing shared by attendance marking, the attendance serializer and the
+periodic attendance task.
+
+Each school's fence is precomputed once (center in radians, bounding box,
+polygon arrays) and cached per process. A point is accepted or rejected with
+a bounding-box and equirectangular test; only points close to the boundary
+fall back to the exact ellipsoidal ``geodesic`` distance.
+"""
+
+import math
+
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS_M = 6371008.8
+
+# Default fence radius in meters, used when a school has no radius of its own
+DEFAULT_RADIUS_M = 100
+
+# Relative band around the radius where the spherical approximation is not
+# trusted and the exact geodesic distance is computed instead. The sphere
+# deviates from the WGS-84 ellipsoid by well under 1%.
+BOUNDARY_TOLERANCE = 0.01
+
+_fences = {}
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Vectorized haversine distance in meters.
+    Accepts scalars or NumPy arrays of degrees and broadcasts them.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2.0) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class Geofence:
+    """
+    A circular fence around a school, optionally replaced by a polygon.
+    """
+    __slots__ = (
+        'source', 'latitude', 'longitude', 'radius_m',
+        '_lat', '_lon', '_cos_lat', '_max_dlat', '_max_dlon',
+        '_inner_m', '_outer_m', '_polygon', '_poly_bbox',
+    )
+
+    def __init__(self, latitude, longitude, radius_m=None, polygon=None):
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.radius_m = float(radius_m or DEFAULT_RADIUS_M)
+        self.source = (latitude, longitude, radius_m, polygon)
+
+        self._lat = math.radians(self.latitude)
+        self._lon = math.radians(self.longitude)
+        self._cos_lat = math.cos(self._lat)
+
+        # Bounding box in radians, slightly widened so it never rejects a point
+        # the exact test would accept.
+        outer = self.radius_m * (1 + BOUNDARY_TOLERANCE)
+        self._max_dlat = outer / EARTH_RADIUS_M
+        self._max_dlon = self._max_dlat / max(math.cos(abs(self._lat) + self._max_dlat), 1e-12)
+        self._inner_m = self.radius_m * (1 - BOUNDARY_TOLERANCE)
+        self._outer_m = outer
+
+        self._polygon = None
+        self._poly_bbox = None
+        if polygon:
+            vertices = np.asarray(polygon, dtype=float)
+            if vertices.ndim != 2 or vertices.shape[0] < 3 or vertices.shape[1] != 2:
+                raise ValueError("Geofence polygon must be a list of at least three [latitude, longitude] pairs.")
+            self._polygon = (vertices[:, 0], vertices[:, 1])
+            self._poly_bbox = (
+                vertices[:, 0].min(), vertices[:, 0].max(),
+                vertices[:, 1].min(), vertices[:, 1].max(),
+            )
+
+    @classmethod
+    def from_school(cls, school):
+        return cls(
+            school.latitude,
+            school.longitude,
+            radius_m=school.geofence_radius,
+            polygon=school.geofence_polygon,
+        )
+
+    def distance_m(self, latitude, longitude):
+        """
+        Exact ellipsoidal distance from the fence center in meters.
+        """
+        return geodesic((latitude, longitude), (self.latitude, self.longitude)).meters
+
+    def contains(self, latitude, longitude):
+        """
+        Returns True if the point lies inside the fence.
+        """
+        latitude = float(latitude)
+        longitude = float(longitude)
+
+        if self._polygon is not None:
+            return bool(self._contains_polygon(np.array([latitude]), np.array([longitude]))[0])
+
+        dlat = math.radians(latitude) - self._lat
+        dlon = (math.radians(longitude) - self._lon + math.pi) % (2 * math.pi) - math.pi
+        if abs(dlat) > self._max_dlat or abs(dlon) > self._max_dlon:
+            return False
+
+        x = dlon * math.cos(self._lat + dlat / 2)
+        approx = EARTH_RADIUS_M * math.hypot(x, dlat)
+        if approx <= self._inner_m:
+            return True
+        if approx >= self._outer_m:
+            return False
+        return self.distance_m(latitude, longitude) <= self.radius_m
+
+    def contains_many(self, latitudes, longitudes):
+        """
+        Vectorized ``contains`` for arrays of points. Returns a boolean array.
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes, longitudes = np.broadcast_arrays(latitudes, longitudes)
+
+        if self._polygon is not None:
+            return self._contains_polygon(latitudes, longitudes)
+
+        dlat = np.radians(latitudes) - self._lat
+        dlon = (np.radians(longitudes) - self._lon + math.pi) % (2 * math.pi) - math.pi
+        in_box = (np.abs(dlat) <= self._max_dlat) & (np.abs(dlon) <= self._max_dlon)
+
+        x = dlon * np.cos(self._lat + dlat / 2)
+        approx = EARTH_RADIUS_M * np.hypot(x, dlat)
+        result = in_box & (approx <= self._inner_m)
+
+        boundary = np.flatnonzero(in_box & (approx > self._inner_m) & (approx < self._outer_m))
+        for index in boundary:
+            result[index] = self.distance_m(latitudes[index], longitudes[index]) <= self.radius_m
+        return result
+
+    def _contains_polygon(self, latitudes, longitudes):
+        """
+        Even-odd ray casting, treating latitude/longitude as planar coordinates.
+        """
+        min_lat, max_lat, min_lon, max_lon = self._poly_bbox
+        inside = np.zeros(latitudes.shape, dtype=bool)
+        in_box = (
+            (latitudes >= min_lat) & (latitudes <= max_lat)
+            & (longitudes >= min_lon) & (longitudes <= max_lon)
+        )
+        if not in_box.any():
+            return inside
+
+        lats = latitudes[in_box]
+        lons = longitudes[in_box]
+        poly_lat, poly_lon = self._polygon
+        crossings = np.zeros(lats.shape, dtype=bool)
+        previous = len(poly_lat) - 1
+        for current in range(len(poly_lat)):
+            lat_i, lon_i = poly_lat[current], poly_lon[current]
+            lat_j, lon_j = poly_lat[previous], poly_lon[previous]
+            if lat_i != lat_j:
+                straddles = (lat_i > lats) != (lat_j > lats)
+                lon_cross = (lon_j - lon_i) * (lats - lat_i) / (lat_j - lat_i) + lon_i
+                crossings ^= straddles & (lons < lon_cross)
+            previous = current
+
+        inside[in_box] = crossings
+        return inside
+
+
+def get_geofence(school):
+    """
+    Returns the cached geofence for a school, or None if the school has no
+    coordinates. The cache entry is rebuilt whenever the school's fence
+    definition differs from the one it was built from.
+    """
+    if school is None or school.latitude is None or school.longitude is None:
+        return None
+
+    source = (school.latitude, school.longitude, school.geofence_radius, school.geofence_polygon)
+    fence = _fences.get(school.pk)
+    if fence is None or fence.source != source:
+        fence = Geofence.from_school(school)
+        if school.pk is not None:
+            _fences[school.pk] = fence
+    return fence
+
+
+def clear_geofence_cache(school_id=None):
+    """
+    Drops one school's cached geofence, or all of them.
+    """
+    if school_id is None:
+        _fences.clear()
+    else:
+        _fences.pop(school_id, None)
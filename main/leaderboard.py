@@ -0,0 +1,616 @@
+# main/leaderboard.py
+
+"""
+Leaderboards per metric with pluggable storage backends.
+
+Score-changing events (achievements, attendance, grades) recompute the
+affected profile's score from its own rows and hand it to the configured
+backend (``settings.LEADERBOARD_BACKEND``):
+
+- ``DatabaseBackend`` keeps the materialized ``Leaderboard`` table. Ranks are
+  competition ranks (equal scores share a rank) and are maintained
+  incrementally: only rows whose scores lie between the old and the new score
+  are shifted by one. Only the global scope is supported.
+- ``RedisBackend`` keeps one sorted set per metric and scope (global, per
+  school, per class). Top-N, pages and rank-of-user are served with
+  ZREVRANGE/ZREVRANK in O(log n + k).
+- ``InMemoryBackend`` is ``RedisBackend`` over an in-process fake of the
+  sorted-set commands, for tests and local development.
+"""
+
+import bisect
+import logging
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Avg, Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import caching
+from .models import (
+    Attendance, Grade, Leaderboard, SchoolClass, User, UserAchievement, UserProfile
+)
+
+logger = logging.getLogger(__name__)
+
+METRICS = [metric for metric, _ in Leaderboard.METRIC_CHOICES]
+
+GLOBAL = 'global'
+SCHOOL = 'school'
+CLASS = 'class'
+SCOPES = [GLOBAL, SCHOOL, CLASS]
+
+# Default number of entries returned by the leaderboard list
+TOP_SIZE = 100
+
+RankedEntry = namedtuple('RankedEntry', ['user_profile_id', 'score', 'rank'])
+
+
+class UnsupportedScope(ValueError):
+    """
+    Raised when a backend cannot serve the requested scope.
+    """
+
+
+def is_valid_metric(metric):
+    return metric in METRICS
+
+
+def scope_key(scope, scope_id=None):
+    if scope == GLOBAL:
+        return GLOBAL
+    if scope in (SCHOOL, CLASS) and scope_id is not None:
+        return f'{scope}:{scope_id}'
+    raise UnsupportedScope(f"Invalid leaderboard scope: {scope}")
+
+
+def compute_score(metric, user_profile_id, user_id):
+    """
+    Computes one profile's score for a metric with a single aggregate query
+    over that user's rows only.
+    """
+    if metric == Leaderboard.XP:
+        value = UserAchievement.objects.filter(user_profile_id=user_profile_id).aggregate(
+            value=Sum('achievement__xp_reward')
+        )['value']
+    elif metric == Leaderboard.ATTENDANCE:
+        value = Attendance.objects.filter(student_id=user_id, status='present').count()
+    elif metric == Leaderboard.GRADES:
+        value = Grade.objects.filter(student_id=user_id).aggregate(value=Avg('grade'))['value']
+    else:
+        raise ValueError(f"Unknown leaderboard metric: {metric}")
+    return float(value or 0)
+
+
+def _score_annotation(metric):
+    if metric == Leaderboard.XP:
+        return Coalesce(Sum('user_achievements__achievement__xp_reward'), 0)
+    if metric == Leaderboard.ATTENDANCE:
+        return Count('user__attendances', filter=Q(user__attendances__status='present'))
+    if metric == Leaderboard.GRADES:
+        return Avg('user__grades__grade')
+    raise ValueError(f"Unknown leaderboard metric: {metric}")
+
+
+def all_scores(metric):
+    """
+    Returns {user_profile_id: score} for every profile, in one aggregate query.
+    """
+    scores = (
+        UserProfile.objects.annotate(score=_score_annotation(metric))
+        .order_by()
+        .values_list('pk', 'score')
+    )
+    return {pk: float(score or 0) for pk, score in scores}
+
+
+class DatabaseBackend:
+    """
+    Materialized ranks in the ``Leaderboard`` table (global scope only).
+    """
+    # Writes go through the ORM and belong to the caller's transaction
+    transactional = True
+
+    def _check_scope(self, scope):
+        if scope != GLOBAL:
+            raise UnsupportedScope("The database leaderboard backend only supports the global scope.")
+
+    def update(self, metric, user_profile_id, user_id, score):
+        with transaction.atomic():
+            entries = Leaderboard.objects.filter(metric=metric)
+            entry = entries.select_for_update().filter(user_profile_id=user_profile_id).first()
+
+            if entry is None:
+                entries.filter(score__lt=score).update(rank=F('rank') + 1)
+                entry = Leaderboard(user_profile_id=user_profile_id, metric=metric)
+            elif score > entry.score:
+                entries.filter(score__gte=entry.score, score__lt=score).exclude(
+                    pk=entry.pk
+                ).update(rank=F('rank') + 1)
+            elif score < entry.score:
+                entries.filter(score__gte=score, score__lt=entry.score).exclude(
+                    pk=entry.pk
+                ).update(rank=F('rank') - 1)
+            else:
+                return
+
+            entry.score = score
+            entry.rank = entries.filter(score__gt=score).exclude(pk=entry.pk).count() + 1
+            entry.save()
+
+    def rebuild(self, metric, batch_size=1000):
+        ranked = sorted(((score, pk) for pk, score in all_scores(metric).items()), reverse=True)
+
+        entries = []
+        rank = 0
+        previous = None
+        for position, (score, pk) in enumerate(ranked, start=1):
+            if score != previous:
+                rank = position
+                previous = score
+            entries.append(Leaderboard(user_profile_id=pk, metric=metric, score=score, rank=rank))
+
+        with transaction.atomic():
+            Leaderboard.objects.filter(metric=metric).delete()
+            Leaderboard.objects.bulk_create(entries, batch_size=batch_size)
+        return len(entries)
+
+    def _entries(self, metric):
+        return Leaderboard.objects.filter(metric=metric).order_by('rank', 'pk')
+
+    def _ranked(self, entries):
+        return [RankedEntry(pid, score, rank) for pid, score, rank in entries]
+
+    def page(self, metric, scope_key, offset=0, limit=TOP_SIZE):
+        self._check_scope(scope_key)
+        return self._ranked(
+            self._entries(metric).values_list('user_profile_id', 'score', 'rank')[offset:offset + limit]
+        )
+
+    def count(self, metric, scope_key):
+        self._check_scope(scope_key)
+        return Leaderboard.objects.filter(metric=metric).count()
+
+    def around(self, metric, scope_key, user_profile_id, radius=5):
+        self._check_scope(scope_key)
+        entries = Leaderboard.objects.filter(metric=metric)
+        entry = entries.filter(user_profile_id=user_profile_id).first()
+        if entry is None:
+            return None, [], []
+
+        above = self._ranked(
+            entries.filter(Q(rank__lt=entry.rank) | Q(rank=entry.rank, pk__lt=entry.pk))
+            .order_by('-rank', '-pk')
+            .values_list('user_profile_id', 'score', 'rank')[:radius]
+        )
+        above.reverse()
+        below = self._ranked(
+            entries.filter(Q(rank__gt=entry.rank) | Q(rank=entry.rank, pk__gt=entry.pk))
+            .order_by('rank', 'pk')
+            .values_list('user_profile_id', 'score', 'rank')[:radius]
+        )
+        return RankedEntry(entry.user_profile_id, entry.score, entry.rank), above, below
+
+    def update_many(self, metric, entries):
+        for user_profile_id, user_id, score in entries:
+            self.update(metric, user_profile_id, user_id, score)
+
+    def update_class_membership(self, school_class_id, user_ids, added):
+        """
+        Class scopes are not stored by this backend.
+        """
+
+    def update_school(self, user_id, old_school_id, new_school_id):
+        """
+        School scopes are not stored by this backend.
+        """
+
+    def remove(self, user_profile_id):
+        """
+        Deletes a profile's entries and moves every entry ranked below them
+        up by one.
+        """
+        with transaction.atomic():
+            entries = Leaderboard.objects.select_for_update().filter(user_profile_id=user_profile_id)
+            for entry in entries:
+                Leaderboard.objects.filter(metric=entry.metric, score__lt=entry.score).update(rank=F('rank') - 1)
+                entry.delete()
+
+
+class RedisBackend:
+    """
+    One sorted set per metric and scope, keyed ``<prefix>:<metric>:<scope>``.
+    Ranks are positions: equal scores are ordered by member, as in Redis.
+    """
+    # Redis writes cannot be rolled back with the database transaction
+    transactional = False
+
+    def __init__(self, client=None, url=None, prefix='leaderboard'):
+        self._client = client
+        self._url = url or getattr(settings, 'LEADERBOARD_REDIS_URL', None)
+        self.prefix = prefix
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self._url, decode_responses=True)
+        return self._client
+
+    def key(self, metric, scope_key):
+        return f'{self.prefix}:{metric}:{scope_key}'
+
+    def _index_key(self, metric):
+        return f'{self.prefix}:{metric}:scopes'
+
+    def _users_scopes(self, user_ids):
+        """
+        Returns {user_id: [scope keys]} with two queries for any number of users.
+        """
+        scopes = {user_id: [GLOBAL] for user_id in user_ids}
+        for user_id, school_id in User.objects.filter(pk__in=scopes).values_list('pk', 'school_id'):
+            if school_id is not None:
+                scopes[user_id].append(scope_key(SCHOOL, school_id))
+        memberships = SchoolClass.students.through.objects.filter(user_id__in=scopes).values_list(
+            'user_id', 'schoolclass_id'
+        )
+        for user_id, class_id in memberships:
+            scopes[user_id].append(scope_key(CLASS, class_id))
+        return scopes
+
+    def update(self, metric, user_profile_id, user_id, score):
+        self.update_many(metric, [(user_profile_id, user_id, score)])
+
+    def update_many(self, metric, entries):
+        """
+        Stores (user_profile_id, user_id, score) entries in one pipeline.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        scopes = self._users_scopes({user_id for _, user_id, _ in entries})
+        keys = set()
+        pipe = self.client.pipeline()
+        for user_profile_id, user_id, score in entries:
+            for scope in scopes[user_id]:
+                key = self.key(metric, scope)
+                pipe.zadd(key, {str(user_profile_id): score})
+                keys.add(key)
+        pipe.sadd(self._index_key(metric), *keys)
+        pipe.execute()
+
+    def rebuild(self, metric, batch_size=1000):
+        scores = all_scores(metric)
+        profile_users = dict(UserProfile.objects.values_list('pk', 'user_id'))
+        user_schools = dict(
+            User.objects.filter(school__isnull=False).values_list('pk', 'school_id')
+        )
+        user_profiles = {user_id: pk for pk, user_id in profile_users.items()}
+
+        sets = {self.key(metric, GLOBAL): {str(pk): score for pk, score in scores.items()}}
+        for pk, score in scores.items():
+            school_id = user_schools.get(profile_users.get(pk))
+            if school_id is not None:
+                sets.setdefault(self.key(metric, scope_key(SCHOOL, school_id)), {})[str(pk)] = score
+        memberships = SchoolClass.students.through.objects.values_list('schoolclass_id', 'user_id')
+        for class_id, user_id in memberships:
+            pk = user_profiles.get(user_id)
+            if pk in scores:
+                sets.setdefault(self.key(metric, scope_key(CLASS, class_id)), {})[str(pk)] = scores[pk]
+
+        index_key = self._index_key(metric)
+        stale = set(self.client.smembers(index_key)) - set(sets)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(index_key, *stale, *sets)
+        for key, mapping in sets.items():
+            items = list(mapping.items())
+            for start in range(0, len(items), batch_size):
+                pipe.zadd(key, dict(items[start:start + batch_size]))
+        if sets:
+            pipe.sadd(index_key, *sets)
+        pipe.execute()
+        return len(scores)
+
+    def _ranked(self, rows, first_rank):
+        return [
+            RankedEntry(int(member), float(score), first_rank + index)
+            for index, (member, score) in enumerate(rows)
+        ]
+
+    def page(self, metric, scope_key, offset=0, limit=TOP_SIZE):
+        if limit <= 0:
+            return []
+        rows = self.client.zrevrange(self.key(metric, scope_key), offset, offset + limit - 1, withscores=True)
+        return self._ranked(rows, offset + 1)
+
+    def count(self, metric, scope_key):
+        return self.client.zcard(self.key(metric, scope_key))
+
+    def around(self, metric, scope_key, user_profile_id, radius=5):
+        key = self.key(metric, scope_key)
+        position = self.client.zrevrank(key, str(user_profile_id))
+        if position is None:
+            return None, [], []
+
+        start = max(position - radius, 0)
+        rows = self.client.zrevrange(key, start, position + radius, withscores=True)
+        ranked = self._ranked(rows, start + 1)
+        index = position - start
+        return ranked[index], ranked[:index], ranked[index + 1:]
+
+    def update_class_membership(self, school_class_id, user_ids, added):
+        """
+        Adds students to, or removes them from, every class-scoped sorted set.
+        """
+        profile_ids = [
+            str(pk) for pk in UserProfile.objects.filter(user_id__in=user_ids).values_list('pk', flat=True)
+        ]
+        if not profile_ids:
+            return
+        for metric in METRICS:
+            key = self.key(metric, scope_key(CLASS, school_class_id))
+            if not added:
+                self.client.zrem(key, *profile_ids)
+                continue
+            global_key = self.key(metric, GLOBAL)
+            pipe = self.client.pipeline()
+            for member in profile_ids:
+                pipe.zscore(global_key, member)
+            scores = pipe.execute()
+            mapping = {member: score for member, score in zip(profile_ids, scores) if score is not None}
+            if mapping:
+                pipe = self.client.pipeline()
+                pipe.zadd(key, mapping)
+                pipe.sadd(self._index_key(metric), key)
+                pipe.execute()
+
+    def update_school(self, user_id, old_school_id, new_school_id):
+        """
+        Moves a user's profiles from the sorted sets of their old school to
+        those of their new one, with the scores of the global sets.
+        """
+        profile_ids = [
+            str(pk) for pk in UserProfile.objects.filter(user_id=user_id).values_list('pk', flat=True)
+        ]
+        if not profile_ids:
+            return
+        for metric in METRICS:
+            global_key = self.key(metric, GLOBAL)
+            pipe = self.client.pipeline()
+            for member in profile_ids:
+                pipe.zscore(global_key, member)
+            scores = pipe.execute()
+            mapping = {member: score for member, score in zip(profile_ids, scores) if score is not None}
+
+            pipe = self.client.pipeline()
+            if old_school_id is not None:
+                pipe.zrem(self.key(metric, scope_key(SCHOOL, old_school_id)), *profile_ids)
+            if new_school_id is not None and mapping:
+                key = self.key(metric, scope_key(SCHOOL, new_school_id))
+                pipe.zadd(key, mapping)
+                pipe.sadd(self._index_key(metric), key)
+            pipe.execute()
+
+    def remove(self, user_profile_id):
+        """
+        Removes a profile from every sorted set of every metric.
+        """
+        member = str(user_profile_id)
+        for metric in METRICS:
+            keys = self.client.smembers(self._index_key(metric))
+            if not keys:
+                continue
+            pipe = self.client.pipeline()
+            for key in keys:
+                pipe.zrem(key, member)
+            pipe.execute()
+
+
+class InMemorySortedSets:
+    """
+    In-process stand-in for the subset of Redis commands used by RedisBackend.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._zsets = {}
+        self._sets = {}
+
+    def _zset(self, name):
+        return self._zsets.setdefault(name, ({}, []))
+
+    def pipeline(self, transaction=False):
+        return _InMemoryPipeline(self)
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            scores, ordered = self._zset(name)
+            added = 0
+            for member, score in mapping.items():
+                score = float(score)
+                if member in scores:
+                    ordered.remove((scores[member], member))
+                else:
+                    added += 1
+                scores[member] = score
+                bisect.insort(ordered, (score, member))
+            return added
+
+    def zrem(self, name, *members):
+        with self._lock:
+            scores, ordered = self._zset(name)
+            removed = 0
+            for member in members:
+                if member in scores:
+                    ordered.remove((scores.pop(member), member))
+                    removed += 1
+            return removed
+
+    def zscore(self, name, member):
+        with self._lock:
+            return self._zset(name)[0].get(member)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._zset(name)[0])
+
+    def zrevrank(self, name, member):
+        with self._lock:
+            scores, ordered = self._zset(name)
+            if member not in scores:
+                return None
+            return len(ordered) - 1 - bisect.bisect_left(ordered, (scores[member], member))
+
+    def zrevrange(self, name, start, end, withscores=False):
+        with self._lock:
+            ordered = self._zset(name)[1]
+            size = len(ordered)
+            if end < 0:
+                end += size
+            rows = [ordered[size - 1 - index] for index in range(max(start, 0), min(end, size - 1) + 1)]
+        if withscores:
+            return [(member, score) for score, member in rows]
+        return [member for _, member in rows]
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                removed += (self._zsets.pop(name, None) is not None) + (self._sets.pop(name, None) is not None)
+            return removed
+
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._sets.setdefault(name, set())
+            before = len(members)
+            members.update(values)
+            return len(members) - before
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._sets.get(name, ()))
+
+    def flushall(self):
+        with self._lock:
+            self._zsets.clear()
+            self._sets.clear()
+
+
+class _InMemoryPipeline:
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            commands, self._commands = self._commands, []
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class InMemoryBackend(RedisBackend):
+    """
+    RedisBackend over an in-process fake; state is lost on restart.
+    """
+
+    def __init__(self, client=None, prefix='leaderboard'):
+        super().__init__(client=client or InMemorySortedSets(), prefix=prefix)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, 'LEADERBOARD_BACKEND', 'main.leaderboard.DatabaseBackend')
+    return import_string(path)()
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    if setting in ('LEADERBOARD_BACKEND', 'LEADERBOARD_REDIS_URL'):
+        get_backend.cache_clear()
+
+
+def refresh_entry(metric, user_profile_id, user_id):
+    """
+    Recomputes one profile's score and stores it in the active backend.
+    """
+    score = compute_score(metric, user_profile_id, user_id)
+    get_backend().update(metric, user_profile_id, user_id, score)
+    caching.bump(Leaderboard)
+    return score
+
+
+def refresh_for_user(metric, user_id):
+    """
+    Refreshes the entry of the profile that belongs to ``user_id``.
+    """
+    user_profile_id = UserProfile.objects.filter(user_id=user_id).values_list('pk', flat=True).first()
+    if user_profile_id is None:
+        return None
+    return refresh_entry(metric, user_profile_id, user_id)
+
+
+def refresh_for_profile(metric, user_profile_id):
+    """
+    Refreshes the entry of the profile with ``user_profile_id``.
+    """
+    user_id = UserProfile.objects.filter(pk=user_profile_id).values_list('user_id', flat=True).first()
+    if user_id is None:
+        return None
+    return refresh_entry(metric, user_profile_id, user_id)
+
+
+def refresh_for_users(metric, user_ids):
+    """
+    Refreshes the entries of several users after a bulk write: the scores
+    of all of their profiles are computed with one aggregate query.
+    """
+    rows = (
+        UserProfile.objects.filter(user_id__in=set(user_ids))
+        .annotate(score=_score_annotation(metric))
+        .order_by()
+        .values_list('pk', 'user_id', 'score')
+    )
+    entries = [(user_profile_id, user_id, float(score or 0)) for user_profile_id, user_id, score in rows]
+    get_backend().update_many(metric, entries)
+    if entries:
+        caching.bump(Leaderboard)
+    return len(entries)
+
+
+def remove_profile(user_profile_id):
+    """
+    Removes a deleted profile from every leaderboard.
+    """
+    get_backend().remove(user_profile_id)
+    caching.bump(Leaderboard)
+
+
+def move_school(user_id, old_school_id, new_school_id):
+    """
+    Moves a user's entries to the school-scoped leaderboards of their new school.
+    """
+    get_backend().update_school(user_id, old_school_id, new_school_id)
+    caching.bump(Leaderboard)
+
+
+def rebuild(metric):
+    """
+    Recomputes every score and rank of a metric from scratch.
+    """
+    count = get_backend().rebuild(metric)
+    caching.bump(Leaderboard)
+    logger.info(f"Leaderboard '{metric}' rebuilt with {count} entries.")
+    return count
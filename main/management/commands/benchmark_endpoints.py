@@ -0,0 +1,171 @@
+# main/management/commands/benchmark_endpoints.py
+
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+# Read endpoints with an async variant under async/, relative to the API root
+ENDPOINTS = [
+    ('me', 'me/'),
+    ('schedules', 'schedules/'),
+    ('homeworks', 'homeworks/'),
+    ('attendances/today', 'attendances/today/'),
+    ('leaderboard', 'leaderboard/'),
+]
+
+# Resident memory of the server processes is sampled this often, in seconds
+MEMORY_SAMPLE_INTERVAL = 0.1
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class MemorySampler(threading.Thread):
+    """
+    Records the peak total resident memory of the given processes.
+    """
+
+    def __init__(self, pids):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.peak_kb = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak_kb = max(self.peak_kb, sum(_rss_kb(pid) for pid in self.pids))
+            self.stopped.wait(MEMORY_SAMPLE_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark requests per second and latency of the sync read endpoints against their '
+        'async variants on a running server. Start the server with the same workers for both '
+        'paths (e.g. the Procfile command) and raise the user throttle rate, otherwise most '
+        'requests are answered with 429.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api/', help='API root of the server.')
+        parser.add_argument('--token', help='Token to authenticate with.')
+        parser.add_argument('--username', help='Use (or create) the token of this user instead of --token.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent connections.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and path.')
+        parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests before each run.')
+        parser.add_argument('--pid', type=int, action='append', default=[],
+                            help='Server process to sample resident memory of; repeat for every worker.')
+        parser.add_argument('--endpoint', action='append', choices=[name for name, _ in ENDPOINTS],
+                            help='Only benchmark these endpoints.')
+
+    def handle(self, *args, **options):
+        token = options['token']
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['username']}' does not exist.")
+            token = Token.objects.get_or_create(user=user)[0].key
+        if not token:
+            raise CommandError('Pass --token or --username.')
+
+        base = urlsplit(options['base_url'])
+        if base.scheme not in ('http', 'https'):
+            raise CommandError('--base-url must be an http(s) URL.')
+        self.base = base
+        self.headers = {'Authorization': f'Token {token}', 'Accept': 'application/json'}
+        root = base.path if base.path.endswith('/') else f'{base.path}/'
+        selected = options['endpoint'] or [name for name, _ in ENDPOINTS]
+
+        self.stdout.write(
+            f"{options['requests']} requests per run, {options['concurrency']} connections, "
+            f"server memory sampled for {len(options['pid'])} processes"
+        )
+        self.stdout.write(
+            f"{'endpoint':<20} {'path':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak RSS MB':>12}"
+        )
+        for name, path in ENDPOINTS:
+            if name not in selected:
+                continue
+            for label, url in (('sync', f'{root}{path}'), ('async', f'{root}async/{path}')):
+                self.run(url, options['warmup'], options['concurrency'])
+                sampler = MemorySampler(options['pid'])
+                sampler.start()
+                seconds, latencies, errors = self.run(url, options['requests'], options['concurrency'])
+                sampler.stop()
+
+                rate = len(latencies) / seconds if seconds else float('inf')
+                p50, p99 = self.percentiles(latencies)
+                memory = f'{sampler.peak_kb / 1024:12.1f}' if options['pid'] else f"{'-':>12}"
+                line = f'{name:<20} {label:<6} {rate:9,.0f} {p50:9.1f} {p99:9.1f} {errors:7d} {memory}'
+                self.stdout.write(self.style.ERROR(line) if errors else line)
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.base.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.base.hostname, self.base.port, timeout=30)
+
+    def run(self, url, requests, concurrency):
+        """
+        Sends ``requests`` GETs over ``concurrency`` keep-alive connections.
+        Returns (seconds, latencies of successful requests in ms, failed requests).
+        """
+        counter = iter(range(requests))
+        lock = threading.Lock()
+
+        def worker():
+            latencies, errors = [], 0
+            connection = self.connect()
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        break
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', url, headers=self.headers)
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = self.connect()
+                    ok = False
+                if ok:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+            connection.close()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: worker(), range(concurrency)))
+        seconds = time.perf_counter() - started
+        latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+        return seconds, latencies, sum(errors for _, errors in results)
+
+    def percentiles(self, latencies):
+        if len(latencies) < 2:
+            value = latencies[0] if latencies else 0.0
+            return value, value
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        return cuts[49], cuts[98]
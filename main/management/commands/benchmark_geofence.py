@@ -0,0 +1,64 @@
+# main/management/commands/benchmark_geofence.py
+
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from main.geo import get_geofence
+from main.models import School
+
+
+class Command(BaseCommand):
+    help = 'Benchmark geofence checks per second: per-call geodesic versus the cached geofence engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=100000, help='Number of points to check.')
+        parser.add_argument('--spread', type=float, default=300.0, help='Points are scattered up to this many meters from the school.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        checks = options['checks']
+        rng = np.random.default_rng(options['seed'])
+
+        # An unsaved school: the benchmark does not touch the database
+        school = School(latitude=Decimal('42.874600'), longitude=Decimal('74.612200'), geofence_radius=100)
+        spread_deg = options['spread'] / 111320.0
+        latitudes = 42.8746 + rng.uniform(-spread_deg, spread_deg, checks)
+        longitudes = 74.6122 + rng.uniform(-spread_deg, spread_deg, checks) / np.cos(np.radians(42.8746))
+        points = list(zip(latitudes.tolist(), longitudes.tolist()))
+
+        # Previous path: convert the school's Decimals and run geodesic for every check
+        started = time.perf_counter()
+        baseline = [
+            geodesic((lat, lon), (float(school.latitude), float(school.longitude))).kilometers <= 0.1
+            for lat, lon in points
+        ]
+        baseline_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        scalar = [get_geofence(school).contains(lat, lon) for lat, lon in points]
+        scalar_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        vectorized = get_geofence(school).contains_many(latitudes, longitudes)
+        vectorized_seconds = time.perf_counter() - started
+
+        mismatches = sum(a != b for a, b in zip(baseline, scalar))
+        mismatches += int(np.count_nonzero(np.array(baseline) != vectorized))
+
+        self.stdout.write(f'Checks: {checks}, inside: {sum(baseline)}')
+        for label, seconds in (
+            ('geodesic per check', baseline_seconds),
+            ('geofence.contains', scalar_seconds),
+            ('geofence.contains_many', vectorized_seconds),
+        ):
+            rate = checks / seconds if seconds else float('inf')
+            self.stdout.write(f'{label:<24} {seconds:8.3f} s  {rate:14,.0f} checks/s')
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f'{mismatches} results differ from the geodesic baseline.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All results match the geodesic baseline.'))
@@ -0,0 +1,106 @@
+# main/management/commands/check_query_plans.py
+
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from main.urls import router
+
+User = get_user_model()
+
+# Router basenames whose list query is filtered by the requesting user's role
+ROLE_FILTERED_ENDPOINTS = [
+    'class', 'schedule', 'homework', 'submitted_homework', 'grade', 'attendance', 'notification',
+]
+
+# Plan lines that mean a table is read in full
+SEQUENTIAL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\S+)'),
+    # SQLite reports "SCAN table" without "USING INDEX" for a full table scan
+    'sqlite': re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN on every role's list query of the role-filtered endpoints "
+        "and fail if any of them falls back to a sequential scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teacher', help='Username of the teacher to check (default: the first teacher).')
+        parser.add_argument('--student', help='Username of the student to check (default: the first student).')
+        parser.add_argument('--parent', help='Username of the parent to check (default: the first parent).')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only the failing ones.')
+
+    def get_user(self, role, username):
+        users = User.objects.filter(role=role)
+        if username:
+            users = users.filter(username=username)
+        return users.order_by('pk').first()
+
+    def build_queries(self, viewset_class, prefix, user):
+        """
+        Yields (label, queryset) for the first page of the endpoint as the user sees it.
+        """
+        request = APIRequestFactory().get(f'/api/{prefix}/')
+        force_authenticate(request, user=user)
+        view = viewset_class(action_map={'get': 'list'}, format_kwarg=None, args=(), kwargs={})
+        view.request = view.initialize_request(request)
+        view.action = 'list'
+
+        queryset = view.filter_queryset(view.get_queryset())
+        page_size = getattr(view.pagination_class, 'page_size', None) or 10
+        yield 'page', queryset[:page_size]
+
+        keyset_ordering = getattr(view, 'keyset_ordering', None)
+        if keyset_ordering:
+            yield 'cursor', queryset.order_by(*keyset_ordering)[:page_size]
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Penalize sequential scans so that the plan does not depend on
+            # table sizes: a Seq Scan that remains means no index is usable.
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                return queryset.explain()
+        return queryset.explain()
+
+    def handle(self, *args, **options):
+        pattern = SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"Query plans are not supported for the '{connection.vendor}' database.")
+
+        viewsets = {basename: (prefix, viewset) for prefix, viewset, basename in router.registry}
+        failures = []
+        checked = 0
+
+        for role in (User.TEACHER, User.STUDENT, User.PARENT):
+            user = self.get_user(role, options[role])
+            if user is None:
+                self.stdout.write(self.style.WARNING(f'No {role} found, skipping the role.'))
+                continue
+
+            for basename in ROLE_FILTERED_ENDPOINTS:
+                prefix, viewset_class = viewsets[basename]
+                for label, queryset in self.build_queries(viewset_class, prefix, user):
+                    plan = self.explain(queryset)
+                    scans = pattern.findall(plan)
+                    checked += 1
+                    name = f'{role:<8} {prefix} ({label})'
+                    if scans:
+                        failures.append(name)
+                        self.stdout.write(self.style.ERROR(f'SEQ SCAN  {name}: {", ".join(sorted(set(scans)))}'))
+                        self.stdout.write(plan)
+                    else:
+                        self.stdout.write(f'ok        {name}')
+                        if options['verbose_plans']:
+                            self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f'{len(failures)} of {checked} list queries use a sequential scan.')
+        self.stdout.write(self.style.SUCCESS(f'All {checked} list queries use indexes.'))
@@ -0,0 +1,525 @@
+# main/management/commands/import_roster.py
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from main import leaderboard
+from main.authentication import evict_user_tokens
+from main.models import User, School, SchoolClass, UserProfile, ParentChild
+from main.profiles import ensure_profiles
+from main.roster import RosterError, read_roster, full_name_of, generate_numeric_password
+from main.signals import bulk_write
+
+# Below this many passwords hashing in the current process is faster than starting a pool
+POOL_THRESHOLD = 64
+
+# Rows of each kind listed by --dry-run without -v 2
+DRY_RUN_SAMPLE = 20
+
+# (SchoolClass many-to-many field, role of its members)
+MEMBERSHIPS = [('students', User.STUDENT), ('teachers', User.TEACHER)]
+
+
+def hash_password(password):
+    return make_password(password)
+
+
+class RosterPlan:
+    """
+    The delta between a roster and the database. Users and classes are
+    referred to by username and class name, so that a plan can be built and
+    printed before any of them exists.
+    """
+
+    def __init__(self, create):
+        self.create = create
+        self.class_names = set()
+        self.missing_classes = []
+        self.unlisted_classes = []
+        self.known_usernames = set()
+        self.renames = []         # [(entry, old full name)]
+        self.moves = {}           # {username: (old class name, new class name)}
+        self.add_members = {}     # {field: [(class name, username)]}
+        self.remove_members = {}  # {field: {(class name, username): (row id, class id, user id)}}
+        self.add_parents = []     # [(parent username, child username, class name)]
+        self.remove_parents = {}  # {(parent username, child username, class name): row id}
+        self.errors = []
+
+    @property
+    def size(self):
+        return (
+            len(self.create) + len(self.missing_classes) + len(self.renames) + len(self.moves)
+            + sum(len(rows) for rows in self.add_members.values())
+            + sum(len(rows) for rows in self.remove_members.values())
+            + len(self.add_parents) + len(self.remove_parents)
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Import students, teachers and parents with their classes and parent links '
+        'from a CSV or XLSX roster. With --reconcile only the difference to the '
+        'current state is written; --dry-run prints it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the roster (.csv or .xlsx).')
+        parser.add_argument('--school', default='Default School', help='Name of the school of the roster.')
+        parser.add_argument('--sheet', help='XLSX sheet name (default: the active sheet).')
+        parser.add_argument('--credentials', default='students_credentials.txt',
+                            help='File the credentials of created users are written to.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used to hash passwords (1 hashes in this process).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT.')
+        parser.add_argument('--start-username', type=int, default=1001,
+                            help='First numeric username tried for rows without a username.')
+        parser.add_argument('--reconcile', action='store_true',
+                            help='Treat the roster as the whole school: also remove class memberships and '
+                                 'parent links missing from it, rename users and move students. '
+                                 'Users and classes are never deleted.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the changes without writing anything.')
+
+    def report(self, label, count, started):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else float('inf')
+        self.stdout.write(f'{label:<28} {count:>8}  {elapsed:8.2f} s  {rate:12,.0f} rows/s')
+
+    def get_or_create_school(self, name):
+        school, created = School.objects.get_or_create(name=name)
+        if created:
+            self.stdout.write(self.style.SUCCESS(f'Created school: {name}'))
+        return school
+
+    def assign_usernames(self, entries, school, start_username):
+        """
+        Returns (new entries, existing entries, errors). A row without a username
+        is matched to an existing user of the school (any school-less user for
+        parents) with the same role and name,
+        otherwise it gets the next free numeric username. All existing usernames
+        are loaded once.
+        """
+        taken = set(User.objects.values_list('username', flat=True))
+        by_name = {}
+        # Parents have no school, so they are matched among all school-less parents
+        condition = Q(role=User.PARENT, school__isnull=True)
+        if school is not None:
+            condition |= Q(school=school)
+        candidates = User.objects.filter(condition)
+        for username, role, first_name, last_name in candidates.values_list(
+            'username', 'role', 'first_name', 'last_name'
+        ):
+            key = (role, last_name, first_name)
+            # Namesakes are ambiguous: such rows are imported as new users
+            by_name[key] = None if key in by_name else username
+        seen = set()
+        next_username = start_username
+        new_entries, existing_entries, errors = [], [], []
+
+        for entry in entries:
+            if entry.username:
+                if entry.username in seen:
+                    errors.append((entry.line, f"Duplicate username '{entry.username}'."))
+                    continue
+                seen.add(entry.username)
+                if entry.username in taken:
+                    existing_entries.append(entry)
+                else:
+                    new_entries.append(entry)
+                continue
+
+            username = by_name.get((entry.role, entry.last_name, entry.first_name))
+            if username is not None and username not in seen:
+                seen.add(username)
+                existing_entries.append(entry._replace(username=username))
+                continue
+
+            while str(next_username) in taken or str(next_username) in seen:
+                next_username += 1
+            username = str(next_username)
+            seen.add(username)
+            new_entries.append(entry._replace(username=username))
+
+        return new_entries, existing_entries, errors
+
+    def hash_passwords(self, passwords, workers):
+        started = time.perf_counter()
+        if workers <= 1 or len(passwords) < POOL_THRESHOLD:
+            hashed = [hash_password(password) for password in passwords]
+        else:
+            hashed = []
+            step = max(len(passwords) // 10, 1)
+            chunksize = max(len(passwords) // (workers * 4), 1)
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+                for index, value in enumerate(executor.map(hash_password, passwords, chunksize=chunksize), start=1):
+                    hashed.append(value)
+                    if index % step == 0 and index < len(passwords):
+                        self.stdout.write(f'  hashed {index}/{len(passwords)}')
+        self.report('Passwords hashed', len(passwords), started)
+        return hashed
+
+    def ensure_classes(self, school, names, batch_size):
+        """
+        Returns {class name: id} for the school, creating the missing classes in bulk.
+        """
+        classes = dict(
+            SchoolClass.objects.filter(school=school, name__in=names).values_list('name', 'pk')
+        )
+        missing = [SchoolClass(name=name, school=school) for name in sorted(set(names) - set(classes))]
+        for school_class in SchoolClass.objects.bulk_create(missing, batch_size=batch_size):
+            classes[school_class.name] = school_class.pk
+        return classes, len(missing)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        reconcile = options['reconcile']
+
+        try:
+            entries, errors = read_roster(options['path'], options['sheet'])
+        except (OSError, RosterError) as e:
+            raise CommandError(f'Cannot read roster: {e}')
+        self.report('Rows read', len(entries), started)
+
+        if options['dry_run']:
+            # Nothing is written, so not even a missing school is created
+            school = School.objects.filter(name=options['school']).first()
+            if school is None:
+                self.stdout.write(f"School '{options['school']}' would be created.")
+        else:
+            school = self.get_or_create_school(options['school'])
+
+        new_entries, existing_entries, username_errors = self.assign_usernames(
+            entries, school, options['start_username']
+        )
+        errors.extend(username_errors)
+        if existing_entries and not reconcile:
+            self.stdout.write(f'{len(existing_entries)} users already exist; only their links are imported.')
+
+        stage = time.perf_counter()
+        plan = self.build_plan(new_entries, existing_entries, school, reconcile)
+        errors.extend(plan.errors)
+        self.report('Changes planned', plan.size, stage)
+        for line, message in sorted(errors):
+            self.stderr.write(self.style.ERROR(f'Line {line}: {message}'))
+
+        if options['dry_run']:
+            self.print_plan(plan, reconcile, options['verbosity'])
+            return
+
+        passwords = [entry.password or generate_numeric_password() for entry in plan.create]
+        hashed = self.hash_passwords(passwords, options['workers'])
+        users, class_changes = self.apply_plan(plan, school, hashed, batch_size)
+        self.sync_leaderboards(users, class_changes)
+        self.write_credentials(options['credentials'], plan.create, passwords)
+
+        elapsed = time.perf_counter() - started
+        rate = len(users) / elapsed if elapsed else float('inf')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {len(users)} users ({len(errors)} rows rejected) in {elapsed:.2f} s, {rate:,.0f} users/s.'
+        ))
+        if reconcile:
+            removed = sum(len(rows) for rows in plan.remove_members.values()) + len(plan.remove_parents)
+            self.stdout.write(self.style.SUCCESS(
+                f'Reconciled: {len(plan.renames)} renamed, {len(plan.moves)} moved, {removed} links removed.'
+            ))
+
+    def build_plan(self, new_entries, existing_entries, school, reconcile):
+        """
+        Diffs the roster against the school's classes, memberships and parent
+        links. Without ``reconcile`` only additions are planned.
+        """
+        plan = RosterPlan(new_entries)
+        roster = new_entries + existing_entries
+        school_classes = set()
+        if school is not None:
+            school_classes = set(SchoolClass.objects.filter(school=school).values_list('name', flat=True))
+        plan.class_names = {name for entry in roster for name in entry.classes}
+        plan.missing_classes = sorted(plan.class_names - school_classes)
+        plan.unlisted_classes = sorted(school_classes - plan.class_names)
+
+        existing = {entry.username: entry for entry in existing_entries}
+        plan.known_usernames = set(existing)
+        if reconcile and existing:
+            self.plan_renames(plan, existing, school)
+
+        for field, role in MEMBERSHIPS:
+            desired = {(name, entry.username) for entry in roster if entry.role == role for name in entry.classes}
+            current = self.current_memberships(field, school)
+            plan.add_members[field] = sorted(desired - current.keys())
+            if reconcile:
+                plan.remove_members[field] = {key: row for key, row in current.items() if key not in desired}
+
+        desired = self.desired_parent_links(plan, roster, school)
+        plan.class_names |= {class_name for _, _, class_name in desired}
+        current = {}
+        if school is not None:
+            rows = ParentChild.objects.filter(school_class__school=school).values_list(
+                'pk', 'parent__username', 'child__username', 'school_class__name'
+            )
+            current = {(parent, child, class_name): pk for pk, parent, child, class_name in rows}
+        plan.add_parents = sorted(desired - current.keys())
+        if reconcile:
+            plan.remove_parents = {key: pk for key, pk in current.items() if key not in desired}
+        return plan
+
+    def plan_renames(self, plan, existing, school):
+        """
+        Finds existing users whose name differs from the roster and students
+        whose profile class is none of their roster classes.
+        """
+        rows = User.objects.filter(username__in=list(existing)).values_list('username', 'first_name', 'last_name')
+        for username, first_name, last_name in rows:
+            entry = existing[username]
+            if (entry.first_name, entry.last_name) != (first_name, last_name):
+                plan.renames.append((entry, f'{last_name} {first_name}'.strip()))
+        plan.renames.sort(key=lambda rename: rename[0].line)
+
+        students = [username for username, entry in existing.items() if entry.role == User.STUDENT and entry.classes]
+        school_id = school.pk if school is not None else None
+        profiles = UserProfile.objects.filter(user__username__in=students).values_list(
+            'user__username', 'school_class__name', 'school_class__school_id'
+        )
+        for username, class_name, class_school_id in profiles:
+            classes = existing[username].classes
+            if class_school_id != school_id or class_name not in classes:
+                plan.moves[username] = (class_name, classes[0])
+
+    def current_memberships(self, field, school):
+        """
+        Returns {(class name, username): (row id, class id, user id)} of a class
+        membership table for the school.
+        """
+        if school is None:
+            return {}
+        through = getattr(SchoolClass, field).through
+        rows = through.objects.filter(schoolclass__school=school).values_list(
+            'schoolclass__name', 'user__username', 'pk', 'schoolclass_id', 'user_id'
+        )
+        return {(class_name, username): (pk, class_id, user_id) for class_name, username, pk, class_id, user_id in rows}
+
+    def desired_parent_links(self, plan, roster, school):
+        """
+        Returns {(parent username, child username, class name)}: a parent is linked
+        to the child in every class of the child. Children are referenced by
+        username or by full name within the roster.
+        """
+        students_by_name = {full_name_of(entry): entry for entry in roster if entry.role == User.STUDENT}
+        students_by_username = {entry.username: entry for entry in roster if entry.role == User.STUDENT}
+
+        references = {
+            reference for entry in roster if entry.role == User.PARENT for reference in entry.children
+            if reference not in students_by_username and reference not in students_by_name
+        }
+        # Classes of children that are not in the roster are looked up in the database once
+        outside_classes = {}
+        if references and school is not None:
+            memberships = SchoolClass.students.through.objects.filter(
+                user__username__in=references, user__role=User.STUDENT, schoolclass__school=school,
+            ).values_list('user__username', 'schoolclass__name')
+            for username, class_name in memberships:
+                outside_classes.setdefault(username, []).append(class_name)
+        plan.known_usernames |= set(outside_classes)
+
+        links = set()
+        for entry in roster:
+            if entry.role != User.PARENT:
+                continue
+            for reference in entry.children:
+                child = students_by_username.get(reference) or students_by_name.get(reference)
+                if child is not None:
+                    username, class_names = child.username, child.classes
+                elif reference in outside_classes:
+                    username, class_names = reference, outside_classes[reference]
+                else:
+                    plan.errors.append((entry.line, f"Unknown child '{reference}'."))
+                    continue
+                if not class_names:
+                    plan.errors.append((entry.line, f"Child '{reference}' has no class."))
+                    continue
+                links.update((entry.username, username, class_name) for class_name in class_names)
+        return links
+
+    def apply_plan(self, plan, school, hashed, batch_size):
+        """
+        Writes the planned delta in one transaction with batched statements.
+        Returns the created users and {class id: (added, removed)} student ids.
+        """
+        class_changes = {}
+        with transaction.atomic():
+            stage = time.perf_counter()
+            classes, classes_created = self.ensure_classes(school, plan.class_names, batch_size)
+            self.report('Classes created', classes_created, stage)
+
+            stage = time.perf_counter()
+            users = User.objects.bulk_create([
+                User(
+                    username=entry.username,
+                    password=password,
+                    first_name=entry.first_name,
+                    last_name=entry.last_name,
+                    email=entry.email or f'{entry.username}@example.com',
+                    role=entry.role,
+                    school=school if entry.role != User.PARENT else None,
+                )
+                for entry, password in zip(plan.create, hashed)
+            ], batch_size=batch_size)
+            self.report('Users created', len(users), stage)
+
+            user_ids = {user.username: user.pk for user in users}
+            if plan.known_usernames:
+                user_ids.update(
+                    User.objects.filter(username__in=plan.known_usernames).values_list('username', 'pk')
+                )
+
+            stage = time.perf_counter()
+            profiles = ensure_profiles([user.pk for user in users], school_classes={
+                user_ids[entry.username]: classes[entry.classes[0]]
+                for entry in plan.create if entry.role == User.STUDENT and entry.classes
+            }, batch_size=batch_size)
+            self.report('Profiles created', profiles, stage)
+
+            if plan.renames:
+                stage = time.perf_counter()
+                User.objects.bulk_update([
+                    User(pk=user_ids[entry.username], first_name=entry.first_name, last_name=entry.last_name)
+                    for entry, _ in plan.renames
+                ], ['first_name', 'last_name'], batch_size=batch_size)
+                # bulk_update sends no post_save: cached tokens would keep the old names
+                evict_user_tokens(*(user_ids[entry.username] for entry, _ in plan.renames))
+                self.report('Users renamed', len(plan.renames), stage)
+
+            if plan.moves:
+                stage = time.perf_counter()
+                moved = {}
+                for username, (_, class_name) in plan.moves.items():
+                    moved.setdefault(class_name, []).append(user_ids[username])
+                # One UPDATE per target class
+                for class_name, ids in moved.items():
+                    UserProfile.objects.filter(user_id__in=ids).update(school_class_id=classes[class_name])
+                self.report('Students moved', len(plan.moves), stage)
+
+            stage = time.perf_counter()
+            added = removed = 0
+            for field, _ in MEMBERSHIPS:
+                through = getattr(SchoolClass, field).through
+                links = [
+                    through(schoolclass_id=classes[class_name], user_id=user_ids[username])
+                    for class_name, username in plan.add_members[field]
+                ]
+                through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+                stale = plan.remove_members.get(field, {}).values()
+                self.delete_in_batches(through.objects.all(), [pk for pk, _, _ in stale], batch_size)
+                added += len(links)
+                removed += len(stale)
+
+                if field == 'students':
+                    for link in links:
+                        class_changes.setdefault(link.schoolclass_id, ([], []))[0].append(link.user_id)
+                    for _, class_id, user_id in stale:
+                        class_changes.setdefault(class_id, ([], []))[1].append(user_id)
+            self.report('Class memberships added', added, stage)
+            if plan.remove_members:
+                self.report('Class memberships removed', removed, stage)
+
+            stage = time.perf_counter()
+            parent_links = [
+                ParentChild(parent_id=user_ids[parent], child_id=user_ids[child], school_class_id=classes[class_name])
+                for parent, child, class_name in plan.add_parents
+            ]
+            ParentChild.objects.bulk_create(parent_links, batch_size=batch_size, ignore_conflicts=True)
+            self.delete_in_batches(ParentChild.objects.all(), list(plan.remove_parents.values()), batch_size)
+            self.report('Parent links', len(parent_links) + len(plan.remove_parents), stage)
+
+            bulk_write.send(sender=User, pks=[user.pk for user in users])
+            for model in (UserProfile, SchoolClass, ParentChild):
+                bulk_write.send(sender=model)
+
+        return users, class_changes
+
+    def delete_in_batches(self, queryset, pks, batch_size):
+        for start in range(0, len(pks), batch_size):
+            queryset.filter(pk__in=pks[start:start + batch_size]).delete()
+
+    def sync_leaderboards(self, users, class_changes):
+        """
+        Adds the new students to the leaderboards and moves class members
+        between the class-scoped ones: bulk membership writes do not send
+        m2m_changed.
+        """
+        new_students = [user.pk for user in users if user.role == User.STUDENT]
+        for metric in leaderboard.METRICS:
+            try:
+                leaderboard.refresh_for_users(metric, new_students)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Leaderboard '{metric}' was not updated: {e}"))
+        try:
+            backend = leaderboard.get_backend()
+            for class_id, (added, removed) in class_changes.items():
+                if added:
+                    backend.update_class_membership(class_id, added, added=True)
+                if removed:
+                    backend.update_class_membership(class_id, removed, added=False)
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'Class leaderboards were not updated: {e}'))
+
+    def print_plan(self, plan, reconcile, verbosity):
+        limit = None if verbosity >= 2 else DRY_RUN_SAMPLE
+        roles = dict(MEMBERSHIPS)
+        sections = [
+            ('Classes to create', [f'+ {name}' for name in plan.missing_classes]),
+            ('Users to create', [
+                f'+ {entry.role} {entry.username} {full_name_of(entry)}' for entry in plan.create
+            ]),
+            ('Users to rename', [
+                f'~ {entry.username}: {old_name} -> {full_name_of(entry)}' for entry, old_name in plan.renames
+            ]),
+            ('Students to move', [
+                f'~ {username}: {old or "-"} -> {new}' for username, (old, new) in sorted(plan.moves.items())
+            ]),
+            ('Class memberships to add', [
+                f'+ {roles[field]} {username} -> {class_name}'
+                for field, rows in plan.add_members.items() for class_name, username in rows
+            ]),
+            ('Class memberships to remove', [
+                f'- {roles[field]} {username} -> {class_name}'
+                for field, rows in plan.remove_members.items() for class_name, username in sorted(rows)
+            ]),
+            ('Parent links to add', [
+                f'+ {parent} -> {child} ({class_name})' for parent, child, class_name in plan.add_parents
+            ]),
+            ('Parent links to remove', [
+                f'- {parent} -> {child} ({class_name})' for parent, child, class_name in sorted(plan.remove_parents)
+            ]),
+        ]
+        self.stdout.write(self.style.WARNING('Dry run: nothing was written.'))
+        for title, lines in sections:
+            self.stdout.write(f'{title:<28} {len(lines):>8}')
+            for line in lines[:limit]:
+                self.stdout.write(f'  {line}')
+            if limit is not None and len(lines) > limit:
+                self.stdout.write(f'  ... and {len(lines) - limit} more (use -v 2 to list all)')
+        if reconcile and plan.unlisted_classes:
+            self.stdout.write(f'Classes not in the roster are kept: {", ".join(plan.unlisted_classes)}')
+
+    def write_credentials(self, path, entries, passwords):
+        if not entries:
+            return
+        try:
+            with open(path, 'w', encoding='utf-8') as credentials_file:
+                credentials_file.write('Class\tUsername\tPassword\tRole\tFull name\n')
+                for entry, password in zip(entries, passwords):
+                    class_name = ';'.join(entry.classes)
+                    credentials_file.write(
+                        f'{class_name}\t{entry.username}\t{password}\t{entry.role}\t{full_name_of(entry)}\n'
+                    )
+            self.stdout.write(self.style.SUCCESS(f'Credentials saved to {path}'))
+        except OSError as e:
+            self.stderr.write(self.style.ERROR(f'Error writing credentials file: {e}'))
@@ -0,0 +1,22 @@
+# main/management/commands/rebuild_leaderboard.py
+
+from django.core.management.base import BaseCommand
+
+from main import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized leaderboard scores and ranks from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metric',
+            choices=leaderboard.METRICS,
+            action='append',
+            help='Metric to rebuild. Can be repeated. Defaults to all metrics.',
+        )
+
+    def handle(self, *args, **options):
+        for metric in options['metric'] or leaderboard.METRICS:
+            count = leaderboard.rebuild(metric)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt leaderboard "{metric}": {count} entries.'))
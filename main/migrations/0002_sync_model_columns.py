@@ -0,0 +1,91 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:46
+
+"""
+Brings the migration state in line with columns the models declared before
+0001_initial was regenerated (attendance coordinates, homework teacher,
+class and profile links). Databases created from the old models already
+have them, so a column is only created where it is missing.
+"""
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# (model, field) pairs whose columns may already exist
+SYNCED_COLUMNS = [
+    ('attendance', 'latitude'),
+    ('attendance', 'longitude'),
+    ('homework', 'teacher'),
+    ('schoolclass', 'user_profile'),
+    ('userprofile', 'school_class'),
+]
+
+
+def add_missing_columns(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for model_name, field_name in SYNCED_COLUMNS:
+            model = apps.get_model('main', model_name)
+            field = model._meta.get_field(field_name)
+            columns = {
+                column.name
+                for column in connection.introspection.get_table_description(cursor, model._meta.db_table)
+            }
+            if field.column not in columns:
+                schema_editor.add_field(model, field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # The fields are added to the state only; the columns follow below
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AddField(
+                model_name='attendance',
+                name='latitude',
+                field=models.DecimalField(blank=True, decimal_places=6, help_text='Широта при отметке посещаемости.', max_digits=9, null=True),
+            ),
+            migrations.AddField(
+                model_name='attendance',
+                name='longitude',
+                field=models.DecimalField(blank=True, decimal_places=6, help_text='Долгота при отметке посещаемости.', max_digits=9, null=True),
+            ),
+            migrations.AddField(
+                model_name='homework',
+                name='teacher',
+                field=models.ForeignKey(blank=True, help_text='Учитель, задавший это задание.', limit_choices_to={'role': 'teacher'}, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='homeworks', to=settings.AUTH_USER_MODEL),
+            ),
+            migrations.AddField(
+                model_name='schoolclass',
+                name='user_profile',
+                field=models.ForeignKey(blank=True, help_text='Профиль классного руководителя (если нужно).', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='classes', to='main.userprofile'),
+            ),
+            migrations.AddField(
+                model_name='userprofile',
+                name='school_class',
+                field=models.ForeignKey(blank=True, help_text='Класс, для связи с учителем', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='main.schoolclass'),
+            ),
+        ]),
+        # Reversing keeps the columns: they may predate this migration
+        migrations.RunPython(add_missing_columns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='attendance',
+            name='school_class',
+            field=models.ForeignKey(help_text='Класс студента.', on_delete=django.db.models.deletion.CASCADE, related_name='attendances', to='main.schoolclass'),
+        ),
+        migrations.AlterField(
+            model_name='homework',
+            name='school_class',
+            field=models.ForeignKey(help_text='Класс, для которого задано домашнее задание.', on_delete=django.db.models.deletion.CASCADE, related_name='homeworks', to='main.schoolclass'),
+        ),
+        migrations.AlterField(
+            model_name='parentchild',
+            name='school_class',
+            field=models.ForeignKey(help_text='Класс ребенка.', on_delete=django.db.models.deletion.CASCADE, related_name='parent_child_relations', to='main.schoolclass'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_sync_model_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='school',
+            name='geofence_polygon',
+            field=models.JSONField(blank=True, help_text='Необязательный многоугольник зоны школы: список пар [широта, долгота]. Заменяет радиус.', null=True),
+        ),
+        migrations.AddField(
+            model_name='school',
+            name='geofence_radius',
+            field=models.PositiveIntegerField(default=100, help_text='Радиус зоны школы в метрах для отметки посещаемости.'),
+        ),
+    ]
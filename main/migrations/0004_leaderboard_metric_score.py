@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_school_geofence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard',
+            name='metric',
+            field=models.CharField(choices=[('xp', 'Опыт'), ('attendance', 'Посещаемость'), ('grades', 'Оценки')], default='xp', help_text='Показатель, по которому строится таблица лидеров.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='leaderboard',
+            name='score',
+            field=models.FloatField(default=0, help_text='Значение показателя.'),
+        ),
+        migrations.AlterField(
+            model_name='leaderboard',
+            name='rank',
+            field=models.PositiveIntegerField(default=1, help_text='Место в таблице лидеров.'),
+        ),
+        migrations.AlterField(
+            model_name='leaderboard',
+            name='user_profile',
+            field=models.ForeignKey(help_text='Профиль пользователя.', on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='main.userprofile'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['metric', 'rank'], name='leaderboard_metric_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['metric', '-score'], name='leaderboard_metric_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboard',
+            constraint=models.UniqueConstraint(fields=('metric', 'user_profile'), name='unique_leaderboard_entry'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_leaderboard_metric_score'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['school_class', '-date', '-id'], name='attendance_class_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['student', '-date', '-id'], name='grade_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['teacher', '-date', '-id'], name='grade_teacher_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='homework',
+            index=models.Index(fields=['school_class', 'due_date'], name='homework_class_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='homework',
+            index=models.Index(fields=['teacher', 'due_date'], name='homework_teacher_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['teacher', 'weekday', 'start_time'], name='schedule_teacher_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submittedhomework',
+            index=models.Index(fields=['homework', '-submitted_at', '-id'], name='submission_hw_submitted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submittedhomework',
+            index=models.Index(fields=['student', '-submitted_at', '-id'], name='submission_student_sub_idx'),
+        ),
+    ]
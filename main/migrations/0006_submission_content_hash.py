@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submittedhomework',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 содержимого файла; одинаковые файлы хранятся один раз.', max_length=64),
+        ),
+    ]
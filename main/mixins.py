@@ -0,0 +1,123 @@
+# main/mixins.py
+
+import hashlib
+
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import caching
+from .pagination import KeysetPagination
+from .serializers import parse_expand
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match on list and retrieve with 304 Not Modified before
+    any query or serializer work is done.
+
+    The validator is built from the requesting user's scope (id and role),
+    the request path and query string, and the cache generations of
+    ``conditional_dependencies`` (see ``main.caching``). Any write to one of
+    those models produces a new ETag, so no rows have to be read to decide.
+    Last-Modified is sent for information only: at its one-second
+    resolution, If-Modified-Since would answer 304 after a write later in
+    the same second.
+    """
+    conditional_dependencies = []
+
+    def build_etag(self, request, generations):
+        user = request.user
+        parts = [
+            str(user.pk), getattr(user, 'role', ''), request.path,
+            request.META.get('QUERY_STRING', ''),
+        ]
+        parts.extend(f'{tag}={generations[tag]}' for tag in sorted(generations))
+        return quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+    def get_conditional_state(self, request):
+        generations, last_modified = caching.get_state(self.conditional_dependencies)
+        return self.build_etag(request, generations), last_modified
+
+    async def aget_conditional_state(self, request):
+        generations, last_modified = await caching.aget_state(self.conditional_dependencies)
+        return self.build_etag(request, generations), last_modified
+
+    def is_not_modified(self, request, etag):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is None:
+            return False
+        candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+        return etag in candidates or f'W/{etag}' in candidates or '*' in candidates
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Authorization, Cookie'
+        return response
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_conditional_state(request)
+        if self.is_not_modified(request, etag):
+            return self.set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+
+class ExpandableQuerysetMixin:
+    """
+    Loads the relations requested with ?expand= (see
+    ``ExpandableFieldsMixin`` in ``main.serializers``) in bulk: foreign keys
+    are joined with select_related and the nested serializer's many-to-many
+    fields are prefetched, so a page costs the same number of queries
+    whatever its size. Without ?expand= the rows are serialized from their
+    foreign key columns and no related table is read.
+    """
+
+    def expand_queryset(self, queryset):
+        expandable = getattr(self.get_serializer_class(), 'expandable_fields', {})
+        expanded = [name for name in expandable if name in parse_expand(self.request)]
+        if not expanded:
+            return queryset
+        prefetch = [f'{name}__{lookup}' for name in expanded for lookup in expandable[name][1]]
+        return queryset.select_related(*expanded).prefetch_related(*prefetch)
+
+    def filter_queryset(self, queryset):
+        return self.expand_queryset(super().filter_queryset(queryset))
+
+
+class KeysetPaginationMixin:
+    """
+    Lets a client choose keyset pagination per request with ?cursor=...
+    (or ?pagination=cursor for the first page) instead of the default page
+    numbers. ``keyset_ordering`` is the sort key with an id tie-breaker;
+    it replaces ?ordering= for keyset pages.
+    """
+    keyset_pagination_class = KeysetPagination
+    keyset_ordering = ('-id',)
+
+    def uses_keyset_pagination(self):
+        params = self.request.query_params
+        return (
+            self.keyset_pagination_class.cursor_query_param in params
+            or params.get('pagination') == 'cursor'
+        )
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.uses_keyset_pagination():
+                self._paginator = self.keyset_pagination_class(ordering=self.keyset_ordering)
+            else:
+                self._paginator = super().paginator
+        return self._paginator
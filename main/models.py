@@ -89,6 +89,15 @@ class School(models.Model):
         blank=True,
         help_text="Долгота школы."
     )
+    geofence_radius = models.PositiveIntegerField(
+        default=100,
+        help_text="Радиус зоны школы в метрах для отметки посещаемости."
+    )
+    geofence_polygon = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Необязательный многоугольник зоны школы: список пар [широта, долгота]. Заменяет радиус."
+    )
 
     def __str__(self):
         return self.name
@@ -195,20 +204,48 @@ class UserAchievement(models.Model):
 # Leaderboard model
 # -----------------------
 class Leaderboard(models.Model):
-    user_profile = models.OneToOneField(
+    XP = 'xp'
+    ATTENDANCE = 'attendance'
+    GRADES = 'grades'
+
+    METRIC_CHOICES = [
+        (XP, 'Опыт'),
+        (ATTENDANCE, 'Посещаемость'),
+        (GRADES, 'Оценки'),
+    ]
+
+    user_profile = models.ForeignKey(
         UserProfile,
         on_delete=models.CASCADE,
-        related_name='leaderboard_entry',
+        related_name='leaderboard_entries',
         help_text="Профиль пользователя."
     )
+    metric = models.CharField(
+        max_length=20,
+        choices=METRIC_CHOICES,
+        default=XP,
+        help_text="Показатель, по которому строится таблица лидеров."
+    )
+    score = models.FloatField(
+        default=0,
+        help_text="Значение показателя."
+    )
     rank = models.PositiveIntegerField(
-        unique=True,
         help_text="Место в таблице лидеров.",
         default=1
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'user_profile'], name='unique_leaderboard_entry')
+        ]
+        indexes = [
+            models.Index(fields=['metric', 'rank'], name='leaderboard_metric_rank_idx'),
+            models.Index(fields=['metric', '-score'], name='leaderboard_metric_score_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.user_profile.user.username} - Rank {self.rank}"
+        return f"{self.user_profile.user.username} - {self.metric} - Rank {self.rank}"
 
 
 # -----------------------
@@ -400,6 +437,9 @@ class Schedule(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['school_class', 'subject', 'weekday', 'start_time'], name='unique_schedule')
         ]
+        indexes = [
+            models.Index(fields=['teacher', 'weekday', 'start_time'], name='schedule_teacher_time_idx'),
+        ]
         ordering = ['school_class', 'weekday', 'start_time']
 
     def __str__(self):
@@ -450,6 +490,12 @@ class Homework(models.Model):
         help_text="Дата и время создания задания."
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['school_class', 'due_date'], name='homework_class_due_idx'),
+            models.Index(fields=['teacher', 'due_date'], name='homework_teacher_due_idx'),
+        ]
+
     def __str__(self):
         return f"Домашнее задание по {self.subject} для {self.school_class}"
 
@@ -480,6 +526,12 @@ class SubmittedHomework(models.Model):
         upload_to='homeworks/submissions/',
         help_text="Файл с выполненным заданием."
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text="SHA-256 содержимого файла; одинаковые файлы хранятся один раз."
+    )
     submitted_at = models.DateTimeField(
         auto_now_add=True,
         help_text="Дата и время отправки задания."
@@ -507,6 +559,10 @@ class SubmittedHomework(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['homework', 'student'], name='unique_homework_submission')
         ]
+        indexes = [
+            models.Index(fields=['homework', '-submitted_at', '-id'], name='submission_hw_submitted_idx'),
+            models.Index(fields=['student', '-submitted_at', '-id'], name='submission_student_sub_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.homework}"
@@ -552,6 +608,12 @@ class Grade(models.Model):
         help_text="Комментарии учителя к оценке."
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', '-date', '-id'], name='grade_student_date_idx'),
+            models.Index(fields=['teacher', '-date', '-id'], name='grade_teacher_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.student} - {self.subject} - {self.grade}"
 
@@ -623,6 +685,9 @@ class Attendance(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['student', 'date'], name='unique_attendance')
         ]
+        indexes = [
+            models.Index(fields=['school_class', '-date', '-id'], name='attendance_class_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.date} - {self.get_status_display()}"
@@ -651,6 +716,12 @@ class Notification(models.Model):
         help_text="Прочитано ли уведомление."
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx'),
+            models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_unread_idx'),
+        ]
+
     def __str__(self):
         return f"Уведомление для {self.user.username} - {'Прочитано' if self.is_read else 'Не прочитано'}"
 
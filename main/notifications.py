@@ -0,0 +1,195 @@
+# main/notifications.py
+
+"""
+Notification fan-out for school events.
+
+Views only schedule the ``fan_out_notifications`` task once their
+transaction commits, so a request costs the same for any class size. The
+task resolves all recipients of an event with one set-based query and
+writes the notifications with chunked ``bulk_create``.
+
+Events:
+
+- ``homework``: new homework, for the students of the class and their parents
+- ``grade``: new grades, for the student and the student's parents
+- ``attendance``: absences, for the student's parents
+
+The unread badge of every user is a counter in the shared cache. Single
+notification writes and the read actions adjust it with atomic ``incr``.
+Bulk inserts drop it, and the next read counts it again with one indexed
+query.
+"""
+
+import datetime
+import logging
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import events
+from .models import User, SchoolClass, Homework, Grade, Attendance, ParentChild, Notification
+
+logger = logging.getLogger(__name__)
+
+HOMEWORK = 'homework'
+GRADE = 'grade'
+ATTENDANCE = 'attendance'
+
+# Notifications written per INSERT
+NOTIFICATION_CHUNK_SIZE = 1000
+
+# Length of the homework description quoted in a notification
+DESCRIPTION_PREVIEW = 100
+
+UNREAD_KEY_PREFIX = 'notifications_unread'
+
+# Counters are recounted from the database at least this often (seconds),
+# which bounds the drift left by an update racing a recount
+UNREAD_COUNT_TIMEOUT = 60 * 60
+
+
+def _unread_key(user_id):
+    return f'{UNREAD_KEY_PREFIX}:{user_id}'
+
+
+def unread_count(user_id):
+    """
+    Returns the number of unread notifications of a user: one cache read,
+    or one indexed COUNT when the counter is not cached.
+    """
+    key = _unread_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.add(key, count, timeout=UNREAD_COUNT_TIMEOUT)
+    return count
+
+
+def adjust_unread_count(user_id, delta):
+    """
+    Atomically adds ``delta`` to a cached counter. A counter that is not
+    cached is left alone: the next read counts it.
+    """
+    if not delta:
+        return
+    key = _unread_key(user_id)
+    try:
+        count = cache.incr(key, delta)
+    except ValueError:
+        return
+    if count < 0:
+        cache.delete(key)
+
+
+def set_unread_count(user_id, count):
+    cache.set(_unread_key(user_id), count, timeout=UNREAD_COUNT_TIMEOUT)
+
+
+def reset_unread_counts(user_ids):
+    """
+    Drops the counters of users whose notifications changed in bulk.
+    """
+    cache.delete_many([_unread_key(user_id) for user_id in set(user_ids)])
+
+
+def _child_name(first_name, last_name, username):
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def _parents_of(child_ids):
+    """
+    Returns {child id: [parent ids]} with one query.
+    """
+    parents = {}
+    rows = ParentChild.objects.filter(child_id__in=child_ids).values_list('child_id', 'parent_id').distinct()
+    for child_id, parent_id in rows:
+        parents.setdefault(child_id, []).append(parent_id)
+    return parents
+
+
+def homework_notifications(homework_ids, chunk_size=NOTIFICATION_CHUNK_SIZE):
+    """
+    Yields (user id, message) for the students of the homework's class and
+    the parents linked to that class.
+    """
+    homeworks = Homework.objects.filter(pk__in=homework_ids).values_list(
+        'school_class_id', 'subject__name', 'description', 'due_date'
+    )
+    for class_id, subject, description, due_date in homeworks:
+        preview = description if len(description) <= DESCRIPTION_PREVIEW else f'{description[:DESCRIPTION_PREVIEW]}…'
+        message = f'New homework in {subject}, due {due_date:%Y-%m-%d}: {preview}'
+        students = SchoolClass.students.through.objects.filter(schoolclass_id=class_id).values('user_id')
+        parents = ParentChild.objects.filter(school_class_id=class_id).values('parent_id')
+        recipients = (
+            User.objects.filter(Q(pk__in=students) | Q(pk__in=parents))
+            .order_by()
+            .values_list('pk', flat=True)
+            .iterator(chunk_size=chunk_size)
+        )
+        for user_id in recipients:
+            yield user_id, message
+
+
+def grade_notifications(grade_ids, chunk_size=NOTIFICATION_CHUNK_SIZE):
+    """
+    Yields (user id, message) for the graded students and their parents.
+    """
+    grades = list(Grade.objects.filter(pk__in=grade_ids).values_list(
+        'student_id', 'student__username', 'student__first_name', 'student__last_name',
+        'subject__name', 'grade', 'date',
+    ))
+    parents = _parents_of({grade[0] for grade in grades})
+    for student_id, username, first_name, last_name, subject, grade, date in grades:
+        yield student_id, f'New grade {grade} in {subject} on {date:%Y-%m-%d}.'
+        child = _child_name(first_name, last_name, username)
+        for parent_id in parents.get(student_id, []):
+            yield parent_id, f'{child} got {grade} in {subject} on {date:%Y-%m-%d}.'
+
+
+def attendance_notifications(student_ids, date, chunk_size=NOTIFICATION_CHUNK_SIZE):
+    """
+    Yields (user id, message) for the parents of the listed students that
+    are marked absent on ``date`` (an ISO date string).
+    """
+    day = datetime.date.fromisoformat(date)
+    absences = list(
+        Attendance.objects.filter(student_id__in=student_ids, date=day, status='absent').values_list(
+            'student_id', 'student__username', 'student__first_name', 'student__last_name', 'school_class__name',
+        )
+    )
+    parents = _parents_of({absence[0] for absence in absences})
+    for student_id, username, first_name, last_name, class_name in absences:
+        message = f'{_child_name(first_name, last_name, username)} was absent from {class_name} on {day:%Y-%m-%d}.'
+        for parent_id in parents.get(student_id, []):
+            yield parent_id, message
+
+
+EVENTS = {
+    HOMEWORK: homework_notifications,
+    GRADE: grade_notifications,
+    ATTENDANCE: attendance_notifications,
+}
+
+
+def fan_out(event, object_ids, chunk_size=NOTIFICATION_CHUNK_SIZE, **params):
+    """
+    Writes the notifications of an event in chunks and returns how many
+    were created.
+    """
+    created = 0
+    chunk = []
+    for user_id, message in EVENTS[event](object_ids, chunk_size=chunk_size, **params):
+        chunk.append(Notification(user_id=user_id, message=message))
+        if len(chunk) >= chunk_size:
+            created += _write_chunk(chunk)
+            chunk = []
+    if chunk:
+        created += _write_chunk(chunk)
+    return created
+
+
+def _write_chunk(chunk):
+    Notification.objects.bulk_create(chunk)
+    reset_unread_counts(notification.user_id for notification in chunk)
+    events.publish_notifications(chunk)
+    return len(chunk)
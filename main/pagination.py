@@ -0,0 +1,164 @@
+# main/pagination.py
+
+"""
+Keyset (cursor) pagination.
+
+Pages are read with a WHERE on the sort key instead of OFFSET, and no
+COUNT(*) is run, so a deep page costs the same as the first one. The cursor
+holds the sort value and the id of the boundary row: rows inserted while a
+client scrolls never shift or repeat the rows it has already seen.
+"""
+
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates on ``ordering``: a sort field followed by a unique tie-breaker,
+    e.g. ``('-date', '-id')``. Both directions are supported; the cursor of
+    the ``previous`` link walks the same key backwards.
+
+    Sort fields must be non-nullable: NULL never compares equal or less, so
+    rows with a NULL key would silently fall out of every page after the
+    first. Nullable fields are rejected with ImproperlyConfigured.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor.'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-id',)
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = payload['p'], bool(payload['r'])
+            if len(position) != len(self.ordering):
+                raise ValueError
+            values = [
+                field.to_python(value) for field, value in zip(self.fields, position)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def get_position(self, instance):
+        position = []
+        for field in self.fields:
+            value = field.value_from_object(instance)
+            position.append(value if isinstance(value, (int, str)) else field.value_to_string(instance))
+        return position
+
+    def keyset_filter(self, values, reverse):
+        """
+        Builds the lexicographic "after this row" condition:
+        (a > x) OR (a = x AND b > y) ..., with the comparison of each key
+        following its direction.
+        """
+        conditions = []
+        for index, (name, descending) in enumerate(self.keys):
+            lookup = 'lt' if descending != reverse else 'gt'
+            equal = {key: value for (key, _), value in zip(self.keys[:index], values)}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': values[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.keys = [(key.lstrip('-'), key.startswith('-')) for key in self.ordering]
+        self.fields = [
+            queryset.model._meta.pk if name in ('id', 'pk') else queryset.model._meta.get_field(name)
+            for name, _ in self.keys
+        ]
+        nullable = [field.name for field in self.fields if field.null]
+        if nullable:
+            raise ImproperlyConfigured(
+                f"Keyset pagination needs non-nullable sort fields; {', '.join(nullable)} can be NULL."
+            )
+
+        values, reverse = self.decode_cursor(request)
+        self.has_cursor = values is not None
+
+        ordering = [
+            f'-{name}' if descending != reverse else name for name, descending in self.keys
+        ]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Going forward, a cursor means there are rows before this page;
+        # going backwards, the row the cursor came from is after it.
+        self.has_next = has_more if not reverse else True
+        self.has_previous = self.has_cursor if not reverse else has_more
+        self.page = rows
+        return rows
+
+    def get_link(self, instance, reverse):
+        url = self.request.build_absolute_uri()
+        if instance is None:
+            return remove_query_param(url, self.cursor_query_param)
+        cursor = self.encode_cursor(self.get_position(instance), reverse)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.get_link(None, reverse=True)
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,52 @@
+# main/profiles.py
+
+"""
+Creation of user profiles.
+
+Every user has a UserProfile. A user saved with ``save()`` gets it from the
+post_save signal. Users written with ``bulk_create`` get it from
+``ensure_profiles()``, which is called by the ``bulk_write`` signal or directly
+by importers. A user that still has none gets one lazily from ``get_profile()``.
+"""
+
+from . import caching
+from .models import UserProfile
+
+# Rows per INSERT when profiles are created in bulk
+PROFILE_BATCH_SIZE = 1000
+
+
+def ensure_profiles(user_ids, school_classes=None, batch_size=PROFILE_BATCH_SIZE):
+    """
+    Creates the missing profiles of ``user_ids`` with one SELECT and batched
+    INSERTs. ``school_classes`` optionally maps a user id to the class of its
+    new profile. Returns the number of profiles created.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return 0
+    school_classes = school_classes or {}
+    existing = set(UserProfile.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    missing = sorted(user_ids - existing)
+    if not missing:
+        return 0
+
+    # ignore_conflicts: a profile created concurrently is not an error
+    UserProfile.objects.bulk_create([
+        UserProfile(user_id=user_id, school_class_id=school_classes.get(user_id))
+        for user_id in missing
+    ], batch_size=batch_size, ignore_conflicts=True)
+    caching.bump_on_commit(UserProfile)
+    return len(missing)
+
+
+def get_profile(user):
+    """
+    Returns the user's profile, creating it for users that were written
+    without one.
+    """
+    try:
+        return user.profile
+    except UserProfile.DoesNotExist:
+        profile, _ = UserProfile.objects.get_or_create(user=user)
+        return profile
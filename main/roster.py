@@ -0,0 +1,144 @@
+# main/roster.py
+
+"""
+Reading of CSV/XLSX rosters for the import_roster command.
+
+A roster has one row per person. Recognized columns (header names are
+case-insensitive):
+
+- ``role``: student, teacher or parent (default student)
+- ``full_name`` ("Фамилия Имя Отчество") or ``last_name`` and ``first_name``
+- ``class``: the student's class, or the classes a teacher teaches;
+  several names are separated with ``;``
+- ``username``, ``password``, ``email``: optional, generated when empty
+- ``children``: for parents, usernames or roster full names of their
+  children separated with ``;``
+"""
+
+import csv
+import os
+import secrets
+import string
+from collections import namedtuple
+
+from openpyxl import load_workbook
+
+from .models import User
+
+ROLES = [User.STUDENT, User.TEACHER, User.PARENT]
+
+LIST_SEPARATOR = ';'
+
+RosterEntry = namedtuple('RosterEntry', [
+    'line', 'role', 'first_name', 'last_name', 'classes', 'username', 'password', 'email', 'children',
+])
+
+
+class RosterError(ValueError):
+    """
+    Raised for a roster file that cannot be read.
+    """
+
+
+def split_full_name(full_name):
+    """
+    Splits "LastName FirstName Patronymic" into (first_name, last_name).
+    """
+    parts = full_name.strip().split()
+    if len(parts) >= 2:
+        return parts[1], parts[0]
+    if len(parts) == 1:
+        return '', parts[0]
+    return '', ''
+
+
+def full_name_of(entry):
+    return f'{entry.last_name} {entry.first_name}'.strip()
+
+
+def generate_numeric_password(length=6):
+    return ''.join(secrets.choice(string.digits) for _ in range(length))
+
+
+def _split_list(value):
+    return [item.strip() for item in (value or '').split(LIST_SEPARATOR) if item.strip()]
+
+
+def _read_csv_rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as roster_file:
+        sample = roster_file.read(4096)
+        roster_file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(roster_file, dialect)
+        yield from reader
+
+
+def _read_xlsx_rows(path, sheet=None):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        for row in worksheet.iter_rows(values_only=True):
+            yield ['' if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_roster_rows(path, sheet=None):
+    """
+    Yields (line number, {column: value}) for every non-empty row of a CSV or XLSX roster.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        rows = _read_xlsx_rows(path, sheet)
+    elif extension in ('.csv', '.tsv', '.txt'):
+        rows = _read_csv_rows(path)
+    else:
+        raise RosterError(f"Unsupported roster format: {extension or path}")
+
+    header = None
+    for line, row in enumerate(rows, start=1):
+        if header is None:
+            header = [column.strip().lower() for column in row]
+            if 'full_name' not in header and 'last_name' not in header:
+                raise RosterError("The roster needs a 'full_name' or 'last_name' column.")
+            continue
+        values = {column: (value or '').strip() for column, value in zip(header, row)}
+        if any(values.values()):
+            yield line, values
+
+
+def read_roster(path, sheet=None):
+    """
+    Returns (entries, errors): parsed RosterEntry rows and (line, message) pairs for invalid rows.
+    """
+    entries = []
+    errors = []
+    for line, values in iter_roster_rows(path, sheet):
+        role = (values.get('role') or User.STUDENT).lower()
+        if role not in ROLES:
+            errors.append((line, f"Unknown role '{role}'."))
+            continue
+
+        if values.get('full_name'):
+            first_name, last_name = split_full_name(values['full_name'])
+        else:
+            first_name, last_name = values.get('first_name', ''), values.get('last_name', '')
+        if not first_name and not last_name:
+            errors.append((line, "Empty name."))
+            continue
+
+        entries.append(RosterEntry(
+            line=line,
+            role=role,
+            first_name=first_name,
+            last_name=last_name,
+            classes=_split_list(values.get('class')),
+            username=values.get('username', ''),
+            password=values.get('password', ''),
+            email=values.get('email', ''),
+            children=_split_list(values.get('children')),
+        ))
+    return entries, errors
@@ -0,0 +1,190 @@
+# main/scheduling.py
+
+"""
+Schedule conflict detection and free-teacher search.
+
+Lessons are half-open intervals [start, end) of week offsets (see
+``main.timetable``), so lessons on different weekdays never overlap and a
+lesson may start exactly when another one ends. ``IntervalIndex`` is a
+static interval tree over such intervals: built in O(n log n), it returns
+every interval overlapping a query in O(log n + k).
+
+``find_conflicts()`` checks a single new or edited lesson as well as a whole
+timetable import against the existing lessons of the same teachers and
+classes, and against each other, with one query and one index per teacher
+and class. ``free_teachers()`` answers "who is free at weekday W, time T"
+from a cached index of all lessons of the weekday.
+"""
+
+from django.db.models import Q
+
+from . import caching
+from .models import User, Schedule
+from .timetable import week_offset, TIMETABLE_CACHE_TIMEOUT
+
+
+class IntervalIndex:
+    """
+    Static interval tree over half-open [start, end) intervals.
+
+    Intervals are sorted by start and the sorted array is read as an
+    implicit balanced tree: the middle of every slice is the root of that
+    slice, and ``max_ends`` holds the largest end in the subtree of each
+    root. A search skips every subtree that ends before the query starts or
+    starts after it ends.
+    """
+    __slots__ = ('starts', 'ends', 'values', 'max_ends')
+
+    def __init__(self, intervals):
+        """
+        ``intervals`` is an iterable of (start, end, value).
+        """
+        items = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self.starts = [item[0] for item in items]
+        self.ends = [item[1] for item in items]
+        self.values = [item[2] for item in items]
+        self.max_ends = [None] * len(items)
+        self._build(0, len(items))
+
+    def __len__(self):
+        return len(self.values)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.ends[mid]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self.max_ends[mid] = max_end
+        return max_end
+
+    def overlapping(self, start, end):
+        """
+        Returns the values of the intervals overlapping [start, end), in the
+        order of their starts.
+        """
+        found = []
+        self._search(0, len(self.values), start, end, found)
+        return found
+
+    def _search(self, lo, hi, start, end, found):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.max_ends[mid] <= start:
+            return
+        self._search(lo, mid, start, end, found)
+        if self.starts[mid] < end:
+            if self.ends[mid] > start:
+                found.append(self.values[mid])
+            self._search(mid + 1, hi, start, end, found)
+
+
+def lesson_interval(weekday, start_time, end_time):
+    return week_offset(weekday, start_time), week_offset(weekday, end_time)
+
+
+def _describe(weekday, start_time, end_time):
+    return f"weekday {weekday} {start_time:%H:%M}-{end_time:%H:%M}"
+
+
+def find_conflicts(lessons, exclude_ids=(), replaced_class_ids=()):
+    """
+    Returns {position: [messages]} for the lessons (Schedule instances, saved
+    or not) that overlap another lesson of the same teacher or class, either
+    an existing one or another one of ``lessons``.
+
+    ``exclude_ids`` are existing lessons to ignore (e.g. the one being
+    edited); the existing lessons of ``replaced_class_ids`` are ignored too,
+    for imports that replace the timetables of those classes.
+    """
+    lessons = list(lessons)
+    if not lessons:
+        return {}
+    teacher_ids = {lesson.teacher_id for lesson in lessons}
+    class_ids = {lesson.school_class_id for lesson in lessons if lesson.school_class_id is not None}
+    existing = (
+        Schedule.objects.filter(
+            Q(teacher_id__in=teacher_ids) | Q(school_class_id__in=class_ids),
+            weekday__in={lesson.weekday for lesson in lessons},
+        )
+        .exclude(pk__in=[pk for pk in exclude_ids if pk is not None])
+        .exclude(school_class_id__in=replaced_class_ids)
+        .values_list('id', 'teacher_id', 'school_class_id', 'weekday', 'start_time', 'end_time')
+    )
+
+    groups = {}
+
+    def add(lesson_ref, teacher_id, class_id, weekday, start_time, end_time):
+        start, end = lesson_interval(weekday, start_time, end_time)
+        groups.setdefault(('teacher', teacher_id), []).append((start, end, lesson_ref))
+        if class_id is not None:
+            groups.setdefault(('class', class_id), []).append((start, end, lesson_ref))
+
+    rows = {}
+    for pk, teacher_id, class_id, weekday, start_time, end_time in existing:
+        rows[pk] = (weekday, start_time, end_time)
+        add(('existing', pk), teacher_id, class_id, weekday, start_time, end_time)
+    for position, lesson in enumerate(lessons):
+        add(('new', position), lesson.teacher_id, lesson.school_class_id,
+            lesson.weekday, lesson.start_time, lesson.end_time)
+
+    indexes = {key: IntervalIndex(intervals) for key, intervals in groups.items()}
+    conflicts = {}
+    for position, lesson in enumerate(lessons):
+        start, end = lesson_interval(lesson.weekday, lesson.start_time, lesson.end_time)
+        keys = [('teacher', lesson.teacher_id)]
+        if lesson.school_class_id is not None:
+            keys.append(('class', lesson.school_class_id))
+        for kind, key_id in keys:
+            for source, ref in indexes[(kind, key_id)].overlapping(start, end):
+                if (source, ref) == ('new', position):
+                    continue
+                who = f"Teacher {key_id}" if kind == 'teacher' else f"Class {key_id}"
+                if source == 'existing':
+                    message = f"{who} already has lesson {ref} on {_describe(*rows[ref])}."
+                else:
+                    other = lessons[ref]
+                    message = f"{who} also has row {ref} on {_describe(other.weekday, other.start_time, other.end_time)}."
+                conflicts.setdefault(position, []).append(message)
+    return conflicts
+
+
+def busy_index(weekday):
+    """
+    Returns the cached IntervalIndex of all lessons on ``weekday`` with
+    teacher ids as values.
+    """
+    def build():
+        rows = Schedule.objects.filter(weekday=weekday).values_list('teacher_id', 'start_time', 'end_time')
+        return IntervalIndex(
+            (*lesson_interval(weekday, start_time, end_time), teacher_id)
+            for teacher_id, start_time, end_time in rows
+        )
+
+    return caching.get_or_set(
+        f'busy_teachers:{weekday}', build, depends_on=[Schedule], timeout=TIMETABLE_CACHE_TIMEOUT,
+    )
+
+
+def busy_teacher_ids(weekday, start_time, end_time=None):
+    """
+    Ids of the teachers with a lesson overlapping ``start_time``-``end_time``
+    on ``weekday``; without ``end_time``, at the moment ``start_time``.
+    """
+    start = week_offset(weekday, start_time)
+    end = week_offset(weekday, end_time) if end_time is not None else start + 1
+    return set(busy_index(weekday).overlapping(start, end))
+
+
+def free_teachers(weekday, start_time, end_time=None, school_id=None):
+    """
+    Returns the active teachers (of ``school_id``, if given) that have no
+    lesson at that time.
+    """
+    teachers = User.objects.filter(role=User.TEACHER, is_active=True)
+    if school_id is not None:
+        teachers = teachers.filter(school_id=school_id)
+    return teachers.exclude(pk__in=busy_teacher_ids(weekday, start_time, end_time)).order_by('last_name', 'username')
@@ -1,17 +1,60 @@
 # serializers.py
 
+from functools import partial
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from .models import (
     SchoolClass, Subject, Schedule, Homework, SubmittedHomework,
     Grade, Attendance, Achievement, UserProfile,
     UserAchievement, Leaderboard, Notification, StudentTeacher
 )
-from geopy.distance import geodesic
+from .geo import get_geofence
+from . import exports, scheduling, uploads
 
 # Получаем кастомную модель пользователя
 User = get_user_model()
 
+# Параметр запроса со списком разворачиваемых связей: ?expand=school_class,subject
+EXPAND_PARAM = 'expand'
+
+
+def parse_expand(request):
+    """
+    Returns the set of relation names requested with ?expand=.
+    """
+    if request is None:
+        return set()
+    value = request.query_params.get(EXPAND_PARAM, '')
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class ExpandableFieldsMixin:
+    """
+    Связанные объекты по умолчанию отдаются только первичными ключами.
+    Связи из ``expandable_fields`` разворачиваются во вложенное представление,
+    если они перечислены в параметре ?expand= запроса.
+
+    ``expandable_fields`` сопоставляет имя поля с парой
+    (класс сериализатора, связи вложенного объекта для prefetch_related).
+    Представления с ``ExpandableQuerysetMixin`` загружают развёрнутые связи
+    пакетно, поэтому число запросов не зависит от размера страницы.
+    """
+    expandable_fields = {}
+
+    def get_expanded_fields(self):
+        requested = parse_expand(self.context.get('request'))
+        return [name for name in self.expandable_fields if name in requested]
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        for name in self.get_expanded_fields():
+            serializer_class, _ = self.expandable_fields[name]
+            related = getattr(instance, name)
+            representation[name] = serializer_class(related).data if related is not None else None
+        return representation
+
 
 class UserSerializer(serializers.ModelSerializer):
     """
@@ -64,6 +107,10 @@ class SchoolClassSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'teachers', 'students', 'subjects']
 
 
+# Связи SchoolClassSerializer, которые нужно предзагрузить для вложенного класса
+SCHOOL_CLASS_PREFETCH = ('teachers', 'students', 'subjects')
+
+
 class SubjectSerializer(serializers.ModelSerializer):
     """
     Сериализатор для модели Subject.
@@ -96,11 +143,16 @@ class StudentTeacherSerializer(serializers.ModelSerializer):
         ]
 
 
-class ScheduleSerializer(serializers.ModelSerializer):
+class ScheduleSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Schedule.
-    Включает вложенные сериализаторы для класса, предмета и учителя.
+    Класс, предмет и учитель разворачиваются по ?expand=.
     """
+    expandable_fields = {
+        'school_class': (SchoolClassSerializer, SCHOOL_CLASS_PREFETCH),
+        'subject': (SubjectSerializer, ()),
+        'teacher': (UserSerializer, ()),
+    }
     school_class = serializers.PrimaryKeyRelatedField(
         queryset=SchoolClass.objects.all()
     )
@@ -115,22 +167,35 @@ class ScheduleSerializer(serializers.ModelSerializer):
         model = Schedule
         fields = ['id', 'school_class', 'subject', 'teacher', 'weekday', 'start_time', 'end_time']
 
-    def to_representation(self, instance):
+    def validate(self, data):
         """
-        Customize representation to include nested data.
+        Проверяет, что занятие не пересекается с другими занятиями
+        того же учителя или класса.
         """
-        representation = super().to_representation(instance)
-        representation['school_class'] = SchoolClassSerializer(instance.school_class).data
-        representation['subject'] = SubjectSerializer(instance.subject).data
-        representation['teacher'] = UserSerializer(instance.teacher).data
-        return representation
+        instance = self.instance
+        values = {
+            field: data.get(field, getattr(instance, field, None))
+            for field in ('school_class', 'teacher', 'weekday', 'start_time', 'end_time')
+        }
+        if values['start_time'] >= values['end_time']:
+            raise serializers.ValidationError("start_time must be earlier than end_time.")
+        # Fields left out of a create keep their model defaults
+        lesson = Schedule(**{field: value for field, value in values.items() if value is not None})
+        conflicts = scheduling.find_conflicts([lesson], exclude_ids=[getattr(instance, 'pk', None)])
+        if conflicts:
+            raise serializers.ValidationError(conflicts[0])
+        return data
 
 
-class HomeworkSerializer(serializers.ModelSerializer):
+class HomeworkSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Homework.
-    Включает вложенные сериализаторы для предмета и класса.
+    Предмет и класс разворачиваются по ?expand=.
     """
+    expandable_fields = {
+        'subject': (SubjectSerializer, ()),
+        'school_class': (SchoolClassSerializer, SCHOOL_CLASS_PREFETCH),
+    }
     school_class = serializers.PrimaryKeyRelatedField(
         queryset=SchoolClass.objects.all()
     )
@@ -142,21 +207,16 @@ class HomeworkSerializer(serializers.ModelSerializer):
         model = Homework
         fields = ['id', 'subject', 'school_class', 'description', 'due_date', 'created_at']
 
-    def to_representation(self, instance):
-        """
-        Customize representation to include nested data.
-        """
-        representation = super().to_representation(instance)
-        representation['subject'] = SubjectSerializer(instance.subject).data
-        representation['school_class'] = SchoolClassSerializer(instance.school_class).data
-        return representation
-
 
-class SubmittedHomeworkSerializer(serializers.ModelSerializer):
+class SubmittedHomeworkSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели SubmittedHomework.
-    Включает вложенные сериализаторы для домашнего задания и студента.
+    Домашнее задание и студент разворачиваются по ?expand=.
     """
+    expandable_fields = {
+        'homework': (HomeworkSerializer, ()),
+        'student': (UserSerializer, ()),
+    }
     homework = serializers.PrimaryKeyRelatedField(
         queryset=Homework.objects.all()
     )
@@ -167,25 +227,59 @@ class SubmittedHomeworkSerializer(serializers.ModelSerializer):
     class Meta:
         model = SubmittedHomework
         fields = [
-            'id', 'homework', 'student', 'submission_file',
+            'id', 'homework', 'student', 'submission_file', 'content_hash',
             'submitted_at', 'status', 'grade', 'feedback'
         ]
+        read_only_fields = ['content_hash']
 
-    def to_representation(self, instance):
+    def store_upload(self, validated_data):
         """
-        Customize representation to include nested data.
+        Сохраняет загруженный файл один раз на содержимое и записывает его хэш.
+        Возвращает загрузку или None, если файл не передан.
         """
-        representation = super().to_representation(instance)
-        representation['homework'] = HomeworkSerializer(instance.homework).data
-        representation['student'] = UserSerializer(instance.student).data
-        return representation
+        upload = validated_data.get('submission_file')
+        if not isinstance(upload, uploads.HashedUpload):
+            return None
+        validated_data['content_hash'] = upload.sha256
+        validated_data['submission_file'] = uploads.store(upload)
+        return upload
+
+    def save_with_upload(self, validated_data, save):
+        """
+        Файл сохраняется до записи строки: если запись не удалась, файл,
+        на который не ссылается ни одна другая работа, удаляется.
+        """
+        upload = self.store_upload(validated_data)
+        try:
+            with transaction.atomic():
+                return save(validated_data)
+        except Exception:
+            if upload is not None:
+                uploads.unstore(upload)
+            raise
+
+    def create(self, validated_data):
+        return self.save_with_upload(validated_data, super().create)
+
+    def update(self, instance, validated_data):
+        upload = validated_data.get('submission_file')
+        if isinstance(upload, uploads.HashedUpload) and upload.sha256 == instance.content_hash:
+            # Тот же файл отправлен повторно: хранить нечего
+            upload.discard()
+            del validated_data['submission_file']
+        return self.save_with_upload(validated_data, partial(super().update, instance))
 
 
-class GradeSerializer(serializers.ModelSerializer):
+class GradeSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Grade.
-    Включает вложенные сериализаторы для студента, предмета и учителя.
+    Студент, предмет и учитель разворачиваются по ?expand=.
     """
+    expandable_fields = {
+        'student': (UserSerializer, ()),
+        'subject': (SubjectSerializer, ()),
+        'teacher': (UserSerializer, ()),
+    }
     student = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.filter(role=User.STUDENT)
     )
@@ -200,22 +294,124 @@ class GradeSerializer(serializers.ModelSerializer):
         model = Grade
         fields = ['id', 'student', 'subject', 'grade', 'date', 'teacher', 'comments']
 
-    def to_representation(self, instance):
-        """
-        Customize representation to include nested data.
-        """
-        representation = super().to_representation(instance)
-        representation['student'] = UserSerializer(instance.student).data
-        representation['subject'] = SubjectSerializer(instance.subject).data
-        representation['teacher'] = UserSerializer(instance.teacher).data
-        return representation
 
+class BulkGradeSerializer(serializers.Serializer):
+    """
+    Заголовок пакетного ввода оценок: класс и значения по умолчанию
+    (предмет, дата) для строк ``grades``. Строки проверяются по отдельности
+    сериализатором BulkGradeRowSerializer.
+    """
+    school_class = serializers.IntegerField()
+    subject = serializers.IntegerField(required=False)
+    date = serializers.DateField(required=False)
+    grades = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=1000
+    )
+
+
+class BulkGradeRowSerializer(serializers.Serializer):
+    """
+    Одна оценка пакетного ввода. Предмет и дата берутся из заголовка,
+    если не указаны в строке. Ссылки на студента и предмет проверяются
+    в представлении одним запросом на весь пакет.
+    """
+    student = serializers.IntegerField()
+    grade = serializers.DecimalField(max_digits=3, decimal_places=1)
+    subject = serializers.IntegerField(required=False)
+    date = serializers.DateField(required=False)
+    comments = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+class BulkScheduleSerializer(serializers.Serializer):
+    """
+    Пакетный импорт расписания. При ``replace`` прежние занятия классов
+    из пакета заменяются, и пакет записывается только целиком.
+    """
+    replace = serializers.BooleanField(default=False)
+    schedules = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=5000
+    )
+
+
+class BulkScheduleRowSerializer(serializers.Serializer):
+    """
+    Одно занятие пакетного импорта. Ссылки на класс, предмет и учителя
+    проверяются в представлении одним запросом на весь пакет.
+    """
+    school_class = serializers.IntegerField()
+    subject = serializers.IntegerField()
+    teacher = serializers.IntegerField()
+    weekday = serializers.ChoiceField(choices=Schedule.WEEKDAYS)
+    start_time = serializers.TimeField()
+    end_time = serializers.TimeField()
 
-class AttendanceSerializer(serializers.ModelSerializer):
+    def validate(self, data):
+        if data['start_time'] >= data['end_time']:
+            raise serializers.ValidationError("start_time must be earlier than end_time.")
+        return data
+
+
+class FreeTeachersSerializer(serializers.Serializer):
+    """
+    Поиск свободных учителей: день недели и момент времени
+    или интервал ``time``-``end_time``.
+    """
+    weekday = serializers.ChoiceField(choices=Schedule.WEEKDAYS)
+    time = serializers.TimeField()
+    end_time = serializers.TimeField(required=False)
+    school = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if 'end_time' in data and data['time'] >= data['end_time']:
+            raise serializers.ValidationError("time must be earlier than end_time.")
+        return data
+
+
+class RollCallSerializer(serializers.Serializer):
+    """
+    Перекличка: статусы посещаемости всего класса за один день
+    в виде {id студента: статус}.
+    """
+    school_class = serializers.IntegerField()
+    date = serializers.DateField(required=False)
+    statuses = serializers.DictField(
+        child=serializers.ChoiceField(choices=Attendance.STATUS_CHOICES), allow_empty=False
+    )
+
+    def validate_statuses(self, value):
+        try:
+            return {int(student_id): status for student_id, status in value.items()}
+        except ValueError:
+            raise serializers.ValidationError("Student ids must be integers.")
+
+
+class ExportSerializer(serializers.Serializer):
+    """
+    Параметры выгрузки: формат файла и фильтры по школе, классу и датам.
+    Параметр называется ``file_format``, потому что ``format`` занят DRF
+    для выбора рендерера.
+    """
+    file_format = serializers.ChoiceField(choices=exports.FORMATS, default=exports.CSV)
+    school = serializers.IntegerField(required=False)
+    school_class = serializers.IntegerField(required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("date_from must not be later than date_to.")
+        return data
+
+
+class AttendanceSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Attendance.
-    Включает вложенные сериализаторы для студента и класса.
+    Студент и класс разворачиваются по ?expand=.
     """
+    expandable_fields = {
+        'student': (UserSerializer, ()),
+        'school_class': (SchoolClassSerializer, SCHOOL_CLASS_PREFETCH),
+    }
     student = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.filter(role=User.STUDENT)
     )
@@ -236,30 +432,16 @@ class AttendanceSerializer(serializers.ModelSerializer):
             school = request.user.school
             if not school or not school.latitude or not school.longitude:
                 raise serializers.ValidationError("School coordinates are not set for this user.")
-            # Validate proximity to the school (e.g., within 100 meters)
-            valid = self.is_within_school_proximity(
-                data['latitude'], data['longitude'], school.latitude, school.longitude
-            )
+            # Validate proximity to the school geofence
+            valid = self.is_within_school_proximity(data['latitude'], data['longitude'], school)
             data['status'] = 'present' if valid else 'absent'
         return data
 
-    def is_within_school_proximity(self, lat1, lon1, lat2, lon2, radius=0.1):
-        """
-        Check if the distance between two coordinates is within a given radius (default: ~100 meters).
-        """
-        student_coords = (lat1, lon1)
-        school_coords = (lat2, lon2)
-        distance = geodesic(student_coords, school_coords).kilometers
-        return distance <= radius
-
-    def to_representation(self, instance):
+    def is_within_school_proximity(self, latitude, longitude, school):
         """
-        Customize representation to include nested data.
+        Check if the coordinates fall inside the school's geofence.
         """
-        representation = super().to_representation(instance)
-        representation['student'] = UserSerializer(instance.student).data
-        representation['school_class'] = SchoolClassSerializer(instance.school_class).data
-        return representation
+        return get_geofence(school).contains(latitude, longitude)
 
 
 class AchievementSerializer(serializers.ModelSerializer):
@@ -326,7 +508,7 @@ class LeaderboardSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Leaderboard
-        fields = ['id', 'user_profile', 'rank']
+        fields = ['id', 'user_profile', 'metric', 'score', 'rank']
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -341,6 +523,13 @@ class NotificationSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'message', 'created_at', 'is_read']
 
 
+class NotificationIdsSerializer(serializers.Serializer):
+    """
+    Список id уведомлений для массовых действий.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """
     Сериализатор для регистрации новых пользователей.
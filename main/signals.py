@@ -1,46 +1,346 @@
 # main/signals.py
 
 import logging
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver, Signal
 from django.db import transaction
-from django.core.cache import cache
-from .models import User, UserProfile, UserAchievement
+from django.utils.timezone import localtime, now
+from .models import (
+    User, School, SchoolClass, Subject, Schedule, Homework, SubmittedHomework,
+    Grade, Attendance, Achievement, UserProfile, UserAchievement, Leaderboard,
+    Notification, ParentChild, StudentTeacher
+)
+from rest_framework.authtoken.models import Token
+from . import caching, events, leaderboard, notifications
+from .authentication import evict_tokens, evict_user_tokens
+from .profiles import ensure_profiles
 
 # Получаем логгер для текущего модуля
 logger = logging.getLogger(__name__)
 
+# Sent by code that writes rows without per-row signals (bulk_create,
+# bulk_update, QuerySet.update/delete). The sender is the model class;
+# ``pks`` holds the affected primary keys where they are known, and
+# ``dates`` the days of written Attendance rows (default: today).
+bulk_write = Signal()
+
+# Models whose writes invalidate cached payloads that depend on them
+CACHED_MODELS = [
+    User, School, SchoolClass, Subject, Schedule, Homework, SubmittedHomework,
+    Grade, Attendance, Achievement, UserProfile, UserAchievement, Leaderboard,
+    Notification, ParentChild, StudentTeacher,
+]
+
+# Fields whose updates never affect cached payloads
+CACHE_IRRELEVANT_FIELDS = {'last_login'}
+
+# Fields of a user rendered in other users' payloads (UserSerializer,
+# dashboards). Those payloads depend on USER_DISPLAY_TAG instead of User, so
+# logins, password changes and other user writes leave them cached.
+USER_DISPLAY_FIELDS = ('username', 'email', 'first_name', 'last_name', 'role')
+USER_DISPLAY_TAG = 'user:display'
+
+
+def attendance_day_tag(day):
+    """
+    Cache tag of the attendance rows of one day.
+    """
+    return f'attendance:{day.isoformat()}'
+
 @receiver(post_save, sender=User)
-def manage_user_profile(sender, instance, created, **kwargs):
+def manage_user_profile(sender, instance, created, update_fields=None, **kwargs):
     """
-    Сигнал для создания или сохранения UserProfile при создании или обновлении User.
+    Сигнал для создания UserProfile при создании User.
+
+    Saves with ``update_fields`` (last_login on login, password changes) do
+    nothing: a profile holds no user data. A full save only creates the
+    profile of a user that was written without one.
     """
     try:
-        with transaction.atomic():
-            if created:
+        if created:
+            with transaction.atomic():
                 UserProfile.objects.create(user=instance)
-                logger.info(f"Создан профиль для пользователя: {instance.username}")
-            else:
-                # Ensure that the UserProfile exists before saving
-                user_profile, profile_created = UserProfile.objects.get_or_create(user=instance)
-                if not profile_created:
-                    user_profile.save()
-                    logger.info(f"Обновлён профиль для пользователя: {instance.username}")
-                else:
-                    logger.info(f"Создан профиль для пользователя при обновлении: {instance.username}")
+            logger.info(f"Создан профиль для пользователя: {instance.username}")
+        elif update_fields is None:
+            if ensure_profiles([instance.pk]):
+                logger.info(f"Создан профиль для пользователя при обновлении: {instance.username}")
     except Exception as e:
         logger.error(f"Ошибка при управлении профилем пользователя {instance.username}: {e}")
-        # Optionally, re-raise the exception if you want to propagate it
-        # raise e
+
+
+@receiver(bulk_write, sender=User)
+def create_bulk_user_profiles(sender, pks=None, **kwargs):
+    """
+    Users written with bulk_create get no post_save: their profiles are
+    created in one batch.
+    """
+    if not pks:
+        return
+    try:
+        ensure_profiles(pks)
+    except Exception as e:
+        logger.error(f"Ошибка при создании профилей пользователей: {e}")
+
+def _refresh_leaderboard_on_commit(refresh, metric, object_id):
+    """
+    Run a leaderboard refresh once the surrounding transaction commits, so that
+    cascading deletes have finished and a failed refresh never breaks the save.
+    """
+    def run():
+        try:
+            refresh(metric, object_id)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении таблицы лидеров ({metric}): {e}")
+
+    transaction.on_commit(run)
+
 
 @receiver(post_save, sender=UserAchievement)
 @receiver(post_delete, sender=UserAchievement)
-def invalidate_leaderboard_cache(sender, **kwargs):
+def update_xp_leaderboard(sender, instance, **kwargs):
+    """
+    Incrementally update the XP leaderboard entry of the affected profile.
+    """
+    _refresh_leaderboard_on_commit(leaderboard.refresh_for_profile, Leaderboard.XP, instance.user_profile_id)
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def update_attendance_leaderboard(sender, instance, **kwargs):
+    """
+    Incrementally update the attendance leaderboard entry of the affected student.
+    """
+    _refresh_leaderboard_on_commit(leaderboard.refresh_for_user, Leaderboard.ATTENDANCE, instance.student_id)
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def update_grades_leaderboard(sender, instance, **kwargs):
+    """
+    Incrementally update the grades leaderboard entry of the affected student.
+    """
+    _refresh_leaderboard_on_commit(leaderboard.refresh_for_user, Leaderboard.GRADES, instance.student_id)
+
+
+@receiver(m2m_changed, sender=SchoolClass.students.through)
+def update_class_leaderboards(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep class-scoped leaderboards in sync with class membership.
+    """
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    if reverse:
+        # instance is the student, pk_set holds class ids
+        changes = [(class_id, [instance.pk]) for class_id in pk_set]
+    else:
+        changes = [(instance.pk, list(pk_set))]
+
+    def run():
+        try:
+            backend = leaderboard.get_backend()
+            for class_id, user_ids in changes:
+                backend.update_class_membership(class_id, user_ids, added=(action == 'post_add'))
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении таблицы лидеров класса: {e}")
+
+    transaction.on_commit(run)
+
+
+@receiver(pre_delete, sender=UserProfile)
+def remove_leaderboard_entries(sender, instance, **kwargs):
+    """
+    Drop a deleted profile (or the profile of a deleted user) from every
+    leaderboard. Database ranks are shifted in the deleting transaction,
+    before the cascade removes the rows; sorted sets once it commits.
+    """
+    user_profile_id = instance.pk
+
+    def run():
+        try:
+            leaderboard.remove_profile(user_profile_id)
+        except Exception as e:
+            logger.error(f"Ошибка при удалении профиля {user_profile_id} из таблицы лидеров: {e}")
+
+    if leaderboard.get_backend().transactional:
+        run()
+    else:
+        transaction.on_commit(run)
+
+
+@receiver(pre_save, sender=User)
+def remember_stored_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Remember the stored school and display fields of a user being saved,
+    so that the save can be compared with them afterwards.
+    """
+    watched = {*USER_DISPLAY_FIELDS, 'school'}
+    if instance._state.adding or (update_fields is not None and not watched & set(update_fields)):
+        return
+    instance._stored_user = User.objects.filter(pk=instance.pk).values(*USER_DISPLAY_FIELDS, 'school_id').first()
+
+
+@receiver(post_save, sender=User)
+def apply_user_changes(sender, instance, created, **kwargs):
+    """
+    Invalidate payloads that display the user if a displayed field changed,
+    and move the leaderboard entries of a user who changed school.
+    """
+    stored = instance.__dict__.pop('_stored_user', None)
+    if created or stored is None:
+        return
+    if any(stored[field] != getattr(instance, field) for field in USER_DISPLAY_FIELDS):
+        caching.bump_on_commit(USER_DISPLAY_TAG)
+    old_school_id = stored['school_id']
+    if old_school_id == instance.school_id:
+        return
+    user_id, new_school_id = instance.pk, instance.school_id
+
+    def run():
+        try:
+            leaderboard.move_school(user_id, old_school_id, new_school_id)
+        except Exception as e:
+            logger.error(f"Ошибка при переносе пользователя {user_id} в таблицы лидеров другой школы: {e}")
+
+    transaction.on_commit(run)
+
+
+@receiver(post_delete, sender=User)
+@receiver(bulk_write, sender=User)
+def invalidate_user_display(sender, **kwargs):
+    """
+    Deleted users and users written in bulk may have changed displayed fields.
+    """
+    try:
+        caching.bump_on_commit(USER_DISPLAY_TAG)
+    except Exception as e:
+        logger.error(f"Ошибка при инвалидации кэша пользователей: {e}")
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def invalidate_attendance_day(sender, instance, **kwargs):
+    """
+    Invalidate payloads built from the attendance of the row's day only.
+    """
+    try:
+        caching.bump_on_commit(attendance_day_tag(instance.date))
+    except Exception as e:
+        logger.error(f"Ошибка при инвалидации кэша посещаемости: {e}")
+
+
+@receiver(bulk_write, sender=Attendance)
+def invalidate_bulk_attendance_days(sender, dates=None, **kwargs):
+    try:
+        caching.bump_on_commit(*[attendance_day_tag(day) for day in dates or [localtime(now()).date()]])
+    except Exception as e:
+        logger.error(f"Ошибка при инвалидации кэша посещаемости: {e}")
+
+
+@receiver(post_save, sender=Notification)
+def track_unread_notifications(sender, instance, created, **kwargs):
+    """
+    Keep the cached unread counter in step with single notification writes.
+    """
+    def run():
+        try:
+            if created:
+                if not instance.is_read:
+                    notifications.adjust_unread_count(instance.user_id, 1)
+            else:
+                # The previous is_read is unknown: the next read recounts
+                notifications.reset_unread_counts([instance.user_id])
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении счётчика непрочитанных уведомлений: {e}")
+
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Notification)
+def publish_new_notification(sender, instance, created, **kwargs):
+    """
+    Push a new notification to the user's event stream.
+    """
+    if created:
+        transaction.on_commit(lambda: events.publish_notifications([instance]))
+
+
+@receiver(post_save, sender=Attendance)
+def publish_attendance_change(sender, instance, **kwargs):
+    """
+    Push an attendance change to the event streams of the class teachers.
+    """
+    transaction.on_commit(lambda: events.publish_attendance([instance]))
+
+
+@receiver(post_delete, sender=Notification)
+def forget_unread_notifications(sender, instance, **kwargs):
+    def run():
+        try:
+            notifications.reset_unread_counts([instance.user_id])
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении счётчика непрочитанных уведомлений: {e}")
+
+    transaction.on_commit(run)
+
+
+def invalidate_model_cache(sender, update_fields=None, **kwargs):
+    """
+    Bump the cache generation of a model on save, delete or bulk write.
+    """
+    if update_fields and set(update_fields) <= CACHE_IRRELEVANT_FIELDS:
+        return
+    try:
+        caching.bump_on_commit(sender)
+    except Exception as e:
+        logger.error(f"Ошибка при инвалидации кэша для {sender.__name__}: {e}")
+
+
+def invalidate_m2m_cache(sender, instance, action, model, **kwargs):
+    """
+    Bump the cache generation of both sides of a many-to-many change.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    try:
+        caching.bump_on_commit(type(instance), model)
+    except Exception as e:
+        logger.error(f"Ошибка при инвалидации кэша для {sender.__name__}: {e}")
+
+
+for cached_model in CACHED_MODELS:
+    label = cached_model._meta.label_lower
+    post_save.connect(invalidate_model_cache, sender=cached_model, dispatch_uid=f'cache_save_{label}')
+    post_delete.connect(invalidate_model_cache, sender=cached_model, dispatch_uid=f'cache_delete_{label}')
+    bulk_write.connect(invalidate_model_cache, sender=cached_model, dispatch_uid=f'cache_bulk_{label}')
+
+for m2m_field in (SchoolClass.students, SchoolClass.teachers, SchoolClass.subjects):
+    m2m_changed.connect(
+        invalidate_m2m_cache,
+        sender=m2m_field.through,
+        dispatch_uid=f'cache_m2m_{m2m_field.through._meta.label_lower}',
+    )
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    """
+    Drop a deleted token (e.g. on logout) from the authentication cache.
+    """
+    try:
+        evict_tokens(instance.key)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении токена из кэша: {e}")
+
+
+@receiver(post_save, sender=User)
+def evict_user_token_cache(sender, instance, created, update_fields=None, **kwargs):
     """
-    Invalidate the leaderboard cache when a UserAchievement is created, updated, or deleted.
+    Drop a user's cached tokens when the user changes (password, role,
+    school, active flag), so the next request re-reads them.
     """
+    if created or (update_fields and set(update_fields) <= CACHE_IRRELEVANT_FIELDS):
+        return
     try:
-        cache.delete('leaderboard_data')
-        logger.info("Leaderboard cache invalidated due to UserAchievement change.")
+        evict_user_tokens(instance.pk)
     except Exception as e:
-        logger.error(f"Ошибка при инвалидации кэша лидеров: {e}")
+        logger.error(f"Ошибка при удалении токенов пользователя {instance.username} из кэша: {e}")
@@ -0,0 +1,106 @@
+# main/streams.py
+
+"""
+Server-sent events endpoint.
+
+Under ASGI (see the Procfile) an idle stream is a coroutine waiting on its
+queue, not a thread, so one worker holds thousands of open connections.
+Frames come from the broker of ``main.events``. Users receive their new
+notifications, and teachers also receive today's attendance changes of
+the classes they teach.
+"""
+
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import events
+from .authentication import ExpiringTokenAuthentication
+from .models import User, SchoolClass
+
+logger = logging.getLogger(__name__)
+
+# A comment line is sent after this many idle seconds, so proxies keep the connection open
+KEEPALIVE_INTERVAL = 15
+
+# Reconnection delay suggested to the client, in milliseconds
+RETRY_MILLISECONDS = 5000
+
+
+def _token_from(request):
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword == 'Token' and key.strip():
+        return key.strip()
+    # EventSource cannot set headers, so browsers pass the token in the query string
+    return request.GET.get('token')
+
+
+def _channels_of(user):
+    channels = [events.user_channel(user.pk)]
+    if user.role == User.TEACHER:
+        class_ids = SchoolClass.objects.filter(teachers=user).values_list('pk', flat=True)
+        channels += [events.class_attendance_channel(class_id) for class_id in class_ids]
+    return channels
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """
+    Unsubscribes when the server closes the response, even if the frame
+    generator is never closed.
+    """
+
+    def __init__(self, subscription):
+        super().__init__(_frames(subscription), content_type='text/event-stream')
+        self.subscription = subscription
+        self['Cache-Control'] = 'no-cache'
+        # Tells nginx-style proxies not to buffer the stream
+        self['X-Accel-Buffering'] = 'no'
+
+    def close(self):
+        super().close()
+        self.subscription.close()
+
+
+async def _frames(subscription):
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        while True:
+            try:
+                frame = await subscription.get(KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if frame is events.CLOSED:
+                break
+            yield frame
+    finally:
+        await subscription.broker.unsubscribe(subscription)
+
+
+@require_GET
+async def event_stream(request):
+    """
+    Stream of live events of the current user as text/event-stream.
+    """
+    key = _token_from(request)
+    if not key:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    try:
+        user, _ = await ExpiringTokenAuthentication().aauthenticate_credentials(key)
+    except AuthenticationFailed as e:
+        return JsonResponse({"detail": str(e.detail)}, status=401)
+
+    channels = await sync_to_async(_channels_of)(user)
+    broker = events.get_broker()
+    try:
+        subscription = await broker.subscribe(channels)
+    except Exception as e:
+        logger.error(f"Error opening the event stream of user {user.username}: {e}")
+        return JsonResponse({"error": "Event stream is unavailable."}, status=503)
+
+    logger.info(f"User {user.username} opened an event stream on {len(channels)} channels.")
+    return EventStreamResponse(subscription)
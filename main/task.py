@@ -1,39 +1,182 @@
+import datetime
+import logging
+import time
+
+import numpy as np
 from celery import shared_task
+from django.db.models import Exists, OuterRef, Subquery
 from django.utils.timezone import localtime, now
-from .models import User, Attendance
-from geopy.distance import geodesic
-import datetime
+from rest_framework.authtoken.models import Token
+
+from .models import User, School, SchoolClass, Attendance, Leaderboard, Notification
+from .authentication import TOKEN_EXPIRATION_TIME, evict_tokens
+from .geo import get_geofence
+from . import events, leaderboard, notifications
+from .signals import bulk_write
+
+logger = logging.getLogger(__name__)
+
+# Mock of the student's current coordinates until the mobile client reports them
+MOCK_STUDENT_COORDS = (42.8746, 74.6122)
+
+# Students are streamed from the database and written back in chunks of this size
+ATTENDANCE_CHUNK_SIZE = 1000
+
+
+def _student_rows(chunk_size, today):
+    """
+    Streams (student_id, school_id, class_id) for every student with a
+    located school and a class and no attendance for ``today`` yet, in a
+    single query. Students already marked, e.g. by a teacher's roll call,
+    are left alone.
+    """
+    first_class = SchoolClass.students.through.objects.filter(
+        user_id=OuterRef('pk')
+    ).order_by('schoolclass_id').values('schoolclass_id')[:1]
+    marked = Attendance.objects.filter(student_id=OuterRef('pk'), date=today)
+
+    return (
+        User.objects.filter(
+            role=User.STUDENT,
+            school__isnull=False,
+            school__latitude__isnull=False,
+            school__longitude__isnull=False,
+        )
+        .exclude(Exists(marked))
+        .annotate(class_id=Subquery(first_class))
+        .filter(class_id__isnull=False)
+        .order_by('pk')
+        .values_list('pk', 'school_id', 'class_id')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for row in iterable:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_chunk(rows, fences, student_coords, today):
+    """
+    Runs the geofence check for a whole chunk at once (one vectorized call per
+    school) and writes it with a single bulk insert. Rows marked since the
+    chunk was read are kept as they are (``unique_attendance`` conflicts
+    are ignored).
+    """
+    student_lats = np.full(len(rows), student_coords[0])
+    student_lons = np.full(len(rows), student_coords[1])
+    school_ids = np.array([school_id for _, school_id, _ in rows])
+
+    present = np.zeros(len(rows), dtype=bool)
+    for school_id in np.unique(school_ids):
+        mask = school_ids == school_id
+        present[mask] = fences[school_id].contains_many(student_lats[mask], student_lons[mask])
+
+    records = [
+        Attendance(
+            student_id=student_id,
+            school_id=school_id,
+            school_class_id=class_id,
+            date=today,
+            status='present' if is_present else 'absent',
+            latitude=student_coords[0],
+            longitude=student_coords[1],
+        )
+        for (student_id, school_id, class_id), is_present in zip(rows, present)
+    ]
+    Attendance.objects.bulk_create(records, ignore_conflicts=True)
+    events.publish_attendance(records)
+    return int(present.sum())
+
 
 @shared_task
-def check_attendance():
+def check_attendance(chunk_size=ATTENDANCE_CHUNK_SIZE):
     """
     Periodically check attendance for students near the school.
+    Students are processed in chunks: one streamed query, one vectorized
+    geofence check per school and one bulk insert per chunk. Only students
+    without attendance for today are checked, so statuses set by teachers
+    are never overwritten.
     """
-    students = User.objects.filter(role=User.STUDENT)
-    current_time = localtime(now()).time()
+    current = localtime(now())
 
     # Only check during a specific time window
-    if current_time >= datetime.time(10, 0) and current_time <= datetime.time(17, 0):
-        for student in students:
-            school = getattr(student, 'school', None)  # Get the student's associated school
-            if not school:
-                continue
-
-            # Mock or retrieve student's current coordinates
-            student_coords = (42.8746, 74.6122)  # Mocked coordinates
-            school_coords = (float(school.latitude), float(school.longitude))
-
-            # Calculate distance
-            distance = geodesic(student_coords, school_coords).kilometers
-            status = 'present' if distance <= 0.1 else 'late'
-
-            # Update or create attendance record
-            Attendance.objects.update_or_create(
-                student=student,
-                date=now().date(),
-                defaults={
-                    'status': status,
-                    'latitude': student_coords[0],
-                    'longitude': student_coords[1],
-                }
-            )
\ No newline at end of file
+    if not datetime.time(10, 0) <= current.time() <= datetime.time(17, 0):
+        return None
+
+    today = current.date()
+    total = present_total = 0
+    started = time.perf_counter()
+
+    fences = {
+        school.pk: get_geofence(school)
+        for school in School.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    }
+
+    for index, rows in enumerate(_chunks(_student_rows(chunk_size, today), chunk_size), start=1):
+        chunk_started = time.perf_counter()
+        present_total += _insert_chunk(rows, fences, MOCK_STUDENT_COORDS, today)
+        total += len(rows)
+        logger.info(
+            f"check_attendance chunk {index}: {len(rows)} students "
+            f"in {(time.perf_counter() - chunk_started) * 1000:.1f} ms"
+        )
+
+    # Bulk inserts bypass the per-row signals: invalidate cached data and
+    # re-rank attendance in one pass
+    if total:
+        bulk_write.send(sender=Attendance, dates=[today])
+        leaderboard.rebuild(Leaderboard.ATTENDANCE)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"check_attendance processed {total} students ({present_total} present) in {elapsed:.2f} s"
+    )
+    return {'processed': total, 'present': present_total, 'seconds': round(elapsed, 3)}
+
+
+@shared_task
+def purge_expired_tokens(batch_size=1000):
+    """
+    Deletes expired authentication tokens in batches, instead of one at a
+    time in the request path. Each batch is evicted from the authentication
+    cache with one call, then deleted with QuerySet.delete(), which keeps
+    the post_delete signal of each token. The batch size bounds the tokens
+    that delete() loads at a time.
+    """
+    expired = Token.objects.filter(created__lt=now() - TOKEN_EXPIRATION_TIME)
+    total = 0
+    while True:
+        keys = list(expired.values_list('key', flat=True)[:batch_size])
+        if not keys:
+            break
+        evict_tokens(*keys)
+        # Still filtered on expiry: a token refreshed since the SELECT is kept
+        deleted, _ = expired.filter(key__in=keys).delete()
+        total += deleted
+    logger.info(f"purge_expired_tokens deleted {total} expired tokens")
+    return total
+
+
+@shared_task
+def fan_out_notifications(event, object_ids, chunk_size=notifications.NOTIFICATION_CHUNK_SIZE, **params):
+    """
+    Notifies everyone concerned by an event (see main.notifications.EVENTS):
+    recipients are resolved with set-based queries and the notifications are
+    written with chunked bulk inserts.
+    """
+    started = time.perf_counter()
+    created = notifications.fan_out(event, object_ids, chunk_size=chunk_size, **params)
+    if created:
+        bulk_write.send(sender=Notification)
+    logger.info(
+        f"fan_out_notifications '{event}' created {created} notifications "
+        f"in {time.perf_counter() - started:.2f} s"
+    )
+    return created
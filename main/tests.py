@@ -1,3 +1,1731 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import hashlib
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localtime, now
+from openpyxl import load_workbook
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.throttling import UserRateThrottle
+
+from . import caching, dashboard, events, geo, leaderboard, notifications, scheduling, timetable, uploads
+from .authentication import (
+    TOKEN_EXPIRATION_TIME, TOKEN_REFRESH_INTERVAL, ExpiringTokenAuthentication, local_token_cache,
+)
+from .pagination import KeysetPagination
+from .signals import bulk_write
+from .task import check_attendance, fan_out_notifications, purge_expired_tokens
+from .models import (
+    School, SchoolClass, Subject, Schedule, Homework, SubmittedHomework,
+    Grade, Attendance, Achievement, UserProfile, UserAchievement,
+    Notification, ParentChild, Leaderboard
+)
+
+User = get_user_model()
+
+# Base seed size. It is kept below the page size (10), so that an N+1 query
+# shows up as a different query count between N and 10×N rows.
+SEED_SIZE = 3
+SCALE = 10
+
+# Generous wall-time limit for a single request on the test database, in seconds
+LATENCY_BUDGET = 2.0
+
+SCHOOL_LATITUDE = Decimal('42.874600')
+SCHOOL_LONGITUDE = Decimal('74.612200')
+
+# In-process cache, leaderboard and event backends, so that signals, cache
+# bumps and leaderboard hooks never reach the Redis of the stock settings
+isolated_backends = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    LEADERBOARD_BACKEND='main.leaderboard.InMemoryBackend',
+    EVENTS_BACKEND='main.events.InMemoryBroker',
+)
+
+
+@isolated_backends
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetTests(TestCase):
+    """
+    Calls every API endpoint as each role with N and 10×N seeded rows and
+    checks that the number of queries does not depend on the amount of data.
+    Wall time of every call is recorded and printed after the run.
+    """
+    timings = []
+    counter = itertools.count()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(
+            name='School', latitude=SCHOOL_LATITUDE, longitude=SCHOOL_LONGITUDE, geofence_radius=100,
+        )
+        cls.admin = User.objects.create(username='admin', role=User.TEACHER, is_staff=True, school=cls.school)
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=cls.school)
+        cls.parent = User.objects.create(username='parent', role=User.PARENT, school=cls.school)
+        cls.student.set_password('password')
+        cls.student.save()
+        cls.subject = Subject.objects.create(name='Subject')
+        cls.school_class = cls.create_class()
+        ParentChild.objects.create(parent=cls.parent, child=cls.student, school_class=cls.school_class)
+        cls.grow(SEED_SIZE)
+
+    @classmethod
+    def create_class(cls):
+        school_class = SchoolClass.objects.create(name=f'Class {next(cls.counter)}', school=cls.school)
+        school_class.teachers.add(cls.teacher)
+        school_class.students.add(cls.student)
+        school_class.subjects.add(cls.subject)
+        return school_class
+
+    @classmethod
+    def grow(cls, n):
+        """
+        Adds n rows of every kind, all visible to the main teacher, student and parent.
+        """
+        today = localtime(now()).date()
+        for _ in range(n):
+            index = next(cls.counter)
+            school_class = cls.create_class()
+            classmate = User.objects.create(username=f'classmate{index}', role=User.STUDENT, school=cls.school)
+            school_class.students.add(classmate)
+            subject = Subject.objects.create(name=f'Subject {index}')
+            school_class.subjects.add(subject)
+
+            Schedule.objects.create(
+                school_class=school_class, subject=subject, teacher=cls.teacher,
+                weekday=index % 7 + 1, start_time=datetime.time(8), end_time=datetime.time(9),
+            )
+            homework = Homework.objects.create(
+                subject=subject, school_class=school_class, teacher=cls.teacher,
+                description=f'Homework {index}', due_date=now() + datetime.timedelta(days=7),
+            )
+            SubmittedHomework.objects.create(homework=homework, student=cls.student)
+            Grade.objects.create(
+                student=cls.student, subject=subject, teacher=cls.teacher, grade=5, date=today,
+            )
+            Attendance.objects.create(
+                student=cls.student, school_class=school_class, school=cls.school,
+                date=today - datetime.timedelta(days=index + 1), status='present',
+            )
+            achievement = Achievement.objects.create(name=f'Achievement {index}', xp_reward=10)
+            UserAchievement.objects.create(user_profile=cls.student.profile, achievement=achievement)
+            for user in (cls.teacher, cls.student, cls.parent, cls.admin):
+                Notification.objects.create(user=user, message=f'Notification {index}')
+        UserProfile.objects.filter(user__role=User.STUDENT).update(xp=100)
+        for metric in leaderboard.METRICS:
+            leaderboard.rebuild(metric)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def endpoints(self, user):
+        """
+        Returns (name, method, url, data, prepare) for every endpoint available to the user.
+        """
+        homework = Homework.objects.filter(school_class=self.school_class).first() or Homework.objects.first()
+        submission = SubmittedHomework.objects.filter(student=self.student).first()
+        grade = Grade.objects.filter(student=self.student).first()
+        attendance = Attendance.objects.filter(student=self.student).first()
+        schedule = Schedule.objects.first()
+        notification = Notification.objects.filter(user=user).first()
+        profile = UserProfile.objects.get(user=user)
+
+        endpoints = [
+            ('me', 'get', '/api/me/', None, None),
+            ('dashboard', 'get', '/api/dashboard/', None, None),
+            ('classes', 'get', '/api/classes/', None, None),
+            ('class', 'get', f'/api/classes/{self.school_class.pk}/', None, None),
+            ('subjects', 'get', '/api/subjects/', None, None),
+            ('subject', 'get', f'/api/subjects/{self.subject.pk}/', None, None),
+            ('schedules', 'get', '/api/schedules/', None, None),
+            ('schedules expanded', 'get', '/api/schedules/?expand=school_class,subject,teacher', None, None),
+            ('schedule', 'get', f'/api/schedules/{schedule.pk}/', None, None),
+            ('schedules now', 'get', '/api/schedules/now/', None, None),
+            ('homeworks', 'get', '/api/homeworks/', None, None),
+            ('homeworks expanded', 'get', '/api/homeworks/?expand=school_class,subject', None, None),
+            ('homework', 'get', f'/api/homeworks/{homework.pk}/', None, None),
+            ('submitted homeworks', 'get', '/api/submitted-homeworks/', None, None),
+            ('submitted homeworks expanded', 'get', '/api/submitted-homeworks/?expand=homework,student', None, None),
+            ('submitted homeworks cursor', 'get', '/api/submitted-homeworks/?pagination=cursor', None, None),
+            ('submitted homework', 'get', f'/api/submitted-homeworks/{submission.pk}/', None, None),
+            ('grades', 'get', '/api/grades/', None, None),
+            ('grades expanded', 'get', '/api/grades/?expand=student,subject,teacher', None, None),
+            ('grades cursor', 'get', '/api/grades/?pagination=cursor', None, None),
+            ('grades export', 'get', '/api/grades/export/', None, None),
+            ('grades export xlsx', 'get', '/api/grades/export/?file_format=xlsx', None, None),
+            ('grade', 'get', f'/api/grades/{grade.pk}/', None, None),
+            ('attendances', 'get', '/api/attendances/', None, None),
+            ('attendances expanded', 'get', '/api/attendances/?expand=student,school_class', None, None),
+            ('attendances cursor', 'get', '/api/attendances/?pagination=cursor', None, None),
+            ('attendance', 'get', f'/api/attendances/{attendance.pk}/', None, None),
+            ('attendances export', 'get', '/api/attendances/export/', None, None),
+            ('attendances export xlsx', 'get', '/api/attendances/export/?file_format=xlsx', None, None),
+            ('attendances today', 'get', '/api/attendances/today/', None, None),
+            ('user profiles', 'get', '/api/user-profiles/', None, None),
+            ('user profile', 'get', f'/api/user-profiles/{profile.pk}/', None, None),
+            ('notifications', 'get', '/api/notifications/', None, None),
+            ('notifications cursor', 'get', '/api/notifications/?pagination=cursor', None, None),
+            ('notification', 'get', f'/api/notifications/{notification.pk}/', None, None),
+            ('notifications unread count', 'get', '/api/notifications/unread_count/', None, None),
+            (
+                'notifications mark read', 'post', '/api/notifications/mark_read/',
+                lambda: {'ids': list(Notification.objects.filter(user=user).values_list('pk', flat=True))},
+                None,
+            ),
+            (
+                'notifications mark all read', 'post', '/api/notifications/mark_all_read/', None,
+                lambda: Notification.objects.filter(user=user).update(is_read=False),
+            ),
+            ('leaderboard me', 'get', '/api/leaderboard/me/', None, None),
+            ('logout', 'post', '/api/logout/', None, lambda: Token.objects.get_or_create(user=user)),
+        ]
+        for metric in leaderboard.METRICS:
+            endpoints.append((f'leaderboard {metric}', 'get', f'/api/leaderboard/?metric={metric}', None, None))
+            endpoints.append((
+                f'leaderboard {metric} school', 'get',
+                f'/api/leaderboard/?metric={metric}&scope=school&scope_id={self.school.pk}', None, None,
+            ))
+        if user.is_staff:
+            endpoints += [
+                ('users', 'get', '/api/users/', None, None),
+                ('user', 'get', f'/api/users/{self.student.pk}/', None, None),
+                ('achievements', 'get', '/api/achievements/', None, None),
+            ]
+        if user == self.teacher:
+            # One row per student: the batch grows with N, only class members are valid
+            endpoints.append((
+                'grades bulk', 'post', '/api/grades/bulk/',
+                lambda: {
+                    'school_class': self.school_class.pk, 'subject': self.subject.pk,
+                    'grades': [
+                        {'student': pk, 'grade': '4.5'}
+                        for pk in User.objects.filter(role=User.STUDENT).values_list('pk', flat=True)
+                    ],
+                },
+                None,
+            ))
+            endpoints.append((
+                'roll call', 'post', '/api/attendances/roll_call/',
+                lambda: {
+                    'school_class': self.school_class.pk,
+                    'statuses': {
+                        str(pk): 'present'
+                        for pk in User.objects.filter(role=User.STUDENT).values_list('pk', flat=True)
+                    },
+                },
+                None,
+            ))
+        if user == self.student:
+            endpoints.append((
+                'mark attendance', 'post', '/api/attendances/mark_attendance/',
+                {'latitude': str(SCHOOL_LATITUDE), 'longitude': str(SCHOOL_LONGITUDE)},
+                lambda: Attendance.objects.filter(student=self.student, date=localtime(now()).date()).delete(),
+            ))
+        return endpoints
+
+    def anonymous_endpoints(self):
+        def register_data():
+            index = next(self.counter)
+            return {
+                'username': f'registered{index}', 'email': f'registered{index}@example.com',
+                'password': 'password', 'role': User.STUDENT,
+            }
+
+        return [
+            ('register', 'post', '/api/users/register/', register_data, None),
+            (
+                'login', 'post', '/api/login/', {'username': 'student', 'password': 'password'},
+                lambda: Token.objects.filter(user=self.student).delete(),
+            ),
+        ]
+
+    def measure(self, user, role, endpoints):
+        results = {}
+        for name, method, url, data, prepare in endpoints:
+            if prepare is not None:
+                prepare()
+            if callable(data):
+                data = data()
+            # Every call starts cold: no cached pages, generations or throttle history
+            cache.clear()
+            self.client.force_authenticate(user)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(self.client, method)(url, data, format='json')
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            self.assertLess(response.status_code, 500, f'{role} {name}: {response.status_code}')
+            self.assertLess(elapsed, LATENCY_BUDGET, f'{role} {name} took {elapsed:.3f} s')
+            self.timings.append((role, name, len(queries), elapsed))
+            results[name] = (response.status_code, len(queries))
+        return results
+
+    def assert_constant_queries(self, user, role, endpoints):
+        small = self.measure(user, role, endpoints())
+        self.grow(SEED_SIZE * (SCALE - 1))
+        large = self.measure(user, role, endpoints())
+        for name, (status_code, count) in small.items():
+            with self.subTest(role=role, endpoint=name):
+                self.assertEqual(large[name][0], status_code)
+                self.assertEqual(
+                    large[name][1], count,
+                    f'{role} {name}: {count} queries with {SEED_SIZE} rows, '
+                    f'{large[name][1]} with {SEED_SIZE * SCALE} rows',
+                )
+
+    def test_teacher(self):
+        self.assert_constant_queries(self.teacher, 'teacher', lambda: self.endpoints(self.teacher))
+
+    def test_student(self):
+        self.assert_constant_queries(self.student, 'student', lambda: self.endpoints(self.student))
+
+    def test_parent(self):
+        self.assert_constant_queries(self.parent, 'parent', lambda: self.endpoints(self.parent))
+
+    def test_admin(self):
+        self.assert_constant_queries(self.admin, 'admin', lambda: self.endpoints(self.admin))
+
+    def test_anonymous(self):
+        self.assert_constant_queries(None, 'anonymous', self.anonymous_endpoints)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        sys.stderr.write('\nEndpoint timings (role, endpoint, queries, ms):\n')
+        for role, name, queries, elapsed in cls.timings:
+            sys.stderr.write(f'  {role:<10} {name:<32} {queries:>4} {elapsed * 1000:8.1f}\n')
+
+
+@isolated_backends
+class UserProfileSignalTests(TestCase):
+    """
+    Profiles are created once per user and never touched by partial saves.
+    """
+
+    def test_partial_save_skips_profile(self):
+        user = User.objects.create(username='user', role=User.STUDENT)
+        user.last_login = now()
+        with CaptureQueriesContext(connection) as queries:
+            user.save(update_fields=['last_login'])
+        self.assertEqual(len(queries), 1)
+
+    def test_bulk_created_users_get_profiles(self):
+        users = User.objects.bulk_create([User(username=f'bulk{index}', role=User.STUDENT) for index in range(5)])
+        pks = [user.pk for user in users]
+        bulk_write.send(sender=User, pks=pks)
+        self.assertEqual(UserProfile.objects.filter(user_id__in=pks).count(), 5)
+        # Users that already have a profile cost a single SELECT
+        with CaptureQueriesContext(connection) as queries:
+            bulk_write.send(sender=User, pks=pks)
+        self.assertEqual(len(queries), 1)
+
+    def test_me_creates_missing_profile(self):
+        user = User.objects.bulk_create([User(username='lazy', role=User.STUDENT)])[0]
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+
+
+@isolated_backends
+class NotificationFanOutTests(TestCase):
+    """
+    Event notifications are written by a task whose query count does not
+    depend on the class size; the request only queues it on commit.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.subject = Subject.objects.create(name='Subject')
+
+    def create_class(self, size):
+        school_class = SchoolClass.objects.create(name=f'Class {size}', school=self.school)
+        school_class.teachers.add(self.teacher)
+        students = User.objects.bulk_create([
+            User(username=f'student{size}-{index}', role=User.STUDENT, school=self.school) for index in range(size)
+        ])
+        parents = User.objects.bulk_create([
+            User(username=f'parent{size}-{index}', role=User.PARENT) for index in range(size)
+        ])
+        school_class.students.add(*students)
+        ParentChild.objects.bulk_create([
+            ParentChild(parent=parent, child=student, school_class=school_class)
+            for parent, student in zip(parents, students)
+        ])
+        return school_class
+
+    def fan_out_homework(self, size):
+        school_class = self.create_class(size)
+        homework = Homework.objects.create(
+            subject=self.subject, school_class=school_class, teacher=self.teacher,
+            description='Read', due_date=now() + datetime.timedelta(days=1),
+        )
+        with CaptureQueriesContext(connection) as queries:
+            created = fan_out_notifications(notifications.HOMEWORK, [str(homework.pk)], chunk_size=50)
+        self.assertEqual(created, size * 2)
+        return len(queries)
+
+    def test_homework_fan_out_is_set_based(self):
+        # Only the number of chunked INSERTs grows with the class
+        self.assertEqual(self.fan_out_homework(20), self.fan_out_homework(40) - 1)
+
+    def test_grade_notifies_student_and_parents(self):
+        school_class = self.create_class(1)
+        student = school_class.students.get()
+        grades = Grade.objects.bulk_create([
+            Grade(student=student, subject=self.subject, teacher=self.teacher, grade=5, date=localtime(now()).date()),
+        ])
+        fan_out_notifications(notifications.GRADE, [grade.pk for grade in grades])
+        recipients = set(Notification.objects.values_list('user__username', flat=True))
+        self.assertEqual(recipients, {'student1-0', 'parent1-0'})
+
+    def test_request_queues_fan_out_on_commit(self):
+        school_class = self.create_class(3)
+        client = APIClient()
+        client.force_authenticate(self.teacher)
+        with patch('main.views.fan_out_notifications.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post('/api/homeworks/', {
+                    'subject': self.subject.pk, 'school_class': school_class.pk, 'description': 'Read',
+                    'due_date': (now() + datetime.timedelta(days=1)).isoformat(),
+                }, format='json')
+        self.assertEqual(response.status_code, 201)
+        delay.assert_called_once_with(notifications.HOMEWORK, [response.data['id']])
+        self.assertFalse(Notification.objects.exists())
+
+
+@isolated_backends
+class UnreadNotificationCounterTests(TestCase):
+    """
+    The unread badge is served from a cached counter kept in step by the
+    read actions.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', role=User.STUDENT)
+        self.notifications = Notification.objects.bulk_create([
+            Notification(user=self.user, message=f'Notification {index}') for index in range(5)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def unread_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/unread_count/')
+        return response.data['unread_count'], len(queries)
+
+    def test_counter_is_cached(self):
+        self.assertEqual(self.unread_count(), (5, 1))
+        self.assertEqual(self.unread_count(), (5, 0))
+
+    def test_mark_read_and_unread_adjust_counter(self):
+        self.unread_count()
+        ids = [notification.pk for notification in self.notifications[:3]]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/notifications/mark_read/', {'ids': ids}, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(self.unread_count(), (2, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/notifications/mark_unread/', {'ids': ids[:1]}, format='json')
+        self.assertEqual(self.unread_count(), (3, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/notifications/mark_all_read/')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(self.unread_count(), (0, 0))
+        self.assertFalse(Notification.objects.filter(is_read=False).exists())
+
+    def test_new_notification_increments_counter(self):
+        self.unread_count()
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, message='New')
+        self.assertEqual(self.unread_count(), (6, 0))
+
+
+class FakePubSub:
+    """
+    A Redis pub/sub connection in memory. An exception queued as a message
+    is raised by ``get_message``, as when the connection drops.
+    """
+
+    def __init__(self):
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, *keys):
+        self.channels.update(keys)
+
+    async def unsubscribe(self, *keys):
+        self.channels.difference_update(keys)
+
+    def publish(self, key, data):
+        if key in self.channels:
+            self.messages.put_nowait({'type': 'message', 'channel': key, 'data': data})
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            message = await asyncio.wait_for(self.messages.get(), timeout=0.05)
+        except TimeoutError:
+            return None
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def aclose(self):
+        pass
+
+
+class FakeRedisBroker(events.RedisBroker):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connections = []
+
+    def connect(self):
+        self.connections.append(FakePubSub())
+        return self.connections[-1]
+
+
+@isolated_backends
+class EventStreamTests(TestCase):
+    """
+    The SSE endpoint streams the events published for the user.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=cls.school)
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.school_class.teachers.add(cls.teacher)
+        cls.school_class.students.add(cls.student)
+
+    async def open_stream(self, user):
+        token = await sync_to_async(Token.objects.create)(user=user)
+        response = await self.async_client.get('/api/events/', {'token': token.key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = aiter(response.streaming_content)
+        self.assertTrue((await anext(frames)).startswith(b'retry:'))
+        return response, frames
+
+    async def next_frame(self, frames):
+        return (await asyncio.wait_for(anext(frames), timeout=1)).decode()
+
+    async def test_notifications_are_pushed(self):
+        response, frames = await self.open_stream(self.student)
+        # Producers publish from worker threads
+        await sync_to_async(Notification.objects.create)(user=self.student, message='Hello')
+        await sync_to_async(events.publish_notifications)(
+            await sync_to_async(list)(Notification.objects.filter(user=self.student))
+        )
+        frame = await self.next_frame(frames)
+        self.assertTrue(frame.startswith('event: notification\n'))
+        self.assertIn('"message":"Hello"', frame)
+        await frames.aclose()
+        # The server closes the response from a worker thread once the client is gone
+        await sync_to_async(response.close)()
+        await asyncio.sleep(0)
+        self.assertEqual(events.get_broker()._subscriptions, {})
+
+    async def test_teacher_receives_class_attendance(self):
+        response, frames = await self.open_stream(self.teacher)
+        record = Attendance(
+            student=self.student, school_class=self.school_class, school=self.school,
+            date=localtime(now()).date(), status='absent',
+        )
+        await sync_to_async(events.publish_attendance)([record])
+        frame = await self.next_frame(frames)
+        self.assertTrue(frame.startswith('event: attendance\n'))
+        self.assertIn(f'"student":{self.student.pk}', frame)
+        await frames.aclose()
+        await sync_to_async(response.close)()
+
+    async def test_stream_requires_token(self):
+        response = await self.async_client.get('/api/events/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_end_is_delivered_to_a_full_stream(self):
+        subscription = await events.InMemoryBroker().subscribe([events.user_channel(self.student.pk)])
+        for index in range(events.STREAM_QUEUE_SIZE):
+            subscription.put(f'frame {index}')
+        subscription.end()
+        frames = [await subscription.get(timeout=1) for _ in range(events.STREAM_QUEUE_SIZE)]
+        self.assertEqual(frames[-1], f'frame {events.STREAM_QUEUE_SIZE - 1}')
+        self.assertIs(await subscription.get(timeout=1), events.CLOSED)
+
+    async def test_streams_resubscribe_after_a_lost_connection(self):
+        broker = FakeRedisBroker(url='redis://unused')
+        channel = events.user_channel(self.student.pk)
+        key = broker.key(channel)
+        lost = await broker.subscribe([channel])
+        broker.connections[0].messages.put_nowait(ConnectionError('Connection reset'))
+        self.assertIs(await lost.get(timeout=1), events.CLOSED)
+
+        # The client reconnects before its old stream was unsubscribed
+        stream = await broker.subscribe([channel])
+        self.assertEqual(len(broker.connections), 2)
+        connection = broker.connections[1]
+        self.assertEqual(connection.channels, {key})
+        connection.publish(key, 'first')
+        self.assertEqual(await stream.get(timeout=1), 'first')
+
+        await broker.unsubscribe(lost)
+        connection.publish(key, 'second')
+        self.assertEqual(await stream.get(timeout=1), 'second')
+
+        reader = broker._reader
+        await broker.unsubscribe(stream)
+        self.assertEqual(connection.channels, set())
+        await asyncio.wait_for(reader, timeout=1)
+
+
+@isolated_backends
+class DashboardTests(TestCase):
+    """
+    The dashboard is scoped by role and served from the cache until its data changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.parent = User.objects.create(username='parent', role=User.PARENT, school=cls.school)
+        cls.subject = Subject.objects.create(name='Math')
+        today = localtime(now()).date()
+        cls.children = []
+        for index in range(2):
+            child = User.objects.create(username=f'child{index}', role=User.STUDENT, school=cls.school)
+            school_class = SchoolClass.objects.create(name=f'Class {index}', school=cls.school)
+            school_class.teachers.add(cls.teacher)
+            school_class.students.add(child)
+            ParentChild.objects.create(parent=cls.parent, child=child, school_class=school_class)
+            Schedule.objects.create(
+                school_class=school_class, subject=cls.subject, teacher=cls.teacher,
+                weekday=today.isoweekday(), start_time=datetime.time(8 + index), end_time=datetime.time(9 + index),
+            )
+            homework = Homework.objects.create(
+                subject=cls.subject, school_class=school_class, teacher=cls.teacher,
+                description=f'Homework {index}', due_date=now() + datetime.timedelta(days=1),
+            )
+            if index == 0:
+                SubmittedHomework.objects.create(homework=homework, student=child)
+            for day in range(8):
+                Grade.objects.create(
+                    student=child, subject=cls.subject, teacher=cls.teacher, grade=4,
+                    date=today - datetime.timedelta(days=day),
+                )
+            Attendance.objects.create(
+                student=child, school_class=school_class, school=cls.school, date=today, status='present',
+            )
+            cls.children.append(child)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get_dashboard(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_student(self):
+        Notification.objects.create(user=self.children[0], message='Hello')
+        data = self.get_dashboard(self.children[0])
+        self.assertEqual(data['unread_notifications'], 1)
+        student = data['student']
+        self.assertEqual([lesson['school_class'] for lesson in student['lessons']], ['Class 0'])
+        self.assertEqual([(hw['description'], hw['submitted']) for hw in student['homework']], [('Homework 0', True)])
+        self.assertEqual(len(student['grades']), dashboard.RECENT_GRADES)
+        self.assertEqual(student['attendance'][0]['status'], 'present')
+
+    def test_parent_gets_every_child(self):
+        data = self.get_dashboard(self.parent)
+        self.assertEqual([child['id'] for child in data['children']], [child.pk for child in self.children])
+        self.assertEqual(
+            [[hw['submitted'] for hw in child['homework']] for child in data['children']], [[True], [False]]
+        )
+
+    def test_teacher_gets_every_class(self):
+        data = self.get_dashboard(self.teacher)
+        self.assertEqual(len(data['lessons']), 2)
+        self.assertEqual([school_class['attendance'] for school_class in data['classes']], [{'present': 1}] * 2)
+        self.assertEqual([school_class['homework'][0]['submissions'] for school_class in data['classes']], [1, 0])
+        self.assertEqual(len(data['recent_grades']), dashboard.TEACHER_RECENT_GRADES)
+
+    def test_cached_until_data_changes(self):
+        self.get_dashboard(self.parent)
+        with CaptureQueriesContext(connection) as queries:
+            self.get_dashboard(self.parent)
+        self.assertEqual(len(queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubmittedHomework.objects.create(
+                homework=Homework.objects.get(description='Homework 1'), student=self.children[1]
+            )
+        data = self.get_dashboard(self.parent)
+        self.assertEqual([child['homework'][0]['submitted'] for child in data['children']], [True, True])
+
+
+@isolated_backends
+class TimetableTests(TestCase):
+    """
+    schedules/now answers from the compiled timetables.
+    """
+    # 2024-01-01 is a Monday
+    MONDAY = datetime.date(2024, 1, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=school)
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=school)
+        cls.school_class = SchoolClass.objects.create(name='Class', school=school)
+        cls.school_class.students.add(cls.student)
+        cls.subject = Subject.objects.create(name='Math')
+        for weekday, hour in ((1, 8), (1, 9), (5, 10)):
+            Schedule.objects.create(
+                school_class=cls.school_class, subject=cls.subject, teacher=cls.teacher,
+                weekday=weekday, start_time=datetime.time(hour), end_time=datetime.time(hour, 45),
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def lookup(self, user, day, hour, minute=0):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/schedules/now/', {'at': f'{day.isoformat()}T{hour:02d}:{minute:02d}:00'})
+        self.assertEqual(response.status_code, 200)
+        [entry] = response.json()['timetables']
+        return entry
+
+    def test_lookup(self):
+        lessons = [
+            timetable.Lesson(1, 1, datetime.time(8), datetime.time(9), 1, 'A', 1, 1),
+            timetable.Lesson(2, 3, datetime.time(8), datetime.time(9), 1, 'A', 1, 1),
+        ]
+        compiled = timetable.Timetable(reversed(lessons))
+        at = timetable.week_offset
+        self.assertEqual(compiled.lookup(at(1, datetime.time(8))), (lessons[0], lessons[1], 2 * 86400))
+        self.assertEqual(compiled.lookup(at(1, datetime.time(9)))[0], None)
+        self.assertEqual(compiled.lookup(at(2, datetime.time(0)))[:2], (None, lessons[1]))
+        self.assertEqual(compiled.lookup(at(7, datetime.time(23))), (None, lessons[0], 9 * 3600))
+        self.assertEqual(timetable.Timetable([]).lookup(0), (None, None, None))
+
+    def test_current_and_next(self):
+        entry = self.lookup(self.student, self.MONDAY, 8, 30)
+        self.assertEqual((entry['scope'], entry['id']), (timetable.CLASS, self.school_class.pk))
+        self.assertEqual(entry['current']['start_time'], '08:00:00')
+        self.assertEqual(entry['next']['start_time'], '09:00:00')
+
+        entry = self.lookup(self.teacher, self.MONDAY + datetime.timedelta(days=4), 11)
+        self.assertIsNone(entry['current'])
+        self.assertEqual(entry['next']['weekday'], 1)
+        self.assertTrue(entry['next']['starts_at'].startswith('2024-01-08T08:00:00'))
+
+    def test_served_from_cache_until_schedule_changes(self):
+        self.lookup(self.student, self.MONDAY, 8, 50)
+        with CaptureQueriesContext(connection) as queries:
+            entry = self.lookup(self.student, self.MONDAY, 8, 50)
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(entry['current'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Schedule.objects.filter(weekday=1, start_time=datetime.time(8)).update(end_time=datetime.time(8, 55))
+            bulk_write.send(sender=Schedule, pks=[])
+        entry = self.lookup(self.student, self.MONDAY, 8, 50)
+        self.assertEqual(entry['current']['end_time'], '08:55:00')
+
+    def test_scope_names_follow_renames(self):
+        self.assertEqual(self.lookup(self.teacher, self.MONDAY, 8)['name'], 'teacher')
+        self.assertEqual(self.lookup(self.student, self.MONDAY, 8)['name'], 'Class')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.username = 'renamed'
+            self.teacher.save()
+        self.assertEqual(self.lookup(self.teacher, self.MONDAY, 8)['name'], 'renamed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.school_class.name = 'Renamed class'
+            self.school_class.save()
+        self.assertEqual(self.lookup(self.student, self.MONDAY, 8)['name'], 'Renamed class')
+
+
+@isolated_backends
+class ScheduleConflictTests(TestCase):
+    """
+    Overlapping lessons of a teacher or class are rejected, and free teachers
+    are found from the interval index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.admin = User.objects.create(username='admin', role=User.TEACHER, is_staff=True, school=cls.school)
+        cls.teachers = [
+            User.objects.create(username=f'teacher{index}', role=User.TEACHER, school=cls.school)
+            for index in range(3)
+        ]
+        cls.classes = [SchoolClass.objects.create(name=f'Class {index}', school=cls.school) for index in range(2)]
+        cls.subject = Subject.objects.create(name='Math')
+        cls.lesson = Schedule.objects.create(
+            school_class=cls.classes[0], subject=cls.subject, teacher=cls.teachers[0],
+            weekday=1, start_time=datetime.time(9), end_time=datetime.time(10),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def row(self, school_class, teacher, start, end, weekday=1):
+        return {
+            'school_class': school_class.pk, 'subject': self.subject.pk, 'teacher': teacher.pk,
+            'weekday': weekday, 'start_time': start, 'end_time': end,
+        }
+
+    def test_interval_index_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        intervals = []
+        for value in range(300):
+            start = int(rng.integers(0, 1000))
+            intervals.append((start, start + int(rng.integers(1, 60)), value))
+        index = scheduling.IntervalIndex(intervals)
+        for start in range(0, 1060, 7):
+            end = start + 15
+            expected = {value for low, high, value in intervals if low < end and high > start}
+            self.assertEqual(set(index.overlapping(start, end)), expected)
+
+    def test_single_create_rejects_overlap(self):
+        response = self.client.post(
+            '/api/schedules/', self.row(self.classes[1], self.teachers[0], '09:30', '10:30'), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        # Back-to-back lessons do not overlap
+        response = self.client.post(
+            '/api/schedules/', self.row(self.classes[1], self.teachers[0], '10:00', '11:00'), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        # Editing a lesson does not conflict with itself
+        self.client.force_authenticate(self.teachers[0])
+        response = self.client.patch(f'/api/schedules/{self.lesson.pk}/', {'end_time': '09:45'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_import_reports_conflicts(self):
+        rows = [
+            self.row(self.classes[1], self.teachers[1], '08:00', '09:00'),
+            self.row(self.classes[1], self.teachers[2], '08:30', '09:30'),
+            self.row(self.classes[1], self.teachers[0], '09:30', '10:30'),
+            self.row(self.classes[1], self.teachers[1], '11:00', '12:00'),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/schedules/bulk/', {'schedules': rows}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [0, 1, 2])
+        self.assertLess(len(queries), 12)
+
+    def test_replace_is_all_or_nothing(self):
+        rows = [
+            self.row(self.classes[0], self.teachers[1], '09:00', '10:00'),
+            self.row(self.classes[0], self.teachers[1], '09:30', '10:30'),
+        ]
+        response = self.client.post('/api/schedules/bulk/', {'replace': True, 'schedules': rows}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Schedule.objects.filter(pk=self.lesson.pk).exists())
+
+        response = self.client.post(
+            '/api/schedules/bulk/', {'replace': True, 'schedules': rows[:1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(Schedule.objects.values_list('teacher_id', flat=True)), [self.teachers[1].pk])
+
+    def test_free_teachers(self):
+        response = self.client.get('/api/schedules/free_teachers/', {'weekday': 1, 'time': '09:15'})
+        self.assertEqual(response.status_code, 200)
+        free = {teacher['username'] for teacher in response.json()}
+        self.assertEqual(free, {'admin', 'teacher1', 'teacher2'})
+
+        response = self.client.get(
+            '/api/schedules/free_teachers/', {'weekday': 1, 'time': '10:00', 'end_time': '11:00'}
+        )
+        self.assertIn('teacher0', {teacher['username'] for teacher in response.json()})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Schedule.objects.create(
+                school_class=self.classes[1], subject=self.subject, teacher=self.teachers[1],
+                weekday=1, start_time=datetime.time(9), end_time=datetime.time(9, 30),
+            )
+        response = self.client.get('/api/schedules/free_teachers/', {'weekday': 1, 'time': '09:15'})
+        self.assertEqual({teacher['username'] for teacher in response.json()}, {'admin', 'teacher2'})
+
+
+@isolated_backends
+class AsyncEndpointTests(TestCase):
+    """
+    The async read endpoints return the same payloads as their DRF counterparts.
+    """
+    ENDPOINTS = [
+        ('/api/me/', '/api/async/me/'),
+        ('/api/schedules/', '/api/async/schedules/'),
+        ('/api/schedules/?page=2&ordering=-start_time', '/api/async/schedules/?page=2&ordering=-start_time'),
+        ('/api/schedules/?expand=subject,teacher', '/api/async/schedules/?expand=subject,teacher'),
+        ('/api/homeworks/?search=Homework 1', '/api/async/homeworks/?search=Homework 1'),
+        ('/api/homeworks/?page=9', '/api/async/homeworks/?page=9'),
+        ('/api/attendances/today/', '/api/async/attendances/today/'),
+        ('/api/leaderboard/?metric=xp', '/api/async/leaderboard/?metric=xp'),
+        ('/api/leaderboard/?scope=class', '/api/async/leaderboard/?scope=class'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=cls.school)
+        cls.parent = User.objects.create(username='parent', role=User.PARENT, school=cls.school)
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.school_class.teachers.add(cls.teacher)
+        cls.school_class.students.add(cls.student)
+        ParentChild.objects.create(parent=cls.parent, child=cls.student, school_class=cls.school_class)
+        subject = Subject.objects.create(name='Subject')
+        for index in range(12):
+            Schedule.objects.create(
+                school_class=cls.school_class, subject=subject, teacher=cls.teacher,
+                weekday=index % 5 + 1, start_time=datetime.time(8 + index), end_time=datetime.time(9 + index),
+            )
+            Homework.objects.create(
+                subject=subject, school_class=cls.school_class, teacher=cls.teacher,
+                description=f'Homework {index}', due_date=now() + datetime.timedelta(days=index),
+            )
+        Attendance.objects.create(
+            student=cls.student, school_class=cls.school_class, school=cls.school,
+            date=localtime(now()).date(), status='present',
+        )
+        UserProfile.objects.filter(user=cls.student).update(xp=50)
+        leaderboard.rebuild(Leaderboard.XP)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, user, url, **headers):
+        token, _ = Token.objects.get_or_create(user=user)
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}', **headers)
+
+    def test_async_payloads_match_sync(self):
+        for user in (self.teacher, self.student, self.parent):
+            for sync_url, async_url in self.ENDPOINTS:
+                with self.subTest(user=user.username, url=async_url):
+                    expected = self.get(user, sync_url)
+                    response = self.get(user, async_url)
+                    self.assertEqual(response.status_code, expected.status_code)
+                    # Page links point to the endpoint that was called
+                    self.assertEqual(
+                        response.content.replace(b'/api/async/', b'/api/'), expected.content
+                    )
+
+    def test_conditional_get(self):
+        response = self.get(self.student, '/api/async/schedules/')
+        self.assertEqual(response.status_code, 200)
+        response = self.get(self.student, '/api/async/schedules/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_token_is_required(self):
+        response = self.client.get('/api/async/me/')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/api/async/me/', HTTP_AUTHORIZATION='Token invalid')
+        self.assertEqual(response.status_code, 401)
+
+    def test_throttled_like_sync(self):
+        with patch.dict(UserRateThrottle.THROTTLE_RATES, {'user': '2/day'}):
+            self.get(self.student, '/api/async/me/')
+            self.get(self.student, '/api/me/')
+            response = self.get(self.student, '/api/async/me/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+@isolated_backends
+class SubmissionUploadTests(TestCase):
+    """
+    Submissions are streamed to storage with their hash, limited early and stored once per content.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.students = [
+            User.objects.create(username=f'student{index}', role=User.STUDENT, school=cls.school)
+            for index in range(2)
+        ]
+        cls.subject = Subject.objects.create(name='Math')
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.homework = Homework.objects.create(
+            subject=cls.subject, school_class=cls.school_class, teacher=cls.teacher,
+            description='Essay', due_date=now() + datetime.timedelta(days=1),
+        )
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root, HOMEWORK_UPLOAD_MAX_SIZE=1024)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client = APIClient()
+
+    def submit(self, student, content, name='essay.pdf', content_type='application/pdf'):
+        self.client.force_authenticate(student)
+        return self.client.post('/api/submitted-homeworks/', {
+            'homework': str(self.homework.pk),
+            'student': student.pk,
+            'submission_file': SimpleUploadedFile(name, content, content_type=content_type),
+        }, format='multipart')
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_upload_is_hashed_and_stored_by_content(self):
+        content = b'%PDF-1.4 essay'
+        response = self.submit(self.students[0], content)
+        self.assertEqual(response.status_code, 201, response.data)
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(response.data['content_hash'], digest)
+        name = f'{uploads.SUBMISSIONS_DIR}{digest[:2]}/{digest}.pdf'
+        self.assertEqual(SubmittedHomework.objects.get().submission_file.name, name)
+        self.assertEqual(self.stored_files(), [name])
+        with open(os.path.join(self.media_root, name), 'rb') as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_identical_files_are_stored_once(self):
+        self.assertEqual(self.submit(self.students[0], b'same answer').status_code, 201)
+        self.assertEqual(self.submit(self.students[1], b'same answer').status_code, 201)
+        names = set(SubmittedHomework.objects.values_list('submission_file', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(self.stored_files(), list(names))
+
+        # Resubmitting the same file returns the existing submission
+        response = self.submit(self.students[0], b'same answer')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SubmittedHomework.objects.count(), 2)
+        self.assertEqual(self.stored_files(), list(names))
+
+    def test_limits_are_enforced_without_keeping_files(self):
+        response = self.submit(self.students[0], b'x' * 1025)
+        self.assertEqual(response.status_code, 413)
+        response = self.submit(self.students[0], b'MZ', name='essay.exe', content_type='application/x-msdownload')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('submission_file', response.data)
+        self.assertFalse(SubmittedHomework.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rejected_submission_drops_staged_file(self):
+        self.client.force_authenticate(self.students[0])
+        response = self.client.post('/api/submitted-homeworks/', {
+            'homework': str(self.homework.pk),
+            'submission_file': SimpleUploadedFile('essay.pdf', b'answer', content_type='application/pdf'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failed_insert_removes_stored_file(self):
+        shared = b'shared answer'
+        self.assertEqual(self.submit(self.students[0], shared).status_code, 201)
+        kept = self.stored_files()
+        with patch.object(SubmittedHomework, 'save', side_effect=IntegrityError('insert failed')):
+            with self.assertRaises(IntegrityError):
+                self.submit(self.students[1], b'new answer')
+            # A file another submission refers to is kept
+            with self.assertRaises(IntegrityError):
+                self.submit(self.students[1], shared)
+        self.assertEqual(self.stored_files(), kept)
+        self.assertEqual(SubmittedHomework.objects.count(), 1)
+
+
+@isolated_backends
+class LeaderboardScopeTests(TestCase):
+    """
+    School and class leaderboards are readable only by their members and by staff.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School', email='school@example.com')
+        cls.other_school = School.objects.create(name='Other', email='other@example.com')
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=cls.school)
+        cls.parent = User.objects.create(username='parent', role=User.PARENT, school=cls.other_school)
+        cls.staff = User.objects.create(username='staff', role=User.TEACHER, school=cls.other_school, is_staff=True)
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.school_class.students.add(cls.student)
+        cls.other_class = SchoolClass.objects.create(name='Other class', school=cls.other_school)
+        ParentChild.objects.create(parent=cls.parent, child=cls.student, school_class=cls.school_class)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, user, url):
+        self.client.force_authenticate(user)
+        return self.client.get(url)
+
+    def test_members_read_their_own_scopes(self):
+        for user in (self.student, self.parent):
+            for scope, scope_id in (('school', self.school.pk), ('class', self.school_class.pk)):
+                url = f'/api/leaderboard/?scope={scope}&scope_id={scope_id}'
+                self.assertEqual(self.get(user, url).status_code, 200, (user.username, url))
+
+    def test_other_scopes_are_forbidden(self):
+        for scope, scope_id in (('school', self.other_school.pk), ('class', self.other_class.pk)):
+            for path in ('/api/leaderboard/', '/api/leaderboard/me/', '/api/async/leaderboard/'):
+                url = f'{path}?scope={scope}&scope_id={scope_id}'
+                if path.startswith('/api/async/'):
+                    token = Token.objects.get_or_create(user=self.student)[0]
+                    response = Client().get(url, HTTP_AUTHORIZATION=f'Token {token.key}')
+                else:
+                    response = self.get(self.student, url)
+                self.assertEqual(response.status_code, 403, url)
+
+    def test_staff_read_every_scope(self):
+        url = f'/api/leaderboard/?scope=class&scope_id={self.school_class.pk}'
+        self.assertEqual(self.get(self.staff, url).status_code, 200)
+
+
+@isolated_backends
+class LeaderboardMaintenanceTests(TestCase):
+    """
+    Deleted profiles leave every leaderboard and school changes move school-scoped entries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School', email='school@example.com')
+        cls.other_school = School.objects.create(name='Other', email='other@example.com')
+        cls.students = [
+            User.objects.create(username=f'student{index}', role=User.STUDENT, school=cls.school)
+            for index in range(3)
+        ]
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.school_class.students.add(*cls.students)
+
+    def setUp(self):
+        leaderboard.get_backend.cache_clear()
+        self.backend = leaderboard.get_backend()
+        for index, student in enumerate(self.students):
+            self.backend.update(Leaderboard.XP, student.profile.pk, student.pk, float(10 * (index + 1)))
+
+    def members(self, scope, scope_id=None):
+        key = leaderboard.scope_key(scope, scope_id)
+        return [entry.user_profile_id for entry in self.backend.page(Leaderboard.XP, key)]
+
+    def test_deleted_user_leaves_every_scope(self):
+        profile_id = self.students[1].profile.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.students[1].delete()
+        for scope, scope_id in ((leaderboard.GLOBAL, None), (leaderboard.SCHOOL, self.school.pk),
+                                (leaderboard.CLASS, self.school_class.pk)):
+            members = self.members(scope, scope_id)
+            self.assertEqual(len(members), 2)
+            self.assertNotIn(profile_id, members)
+
+    def test_school_change_moves_school_entries(self):
+        student = self.students[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            student.school = self.other_school
+            student.save()
+        self.assertNotIn(student.profile.pk, self.members(leaderboard.SCHOOL, self.school.pk))
+        self.assertEqual(self.members(leaderboard.SCHOOL, self.other_school.pk), [student.profile.pk])
+        self.assertIn(student.profile.pk, self.members(leaderboard.GLOBAL))
+
+    @override_settings(LEADERBOARD_BACKEND='main.leaderboard.DatabaseBackend')
+    def test_database_ranks_close_the_gap(self):
+        self.setUp()
+        self.students[2].delete()
+        ranks = list(Leaderboard.objects.filter(metric=Leaderboard.XP).order_by('rank').values_list('score', 'rank'))
+        self.assertEqual(ranks, [(20.0, 1), (10.0, 2)])
+
+
+@isolated_backends
+class CheckAttendanceTests(TestCase):
+    """
+    The periodic attendance check only fills in students nobody has marked yet.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(
+            name='School', email='school@example.com', latitude=SCHOOL_LATITUDE, longitude=SCHOOL_LONGITUDE,
+        )
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.students = [
+            User.objects.create(username=f'student{index}', role=User.STUDENT, school=cls.school)
+            for index in range(2)
+        ]
+        cls.school_class.students.add(*cls.students)
+
+    def test_roll_call_statuses_are_kept(self):
+        moment = datetime.datetime(2026, 10, 16, 12, 0, tzinfo=datetime.timezone.utc)
+        Attendance.objects.create(
+            student=self.students[0], school=self.school, school_class=self.school_class,
+            date=moment.date(), status='late',
+        )
+        with patch('main.task.now', return_value=moment):
+            result = check_attendance()
+            self.assertEqual(result['processed'], 1)
+            self.assertEqual(check_attendance()['processed'], 0)
+        statuses = dict(Attendance.objects.filter(date=moment.date()).values_list('student_id', 'status'))
+        self.assertEqual(statuses, {self.students[0].pk: 'late', self.students[1].pk: 'present'})
+
+
+@isolated_backends
+class ConditionalGetTests(TestCase):
+    """
+    Validators and cached dashboards change only with the data they render.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=cls.school)
+        cls.other = User.objects.create(username='other', role=User.STUDENT, school=cls.school)
+        cls.subject = Subject.objects.create(name='Math')
+        cls.school_class = SchoolClass.objects.create(name='Class', school=cls.school)
+        cls.school_class.students.add(cls.student, cls.other)
+        Grade.objects.create(student=cls.student, subject=cls.subject, teacher=cls.teacher, grade=4)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_grades_revalidate_until_a_relevant_write(self):
+        url = '/api/grades/?expand=teacher'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.set_password('secret')
+            self.other.save()
+            self.other.save(update_fields=['is_active'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.is_active = True
+            self.teacher.save()
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.first_name = 'Anna'
+            self.teacher.save()
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['teacher']['first_name'], 'Anna')
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.create(student=self.student, subject=self.subject, teacher=self.teacher, grade=5)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_writes_within_one_second_are_seen(self):
+        url = '/api/grades/'
+        # Two bumps in the same second, one before and one after the first response
+        in_one_second = patch('main.caching.time.time', return_value=1_700_000_000.2)
+        with in_one_second:
+            caching.bump(Grade)
+        response = self.client.get(url)
+        with in_one_second:
+            caching.bump(Grade)
+
+        last_modified, etag = response['Last-Modified'], response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.revalidate(url, response['ETag']).status_code, 304)
+
+    def test_dashboard_ignores_other_days_and_hidden_user_fields(self):
+        dashboard.get_dashboard(self.student)
+        today = localtime(now()).date()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.set_password('secret')
+            self.other.save()
+            Attendance.objects.create(
+                student=self.other, school_class=self.school_class, school=self.school,
+                date=today - datetime.timedelta(days=1), status='absent',
+            )
+        with self.assertNumQueries(0):
+            dashboard.get_dashboard(self.student)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.create(
+                student=self.student, school_class=self.school_class, school=self.school,
+                date=today, status='late',
+            )
+        self.assertEqual(dashboard.get_dashboard(self.student)['student']['attendance'][0]['status'], 'late')
+
+
+@isolated_backends
+class KeysetPaginationTests(TestCase):
+    """
+    Cursor pages walk tied sort keys in both directions without gaps or duplicates.
+    """
+    PAGE_SIZE = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.student = User.objects.create(username='student', role=User.STUDENT, school=cls.school)
+        cls.subject = Subject.objects.create(name='Math')
+        cls.first_day = datetime.date(2026, 9, 1)
+        # Eleven grades over three days, so pages split runs of equal dates
+        for index in range(11):
+            cls.add_grade(cls.first_day + datetime.timedelta(days=index % 3))
+
+    @classmethod
+    def add_grade(cls, date):
+        return Grade.objects.create(student=cls.student, subject=cls.subject, teacher=cls.teacher, grade=4, date=date)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def expected_ids(self):
+        return list(Grade.objects.order_by('-date', '-id').values_list('id', flat=True))
+
+    def walk(self, url, link='next', on_page=None):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            if on_page is not None:
+                on_page(len(pages))
+            url = response.data[link]
+        return pages
+
+    def test_walks_forward_and_back_over_ties(self):
+        pages = self.walk(f'/api/grades/?pagination=cursor&page_size={self.PAGE_SIZE}')
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+        self.assertEqual([pk for page in pages for pk in page], self.expected_ids())
+
+        last = self.client.get(f'/api/grades/?pagination=cursor&page_size={self.PAGE_SIZE}')
+        while last.data['next']:
+            last = self.client.get(last.data['next'])
+        backwards = self.walk(last.data['previous'], link='previous')
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_rows_inserted_mid_scroll(self):
+        inserted = []
+
+        def insert(page_number):
+            if page_number == 1:
+                # One row before the cursor, one after it
+                inserted.append(self.add_grade(self.first_day + datetime.timedelta(days=5)).pk)
+                inserted.append(self.add_grade(self.first_day - datetime.timedelta(days=1)).pk)
+
+        pages = self.walk(f'/api/grades/?pagination=cursor&page_size={self.PAGE_SIZE}', on_page=insert)
+        seen = [pk for page in pages for pk in page]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, [pk for pk in self.expected_ids() if pk != inserted[0]])
+
+    def test_malformed_cursor_is_not_found(self):
+        for cursor in ('garbage', 'eyJwIjpbMV0sInIiOmZhbHNlfQ==', 'eyJwIjpbIngiLCJ5Il0sInIiOmZhbHNlfQ=='):
+            response = self.client.get(f'/api/grades/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_nullable_sort_key_is_rejected(self):
+        request = Request(APIRequestFactory().get('/api/submitted-homeworks/'))
+        with self.assertRaises(ImproperlyConfigured):
+            KeysetPagination(ordering=('-grade', '-id')).paginate_queryset(SubmittedHomework.objects.all(), request)
+
+
+class GeofenceTests(TestCase):
+    """
+    Circle and polygon fences, the geodesic fallback near the boundary and the per-school cache.
+    """
+    # Meters per degree of latitude on the sphere used by the fast test
+    METERS_PER_DEGREE = geo.EARTH_RADIUS_M * np.pi / 180
+
+    def north_of_school(self, meters):
+        return float(SCHOOL_LATITUDE) + meters / self.METERS_PER_DEGREE, float(SCHOOL_LONGITUDE)
+
+    def test_circle_fence(self):
+        fence = geo.Geofence(SCHOOL_LATITUDE, SCHOOL_LONGITUDE, radius_m=100)
+        points = [self.north_of_school(50), self.north_of_school(200), (float(SCHOOL_LATITUDE), 75.0)]
+        with patch.object(geo.Geofence, 'distance_m') as distance_m:
+            self.assertEqual([fence.contains(*point) for point in points], [True, False, False])
+            self.assertEqual(list(fence.contains_many(*zip(*points))), [True, False, False])
+        distance_m.assert_not_called()
+
+    def test_boundary_band_uses_geodesic_distance(self):
+        fence = geo.Geofence(SCHOOL_LATITUDE, SCHOOL_LONGITUDE, radius_m=100)
+        for meters in (99.5, 100.5):
+            point = self.north_of_school(meters)
+            exact = fence.distance_m(*point) <= 100
+            with patch.object(geo.Geofence, 'distance_m', autospec=True, side_effect=geo.Geofence.distance_m) as distance_m:
+                self.assertEqual(fence.contains(*point), exact)
+                self.assertEqual(bool(fence.contains_many([point[0]], [point[1]])[0]), exact)
+            self.assertEqual(distance_m.call_count, 2)
+
+    def test_polygon_fence_replaces_the_circle(self):
+        lat, lon = float(SCHOOL_LATITUDE), float(SCHOOL_LONGITUDE)
+        # A triangle with its apex north of the school
+        fence = geo.Geofence(lat, lon, radius_m=100, polygon=[
+            [lat - 0.001, lon - 0.001], [lat - 0.001, lon + 0.001], [lat + 0.002, lon],
+        ])
+        points = [(lat, lon), (lat + 0.0015, lon), (lat + 0.0015, lon + 0.0009), (lat, lon + 0.002)]
+        self.assertEqual([fence.contains(*point) for point in points], [True, True, False, False])
+        self.assertEqual(list(fence.contains_many(*zip(*points))), [True, True, False, False])
+        with self.assertRaises(ValueError):
+            geo.Geofence(lat, lon, polygon=[[lat, lon], [lat + 1, lon]])
+
+    def test_cached_fence_follows_edits(self):
+        geo.clear_geofence_cache()
+        school = School.objects.create(name='School', latitude=SCHOOL_LATITUDE, longitude=SCHOOL_LONGITUDE)
+        fence = geo.get_geofence(school)
+        self.assertIs(geo.get_geofence(School.objects.get(pk=school.pk)), fence)
+        point = self.north_of_school(150)
+        self.assertFalse(fence.contains(*point))
+
+        school.geofence_radius = 200
+        school.save()
+        edited = geo.get_geofence(School.objects.get(pk=school.pk))
+        self.assertIsNot(edited, fence)
+        self.assertTrue(edited.contains(*point))
+        self.assertIsNone(geo.get_geofence(School(name='Unlocated')))
+
+
+@isolated_backends
+class RosterImportTests(TestCase):
+    """
+    import_roster creates users, profiles, memberships and parent links in bulk, once.
+    """
+    ROSTER = (
+        'role,full_name,class,children\n'
+        'student,Иванов Иван,5A,\n'
+        'student,Петрова Анна,5A,\n'
+        'teacher,Сидоров Петр,5A;5B,\n'
+        'parent,Иванова Мария,,Иванов Иван\n'
+    )
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.credentials = os.path.join(self.directory, 'credentials.txt')
+
+    def write_roster(self, content, name='roster.csv'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as roster_file:
+            roster_file.write(content)
+        return path
+
+    def import_roster(self, path, *args):
+        out = StringIO()
+        call_command(
+            'import_roster', path, '--school', 'School', '--credentials', self.credentials, '--workers', '1',
+            *args, stdout=out, stderr=StringIO(),
+        )
+        return out.getvalue()
+
+    def snapshot(self):
+        return (
+            sorted(User.objects.values_list('username', 'first_name', 'last_name', 'role', 'school__name')),
+            sorted(UserProfile.objects.values_list('user__username', 'school_class__name')),
+            sorted(SchoolClass.students.through.objects.values_list('schoolclass__name', 'user__username')),
+            sorted(SchoolClass.teachers.through.objects.values_list('schoolclass__name', 'user__username')),
+            sorted(ParentChild.objects.values_list('parent__username', 'child__username', 'school_class__name')),
+        )
+
+    def test_import_creates_everything_once(self):
+        path = self.write_roster(self.ROSTER)
+        self.import_roster(path)
+
+        users = {user.last_name: user for user in User.objects.all()}
+        self.assertEqual(sorted(users), ['Иванов', 'Иванова', 'Петрова', 'Сидоров'])
+        ivanov, petrova, sidorov, ivanova = users['Иванов'], users['Петрова'], users['Сидоров'], users['Иванова']
+        self.assertEqual((ivanov.first_name, ivanov.role, ivanov.school.name), ('Иван', User.STUDENT, 'School'))
+        self.assertEqual(sidorov.role, User.TEACHER)
+        self.assertEqual(ivanova.role, User.PARENT)
+        self.assertIsNone(ivanova.school)
+
+        self.assertEqual(UserProfile.objects.count(), 4)
+        self.assertEqual(UserProfile.objects.get(user=ivanov).school_class.name, '5A')
+        self.assertIsNone(UserProfile.objects.get(user=sidorov).school_class)
+        class_5a = SchoolClass.objects.get(school__name='School', name='5A')
+        self.assertEqual(set(class_5a.students.all()), {ivanov, petrova})
+        self.assertEqual(set(sidorov.teaching_classes.values_list('name', flat=True)), {'5A', '5B'})
+        self.assertEqual(
+            list(ParentChild.objects.values_list('parent', 'child', 'school_class')),
+            [(ivanova.pk, ivanov.pk, class_5a.pk)],
+        )
+
+        with open(self.credentials, encoding='utf-8') as credentials_file:
+            header, *lines = credentials_file.read().splitlines()
+        self.assertEqual(header, 'Class\tUsername\tPassword\tRole\tFull name')
+        self.assertEqual(len(lines), 4)
+        for line in lines:
+            class_name, username, password, role, full_name = line.split('\t')
+            user = User.objects.get(username=username)
+            self.assertTrue(user.check_password(password))
+            self.assertEqual((role, full_name), (user.role, f'{user.last_name} {user.first_name}'))
+        self.assertIn(f'5A\t{ivanov.username}\t', '\n'.join(lines))
+
+        # A second import of the same roster matches every row and writes nothing
+        state = self.snapshot()
+        os.remove(self.credentials)
+        self.import_roster(path)
+        self.assertEqual(self.snapshot(), state)
+        self.assertFalse(os.path.exists(self.credentials))
+
+    def test_rejected_rows_are_reported(self):
+        path = self.write_roster(
+            'role,full_name,class,children\n'
+            'student,Иванов Иван,5A,\n'
+            'janitor,Кузнецов Олег,,\n'
+            'parent,Иванова Мария,,Неизвестный Ребенок\n'
+        )
+        err = StringIO()
+        call_command(
+            'import_roster', path, '--school', 'School', '--credentials', self.credentials, '--workers', '1',
+            stdout=StringIO(), stderr=err,
+        )
+        self.assertIn("Line 3: Unknown role 'janitor'.", err.getvalue())
+        self.assertIn("Line 4: Unknown child 'Неизвестный Ребенок'.", err.getvalue())
+        self.assertFalse(ParentChild.objects.exists())
+        self.assertEqual(User.objects.filter(last_name='Иванов').count(), 1)
+
+    def test_reconcile_applies_the_diff(self):
+        self.import_roster(self.write_roster(
+            'role,username,full_name,class,children\n'
+            'student,s1,Иванов Иван,5A,\n'
+            'student,s2,Петрова Анна,5A,\n'
+            'teacher,t1,Сидоров Петр,5A;5B,\n'
+            'parent,p1,Иванова Мария,,s1\n'
+        ))
+        token = Token.objects.create(user=User.objects.get(username='s1'))
+        ExpiringTokenAuthentication().authenticate_credentials(token.key)
+        changed = self.write_roster(
+            'role,username,full_name,class,children\n'
+            'student,s1,Иванов Иоанн,5A,\n'
+            'student,s2,Петрова Анна,5B,\n'
+            'teacher,t1,Сидоров Петр,5A,\n'
+            'parent,p1,Иванова Мария,,\n',
+            name='changed.csv',
+        )
+
+        state = self.snapshot()
+        os.remove(self.credentials)
+        report = self.import_roster(changed, '--reconcile', '--dry-run', '-v', '2')
+        self.assertEqual(self.snapshot(), state)
+        self.assertEqual(School.objects.count(), 1)
+        self.assertFalse(os.path.exists(self.credentials))
+        for line in [
+            'Dry run: nothing was written.',
+            'Users to create                     0',
+            'Users to rename                     1',
+            '  ~ s1: Иванов Иван -> Иванов Иоанн',
+            '  ~ s2: 5A -> 5B',
+            '  + student s2 -> 5B',
+            '  - student s2 -> 5A',
+            '  - teacher t1 -> 5B',
+            '  - p1 -> s1 (5A)',
+        ]:
+            self.assertIn(line, report)
+
+        report = self.import_roster(changed, '--reconcile')
+        self.assertIn('Reconciled: 1 renamed, 1 moved, 3 links removed.', report)
+        self.assertEqual(User.objects.get(username='s1').first_name, 'Иоанн')
+        self.assertEqual(UserProfile.objects.get(user__username='s2').school_class.name, '5B')
+        self.assertEqual(
+            sorted(SchoolClass.students.through.objects.values_list('schoolclass__name', 'user__username')),
+            [('5A', 's1'), ('5B', 's2')],
+        )
+        self.assertEqual(list(User.objects.get(username='t1').teaching_classes.values_list('name', flat=True)), ['5A'])
+        self.assertFalse(ParentChild.objects.exists())
+        # Users and classes are never deleted
+        self.assertEqual(User.objects.count(), 4)
+        self.assertTrue(SchoolClass.objects.filter(name='5B').exists())
+
+        # The rename went through bulk_update: the cached token must not keep the old name
+        self.assertIsNone(local_token_cache.get(token.key))
+        user, _ = ExpiringTokenAuthentication().authenticate_credentials(token.key)
+        self.assertEqual(user.first_name, 'Иоанн')
+
+    def test_dry_run_creates_no_school(self):
+        report = self.import_roster(self.write_roster(self.ROSTER), '--dry-run')
+        self.assertIn("School 'School' would be created.", report)
+        self.assertIn('Users to create                     4', report)
+        self.assertFalse(School.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+@isolated_backends
+class TokenCacheTests(TestCase):
+    """
+    Tokens are served from the cache without queries and evicted whenever they or their user change.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.user = User.objects.create_user(username='student', password='secret', role=User.STUDENT, school=cls.school)
+
+    def setUp(self):
+        local_token_cache.clear()
+        cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = ExpiringTokenAuthentication()
+
+    def authenticate(self, key=None):
+        return self.authentication.authenticate_credentials(key or self.token.key)
+
+    def assertEvicted(self, key):
+        self.assertIsNone(local_token_cache.get(key))
+        self.assertIsNone(cache.get(f'auth_token:{key}'))
+
+    def test_cached_token_needs_no_query(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user.pk, user.role, user.school_id), (self.user.pk, User.STUDENT, self.school.pk))
+        self.assertEqual(token.key, self.token.key)
+
+        # The shared tier serves another process whose local cache is empty
+        local_token_cache.clear()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_logout_evicts_token(self):
+        self.authenticate()
+        response = APIClient().post('/api/logout/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEvicted(self.token.key)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_user_changes_evict_tokens(self):
+        self.authenticate()
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEvicted(self.token.key)
+
+        self.authenticate()
+        self.user.role = User.TEACHER
+        self.user.save(update_fields=['role'])
+        self.assertEvicted(self.token.key)
+        self.assertEqual(self.authenticate()[0].role, User.TEACHER)
+
+        # A login only touches last_login and keeps the cache
+        self.user.last_login = now()
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(local_token_cache.get(self.token.key))
+
+    def test_sliding_refresh(self):
+        stale = now() - TOKEN_REFRESH_INTERVAL - datetime.timedelta(minutes=1)
+        Token.objects.filter(pk=self.token.pk).update(created=stale)
+        self.authenticate()
+        refreshed = Token.objects.get(pk=self.token.pk).created
+        self.assertGreater(refreshed, stale + TOKEN_REFRESH_INTERVAL)
+        self.assertEqual(local_token_cache.get(self.token.key)['created'], refreshed)
+
+        # Within the refresh interval the token is not written again
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+        Token.objects.filter(pk=self.token.pk).update(created=now() - TOKEN_EXPIRATION_TIME)
+        local_token_cache.clear()
+        cache.clear()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+        self.assertEvicted(self.token.key)
+
+    def test_purge_evicts_expired_tokens(self):
+        other = User.objects.create(username='other', role=User.STUDENT, school=self.school)
+        expired = Token.objects.create(user=other)
+        self.authenticate()
+        self.authenticate(expired.key)
+        Token.objects.filter(pk=expired.pk).update(created=now() - TOKEN_EXPIRATION_TIME - datetime.timedelta(minutes=1))
+
+        self.assertEqual(purge_expired_tokens(batch_size=1), 1)
+        self.assertEqual(list(Token.objects.values_list('key', flat=True)), [self.token.key])
+        self.assertEvicted(expired.key)
+        self.assertIsNotNone(local_token_cache.get(self.token.key))
+
+
+@isolated_backends
+class ExportTests(TestCase):
+    """
+    Exported text that a spreadsheet would evaluate as a formula is written as text.
+    """
+    COMMENT = '=HYPERLINK("http://example.com","click")'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = School.objects.create(name='School')
+        cls.teacher = User.objects.create(username='teacher', role=User.TEACHER, school=cls.school)
+        cls.student = User.objects.create(
+            username='student', first_name='Анна', last_name='+Иванова', role=User.STUDENT, school=cls.school,
+        )
+        Grade.objects.create(
+            student=cls.student, subject=Subject.objects.create(name='@Math'), teacher=cls.teacher,
+            grade=5, date=localtime().date(), comments=cls.COMMENT,
+        )
+
+    def export(self, file_format):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        response = client.get('/api/grades/export/', {'file_format': file_format})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_escapes_formulas(self):
+        header, row = csv.reader(self.export('csv').decode('utf-8-sig').splitlines())
+        values = dict(zip(header, row))
+        self.assertEqual(values['Comments'], f"'{self.COMMENT}")
+        self.assertEqual(values['Last name'], "'+Иванова")
+        self.assertEqual(values['Subject'], "'@Math")
+        self.assertEqual((values['First name'], values['Student']), ('Анна', 'student'))
+
+    def test_xlsx_writes_formulas_as_strings(self):
+        workbook = load_workbook(BytesIO(self.export('xlsx')))
+        header, row = workbook.active.iter_rows()
+        cells = {title.value: cell for title, cell in zip(header, row)}
+        self.assertEqual((cells['Comments'].value, cells['Comments'].data_type), (self.COMMENT, 's'))
+        self.assertEqual((cells['Last name'].value, cells['Last name'].data_type), ('+Иванова', 's'))
+        self.assertEqual(cells['Grade'].data_type, 'n')
@@ -0,0 +1,189 @@
+# main/timetable.py
+
+"""
+Compiled weekly timetables.
+
+A timetable is the week of one class or one teacher compiled into arrays
+sorted by start time: the lessons as plain tuples and their starts and ends
+as seconds since Monday 00:00. Finding the current and the next lesson is a
+binary search over the starts, O(log n), with no database access.
+
+Compiled timetables live in the versioned cache (see ``main.caching``) and
+are rebuilt only after a ``Schedule`` or ``Subject`` row changes. The
+classes a user follows are cached the same way until class membership or
+parent links change. Lessons of one timetable are expected not to overlap:
+a lesson that starts while another is running replaces it as current.
+"""
+
+import bisect
+import datetime
+from collections import namedtuple
+
+from . import caching
+from .models import User, SchoolClass, Subject, Schedule, ParentChild
+
+CLASS = 'class'
+TEACHER = 'teacher'
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+# Models whose changes invalidate compiled timetables
+TIMETABLE_CACHE_DEPENDENCIES = [Schedule, Subject]
+
+# Models whose changes invalidate the timetables a user follows
+SCOPE_CACHE_DEPENDENCIES = [SchoolClass, ParentChild]
+
+# Compiled timetables are invalidated by generation; the timeout only
+# bounds how long unreachable generations stay in the cache (seconds)
+TIMETABLE_CACHE_TIMEOUT = 24 * 60 * 60
+
+Lesson = namedtuple(
+    'Lesson', 'id weekday start_time end_time subject_id subject school_class_id teacher_id'
+)
+
+
+def week_offset(weekday, time):
+    """
+    Seconds from Monday 00:00 to ``time`` on ISO ``weekday`` (1 = Monday).
+    """
+    return (weekday - 1) * SECONDS_PER_DAY + time.hour * 3600 + time.minute * 60 + time.second
+
+
+class Timetable:
+    """
+    The lessons of a week sorted by start, with their starts and ends as
+    week offsets for binary search.
+    """
+    __slots__ = ('lessons', 'starts', 'ends')
+
+    def __init__(self, lessons):
+        self.lessons = sorted(lessons, key=lambda lesson: (lesson.weekday, lesson.start_time, lesson.id))
+        self.starts = [week_offset(lesson.weekday, lesson.start_time) for lesson in self.lessons]
+        self.ends = [week_offset(lesson.weekday, lesson.end_time) for lesson in self.lessons]
+
+    def __len__(self):
+        return len(self.lessons)
+
+    def lookup(self, offset):
+        """
+        Returns (current lesson or None, next lesson or None, seconds until
+        the next lesson starts) at week offset ``offset``. After the last
+        lesson of the week the next one is the first lesson of next week.
+        """
+        if not self.lessons:
+            return None, None, None
+        index = bisect.bisect_right(self.starts, offset) - 1
+        current = self.lessons[index] if index >= 0 and offset < self.ends[index] else None
+        following = index + 1
+        if following < len(self.lessons):
+            return current, self.lessons[following], self.starts[following] - offset
+        return current, self.lessons[0], self.starts[0] + SECONDS_PER_WEEK - offset
+
+
+def compile_timetables(scopes):
+    """
+    Compiles the timetables of [(scope, id)] with one query per kind of scope.
+    """
+    lessons = {key: [] for key in scopes}
+    for scope, field in ((CLASS, 'school_class_id'), (TEACHER, 'teacher_id')):
+        ids = [scope_id for kind, scope_id in scopes if kind == scope]
+        if not ids:
+            continue
+        rows = Schedule.objects.filter(**{f'{field}__in': ids}).values_list(
+            'id', 'weekday', 'start_time', 'end_time', 'subject_id', 'subject__name', 'school_class_id', 'teacher_id',
+        )
+        for row in rows:
+            lesson = Lesson(*row)
+            lessons[(scope, getattr(lesson, field))].append(lesson)
+    return {key: Timetable(items) for key, items in lessons.items()}
+
+
+def _cache_key(scope, scope_id):
+    return f'timetable:{scope}:{scope_id}'
+
+
+def get_timetables(scopes):
+    """
+    Returns {(scope, id): compiled timetable} for classes and teachers;
+    the ones that are not cached are compiled together.
+    """
+    keys = {_cache_key(scope, scope_id): (scope, scope_id) for scope, scope_id in scopes}
+    cached = caching.get_many_or_set(
+        list(keys),
+        lambda missing: {
+            _cache_key(*key): compiled
+            for key, compiled in compile_timetables([keys[cache_key] for cache_key in missing]).items()
+        },
+        depends_on=TIMETABLE_CACHE_DEPENDENCIES,
+        timeout=TIMETABLE_CACHE_TIMEOUT,
+    )
+    return {keys[cache_key]: compiled for cache_key, compiled in cached.items()}
+
+
+def get_timetable(scope, scope_id):
+    """
+    Returns the compiled timetable of a class or a teacher.
+    """
+    return get_timetables([(scope, scope_id)])[(scope, scope_id)]
+
+
+def get_scopes(user):
+    """
+    Returns [(scope, id, name)] of the timetables the user follows: their
+    own as a teacher, their classes as a student, their children's classes
+    as a parent.
+    """
+    # A teacher's scope needs no query; it is not cached, so a rename shows at once
+    if user.role == User.TEACHER:
+        return [(TEACHER, user.pk, user.username)]
+
+    def build():
+        if user.role == User.STUDENT:
+            classes = SchoolClass.objects.filter(students=user)
+        elif user.role == User.PARENT:
+            children = ParentChild.objects.filter(parent=user).values('child_id')
+            classes = SchoolClass.objects.filter(students__in=children).distinct()
+        else:
+            return []
+        return [(CLASS, class_id, name) for class_id, name in classes.order_by('name', 'pk').values_list('id', 'name')]
+
+    return caching.get_or_set(
+        f'timetable_scopes:{user.pk}:{user.role}',
+        build,
+        depends_on=SCOPE_CACHE_DEPENDENCIES,
+        timeout=TIMETABLE_CACHE_TIMEOUT,
+    )
+
+
+def _lesson_data(lesson, starts_at):
+    duration = week_offset(lesson.weekday, lesson.end_time) - week_offset(lesson.weekday, lesson.start_time)
+    return {
+        'id': lesson.id,
+        'weekday': lesson.weekday,
+        'start_time': lesson.start_time.isoformat(),
+        'end_time': lesson.end_time.isoformat(),
+        'subject_id': lesson.subject_id,
+        'subject': lesson.subject,
+        'school_class_id': lesson.school_class_id,
+        'teacher_id': lesson.teacher_id,
+        'starts_at': starts_at,
+        'ends_at': starts_at + datetime.timedelta(seconds=duration),
+    }
+
+
+def current_and_next(timetable, moment):
+    """
+    Returns {'current': lesson or None, 'next': lesson or None} at the local
+    datetime ``moment``, with the dates the lessons start and end.
+    """
+    offset = week_offset(moment.isoweekday(), moment.time())
+    current, following, starts_in = timetable.lookup(offset)
+    moment = moment.replace(microsecond=0)
+    data = {'current': None, 'next': None}
+    if current is not None:
+        started_ago = offset - week_offset(current.weekday, current.start_time)
+        data['current'] = _lesson_data(current, moment - datetime.timedelta(seconds=started_ago))
+    if following is not None:
+        data['next'] = _lesson_data(following, moment + datetime.timedelta(seconds=starts_in))
+    return data
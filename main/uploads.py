@@ -0,0 +1,265 @@
+# main/uploads.py
+
+"""
+Streaming, hashing upload handler for homework submissions.
+
+``HashingUploadHandler`` replaces Django's memory and temporary-file
+handlers on the submission endpoints. Each chunk of an uploaded file is
+written straight to a staging file in the media storage and fed to a
+SHA-256 as it arrives, so a file is never held in memory nor copied after
+the upload. Limits are enforced as early as possible: the request is
+refused before its body is read when its Content-Length is already too
+large, a file of a type that is not allowed is refused on its headers, and
+a file that grows past the limit is refused at the chunk that crosses it.
+
+Stored files are content-addressed: ``store()`` moves a staged file to a
+path derived from its hash, or drops it if a file with the same hash is
+already stored, so the same bytes are kept once however often they are
+submitted. ``unstore()`` deletes a file stored for a submission whose row
+could not be saved. Staging and storing require a storage on the local filesystem
+(``MEDIA_ROOT``); moving a staged file is a rename, not a copy.
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import SubmittedHomework
+
+logger = logging.getLogger(__name__)
+
+# Largest accepted file, in bytes (settings.HOMEWORK_UPLOAD_MAX_SIZE)
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+
+# Accepted file extensions (settings.HOMEWORK_UPLOAD_EXTENSIONS)
+ALLOWED_EXTENSIONS = [
+    '.pdf', '.doc', '.docx', '.odt', '.rtf', '.txt',
+    '.ppt', '.pptx', '.xls', '.xlsx', '.jpg', '.jpeg', '.png', '.zip',
+]
+
+# Declared content types accepted for the extensions above; clients that
+# cannot tell send application/octet-stream
+ALLOWED_CONTENT_TYPES = {
+    'application/pdf',
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.oasis.opendocument.text',
+    'application/rtf',
+    'text/rtf',
+    'text/plain',
+    'application/vnd.ms-powerpoint',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.ms-excel',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'image/jpeg',
+    'image/png',
+    'application/zip',
+    'application/x-zip-compressed',
+    'application/octet-stream',
+}
+
+# Room for form fields and multipart headers next to the file when the
+# Content-Length of a whole request is checked (bytes)
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Bytes read from the request per chunk
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Staging directory and directory of stored submissions, in the media storage
+STAGING_DIR = 'homeworks/incoming/'
+SUBMISSIONS_DIR = 'homeworks/submissions/'
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+
+def max_upload_size():
+    return getattr(settings, 'HOMEWORK_UPLOAD_MAX_SIZE', MAX_UPLOAD_SIZE)
+
+
+def allowed_extensions():
+    return [extension.lower() for extension in getattr(settings, 'HOMEWORK_UPLOAD_EXTENSIONS', ALLOWED_EXTENSIONS)]
+
+
+def _too_large():
+    return UploadTooLarge(f'Files larger than {max_upload_size() // (1024 * 1024)} MB are not accepted.')
+
+
+def _extension(file_name):
+    return os.path.splitext(file_name)[1].lower()
+
+
+class HashedUpload(UploadedFile):
+    """
+    A file staged in the media storage with its SHA-256. ``store()`` moves
+    it to its content-addressed name; ``discard()`` deletes it.
+    """
+
+    def __init__(self, staged_name, name, content_type, size, sha256, charset=None, content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.staged_name = staged_name
+        self.sha256 = sha256
+        self.stored_name = None
+        # True once store() moved this file into place (it was not stored before)
+        self.moved = False
+
+    @property
+    def extension(self):
+        return _extension(self.name)
+
+    def open(self, mode='rb'):
+        if self.file is None or self.file.closed:
+            self.file = default_storage.open(self.staged_name, mode)
+        else:
+            self.file.seek(0)
+        return self
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def discard(self):
+        """
+        Deletes the staged file unless it was stored. Safe to call twice.
+        """
+        if self.staged_name is None:
+            return
+        self.close()
+        default_storage.delete(self.staged_name)
+        self.staged_name = None
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Writes uploaded files chunk by chunk to staging files in the media
+    storage while hashing them, and enforces the size and type limits.
+    """
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = max_upload_size()
+        self.uploads = []
+        self.staged_name = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Refused before a byte of the body is read
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            raise _too_large()
+        return None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if _extension(file_name) not in allowed_extensions() or content_type not in ALLOWED_CONTENT_TYPES:
+            raise ValidationError({field_name: [f'Files of type "{_extension(file_name) or content_type}" are not accepted.']})
+        if content_length is not None and content_length > self.max_size:
+            raise _too_large()
+
+        self.staged_name = f'{STAGING_DIR}{uuid.uuid4().hex}.part'
+        path = default_storage.path(self.staged_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'xb')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_size:
+            self.upload_interrupted()
+            raise _too_large()
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.file.close()
+        upload = HashedUpload(
+            self.staged_name, self.file_name, self.content_type, file_size, self.hasher.hexdigest(),
+            self.charset, self.content_type_extra,
+        )
+        self.uploads.append(upload)
+        self.staged_name = None
+        return upload
+
+    def upload_interrupted(self):
+        if self.staged_name is not None:
+            self.file.close()
+            default_storage.delete(self.staged_name)
+            self.staged_name = None
+
+    def discard_unstored(self):
+        """
+        Deletes the staged files that were not stored, e.g. after a request
+        failed validation.
+        """
+        self.upload_interrupted()
+        for upload in self.uploads:
+            if upload.stored_name is None:
+                upload.discard()
+
+
+def discard_unstored(request):
+    """
+    Cleans up after the ``HashingUploadHandler`` of ``request``, if any.
+    """
+    for handler in getattr(request, 'upload_handlers', ()):
+        if isinstance(handler, HashingUploadHandler):
+            handler.discard_unstored()
+
+
+def store(upload):
+    """
+    Stores a staged upload once per content and returns its storage name.
+    If the same bytes are already stored the staged file is deleted and the
+    existing name is returned.
+    """
+    if upload.stored_name is not None:
+        return upload.stored_name
+
+    name = (
+        SubmittedHomework.objects.filter(content_hash=upload.sha256)
+        .exclude(submission_file='')
+        .values_list('submission_file', flat=True)
+        .first()
+    )
+    if name is None or not default_storage.exists(name):
+        name = f'{SUBMISSIONS_DIR}{upload.sha256[:2]}/{upload.sha256}{upload.extension}'
+
+    if default_storage.exists(name):
+        logger.info(f"Upload {upload.name} duplicates stored file {name}; staged copy dropped.")
+        upload.discard()
+    else:
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        upload.close()
+        os.replace(default_storage.path(upload.staged_name), path)
+        if default_storage.file_permissions_mode is not None:
+            os.chmod(path, default_storage.file_permissions_mode)
+        upload.staged_name = None
+        upload.moved = True
+    upload.stored_name = name
+    return name
+
+
+def unstore(upload):
+    """
+    Deletes the file that ``store()`` moved into place for an upload whose
+    submission was not saved, unless another submission refers to it.
+    """
+    if not upload.moved:
+        return
+    if not SubmittedHomework.objects.filter(submission_file=upload.stored_name).exists():
+        logger.info(f"Stored file {upload.stored_name} has no submission; deleted.")
+        default_storage.delete(upload.stored_name)
+    upload.moved = False
@@ -9,8 +9,10 @@ from .views import (
     UserViewSet, CustomObtainAuthToken, SchoolClassViewSet, SubjectViewSet,
     ScheduleViewSet, HomeworkViewSet, SubmittedHomeworkViewSet, GradeViewSet,
     AttendanceViewSet, AchievementViewSet, UserProfileViewSet,
-    LeaderboardViewSet, NotificationViewSet, logout_view, UserMeView,
+    LeaderboardViewSet, NotificationViewSet, logout_view, UserMeView, DashboardView,
 )
+from .streams import event_stream
+from . import async_views
 
 # Import for Swagger documentation
 from drf_yasg.views import get_schema_view
@@ -56,6 +58,17 @@ urlpatterns = [
     path('login/', CustomObtainAuthToken.as_view(), name='api_token_auth'),
     path('logout/', logout_view, name='api_logout'),
     path('me/', UserMeView.as_view(), name='user_me'),
+    path('dashboard/', DashboardView.as_view(), name='dashboard'),
+
+    # Async variants of the read-heavy endpoints (served under ASGI)
+    path('async/me/', async_views.me, name='async_user_me'),
+    path('async/schedules/', async_views.schedules, name='async_schedules'),
+    path('async/homeworks/', async_views.homeworks, name='async_homeworks'),
+    path('async/attendances/today/', async_views.attendance_today, name='async_attendance_today'),
+    path('async/leaderboard/', async_views.leaderboard_list, name='async_leaderboard'),
+
+    # Server-sent events (served under ASGI)
+    path('events/', event_stream, name='event_stream'),
     
     # Swagger/OpenAPI documentation
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
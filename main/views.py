@@ -2,13 +2,14 @@
 # views.py
 
 import logging
-import datetime
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import localtime, now
 from django.conf import settings
-from django.db.models import Prefetch, Sum, Count, Avg, Q
-from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Prefetch
 
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.response import Response
@@ -17,21 +18,31 @@ from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.throttling import UserRateThrottle
-
-from geopy.distance import geodesic  # For distance calculations
+from rest_framework.exceptions import PermissionDenied
 
 from .models import (
     SchoolClass, Subject, Schedule, Homework, SubmittedHomework,
     Grade, Attendance, Achievement, UserProfile,
-    UserAchievement, Leaderboard, Notification, StudentTeacher
+    UserAchievement, Leaderboard, Notification, StudentTeacher, ParentChild
 )
+from .authentication import token_is_expired
+from .geo import get_geofence
+from .mixins import ConditionalGetMixin, ExpandableQuerysetMixin, KeysetPaginationMixin
+from .dashboard import get_dashboard
+from .profiles import get_profile
+from . import caching, events, exports, leaderboard, notifications, scheduling, timetable, uploads
+from .signals import bulk_write, USER_DISPLAY_TAG
+from .task import fan_out_notifications
 from .serializers import (
     UserSerializer, SchoolClassSerializer, SubjectSerializer, ScheduleSerializer,
     HomeworkSerializer, SubmittedHomeworkSerializer, GradeSerializer,
     AttendanceSerializer, AchievementSerializer, UserProfileSerializer,
     UserAchievementSerializer, LeaderboardSerializer, NotificationSerializer,
-    UserRegistrationSerializer, StudentTeacherSerializer
+    UserRegistrationSerializer, StudentTeacherSerializer, BulkGradeSerializer,
+    BulkGradeRowSerializer, RollCallSerializer, ExportSerializer, NotificationIdsSerializer,
+    BulkScheduleSerializer, BulkScheduleRowSerializer, FreeTeachersSerializer,
 )
 
 User = get_user_model()
@@ -64,14 +75,38 @@ class IsParent(permissions.BasePermission):
         return request.user.is_authenticated and request.user.role == User.PARENT
 
 
-# Token expiration settings
-TOKEN_EXPIRATION_TIME = datetime.timedelta(hours=24)
+def refresh_leaderboard_on_commit(metric, user_ids):
+    """
+    Refresh leaderboard entries of users touched by a bulk write once the
+    transaction commits. Bulk writes do not send per-row signals.
+    """
+    user_ids = set(user_ids)
+
+    def run():
+        try:
+            leaderboard.refresh_for_users(metric, user_ids)
+        except Exception as e:
+            logger.error(f"Error refreshing the '{metric}' leaderboard after a bulk write: {e}")
+
+    transaction.on_commit(run)
+
 
-def token_is_expired(token):
+def notify_on_commit(event, object_ids, **params):
     """
-    Checks if the token has expired.
+    Queue the notification fan-out of an event once the transaction commits,
+    so the request never waits for the recipients to be written.
     """
-    return timezone.now() > token.created + TOKEN_EXPIRATION_TIME
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+
+    def run():
+        try:
+            fan_out_notifications.delay(event, object_ids, **params)
+        except Exception as e:
+            logger.error(f"Error queueing '{event}' notifications: {e}")
+
+    transaction.on_commit(run)
 
 
 # Default paginator
@@ -91,19 +126,12 @@ class UserMeView(APIView):
         try:
             user = request.user
             user_serializer = UserSerializer(user)
-            try:
-                user_profile = user.profile
-                user_profile_serializer = UserProfileSerializer(user_profile)
-            except UserProfile.DoesNotExist:
-                user_profile_serializer = None
-                logger.warning(f"User {user.username} does not have a UserProfile.")
-            
+            # Users written in bulk may have no profile yet
+            user_profile_serializer = UserProfileSerializer(get_profile(user))
+
             response_data = user_serializer.data
-            if user_profile_serializer:
-                response_data.update(user_profile_serializer.data)
-            else:
-                response_data.update({"profile": "Profile not found."})
-            
+            response_data.update(user_profile_serializer.data)
+
             logger.info(f"User {user.username} retrieved their information.")
             return Response(response_data)
         except Exception as e:
@@ -111,6 +139,29 @@ class UserMeView(APIView):
             return Response({"error": "Failed to retrieve user information."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class DashboardView(APIView):
+    """
+    Home screen of the current user in one response: today's lessons,
+    upcoming homework, recent grades, today's attendance and the unread
+    notification count, per child for parents and per class for teachers.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        try:
+            data = get_dashboard(user)
+        except Exception as e:
+            logger.error(f"Error building the dashboard for user {user.username}: {e}")
+            return Response({"error": "Failed to retrieve dashboard."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if data is None:
+            logger.warning(f"User {user.username} with unknown role attempted to access the dashboard.")
+            return Response({"error": "You do not have access to this endpoint."}, status=status.HTTP_403_FORBIDDEN)
+        logger.info(f"User {user.username} retrieved their dashboard.")
+        return Response(data, status=status.HTTP_200_OK)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing users.
@@ -158,7 +209,7 @@ class CustomObtainAuthToken(ObtainAuthToken):
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
 
-        if not created and token_is_expired(token):
+        if not created and token_is_expired(token.created):
             logger.info(f"Token for user {user.username} expired. Creating a new token.")
             token.delete()
             token = Token.objects.create(user=user)
@@ -233,11 +284,13 @@ class SubjectViewSet(viewsets.ModelViewSet):
             raise e
 
 
-class ScheduleViewSet(viewsets.ModelViewSet):
+class ScheduleViewSet(ConditionalGetMixin, ExpandableQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing schedules.
+    Answers conditional GETs with 304 while no schedule data has changed.
     """
-    queryset = Schedule.objects.select_related('school_class', 'subject', 'teacher').all()
+    conditional_dependencies = [Schedule, SchoolClass, ParentChild, Subject, USER_DISPLAY_TAG]
+    queryset = Schedule.objects.all()
     serializer_class = ScheduleSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
@@ -246,35 +299,172 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     ordering_fields = ['weekday', 'start_time']
     ordering = ['weekday', 'start_time']
 
+    @action(detail=False, methods=['get'], url_path='now')
+    def current_lesson(self, request):
+        """
+        Current and next lesson of every timetable the user follows, looked
+        up in the compiled timetables (?at= an ISO datetime, default: now).
+        """
+        user = request.user
+        moment = localtime(now())
+        if 'at' in request.query_params:
+            moment = parse_datetime(request.query_params['at'])
+            if moment is None:
+                return Response({"error": "Invalid 'at' datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            moment = localtime(moment) if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+        try:
+            scopes = timetable.get_scopes(user)
+            compiled = timetable.get_timetables([(scope, scope_id) for scope, scope_id, _ in scopes])
+            timetables = []
+            for scope, scope_id, name in scopes:
+                entry = {'scope': scope, 'id': scope_id, 'name': name}
+                entry.update(timetable.current_and_next(compiled[(scope, scope_id)], moment))
+                timetables.append(entry)
+        except Exception as e:
+            logger.error(f"Error looking up the current lesson for user {user.username}: {e}")
+            return Response({"error": "Failed to retrieve the timetable."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({'at': moment, 'timetables': timetables}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        """
+        Import many lessons at once, e.g. a whole timetable.
+        References are validated with one query per kind, and every lesson
+        is checked for overlaps with the other lessons of its teacher and
+        class in O(n log n). With 'replace' the previous lessons of the
+        classes in the batch are deleted, and nothing is written unless
+        every row is valid; otherwise invalid rows are reported by index
+        and the valid ones are created.
+        """
+        user = request.user
+        header = BulkScheduleSerializer(data=request.data)
+        header.is_valid(raise_exception=True)
+        replace = header.validated_data['replace']
+
+        errors = []
+        rows = []
+        for index, raw in enumerate(header.validated_data['schedules']):
+            row = BulkScheduleRowSerializer(data=raw)
+            if not row.is_valid():
+                errors.append({'index': index, 'errors': row.errors})
+                continue
+            rows.append((index, row.validated_data))
+
+        class_ids = set(SchoolClass.objects.filter(
+            pk__in={values['school_class'] for _, values in rows}
+        ).values_list('pk', flat=True))
+        subject_ids = set(Subject.objects.filter(
+            pk__in={values['subject'] for _, values in rows}
+        ).values_list('pk', flat=True))
+        teacher_ids = set(User.objects.filter(
+            pk__in={values['teacher'] for _, values in rows}, role=User.TEACHER
+        ).values_list('pk', flat=True))
+
+        lessons = []
+        for index, values in rows:
+            row_errors = {}
+            if values['school_class'] not in class_ids:
+                row_errors['school_class'] = ['Class does not exist.']
+            if values['subject'] not in subject_ids:
+                row_errors['subject'] = ['Subject does not exist.']
+            if values['teacher'] not in teacher_ids:
+                row_errors['teacher'] = ['Teacher does not exist.']
+            if row_errors:
+                errors.append({'index': index, 'errors': row_errors})
+                continue
+            lessons.append((index, Schedule(
+                school_class_id=values['school_class'],
+                subject_id=values['subject'],
+                teacher_id=values['teacher'],
+                weekday=values['weekday'],
+                start_time=values['start_time'],
+                end_time=values['end_time'],
+            )))
+
+        replaced_class_ids = {lesson.school_class_id for _, lesson in lessons} if replace else set()
+        conflicts = scheduling.find_conflicts(
+            [lesson for _, lesson in lessons], replaced_class_ids=replaced_class_ids
+        )
+        for position, messages in conflicts.items():
+            errors.append({'index': lessons[position][0], 'errors': {'non_field_errors': messages}})
+        schedules = [lesson for position, (_, lesson) in enumerate(lessons) if position not in conflicts]
+
+        if replace and errors:
+            schedules = []
+        if schedules:
+            try:
+                with transaction.atomic():
+                    deleted = 0
+                    if replaced_class_ids:
+                        deleted, _ = Schedule.objects.filter(school_class_id__in=replaced_class_ids).delete()
+                    created = Schedule.objects.bulk_create(schedules)
+                    bulk_write.send(sender=Schedule, pks=[schedule.pk for schedule in created])
+            except Exception as e:
+                logger.error(f"Error importing schedules by {user.username}: {e}")
+                return Response({"error": "Failed to save schedules."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.info(f"User {user.username} imported {len(schedules)} lessons, replacing {deleted} rows.")
+
+        errors.sort(key=lambda error: error['index'])
+        response_status = status.HTTP_201_CREATED if schedules else status.HTTP_400_BAD_REQUEST
+        return Response({"created": len(schedules), "errors": errors}, status=response_status)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsTeacher | permissions.IsAdminUser])
+    def free_teachers(self, request):
+        """
+        Teachers without a lesson at ?weekday= and ?time= (or during
+        ?time=-?end_time=), for planning substitutions. Teachers of the
+        user's school by default; staff may pass ?school=.
+        """
+        params = FreeTeachersSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        school_id = data.get('school') if request.user.is_staff else None
+        if school_id is None:
+            school_id = request.user.school_id
+
+        try:
+            teachers = scheduling.free_teachers(
+                data['weekday'], data['time'], data.get('end_time'), school_id=school_id
+            )
+            serializer = UserSerializer(teachers, many=True)
+        except Exception as e:
+            logger.error(f"Error searching free teachers for user {request.user.username}: {e}")
+            return Response({"error": "Failed to search free teachers."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
     def get_queryset(self):
         user = self.request.user
         logger.debug(f"Fetching schedules for user: {user.username} with role: {user.role}")
 
         if user.role == User.TEACHER:
-            queryset = Schedule.objects.filter(teacher=user).select_related('school_class', 'subject', 'teacher')
-            logger.debug(f"Teacher {user.username} schedules: {queryset}")
+            queryset = Schedule.objects.filter(teacher=user)
+            logger.debug(f"Teacher {user.username} schedules.")
             return queryset
         elif user.role == User.STUDENT:
             class_objs = user.classes.all()
-            queryset = Schedule.objects.filter(school_class__in=class_objs).select_related('school_class', 'subject', 'teacher')
-            logger.debug(f"Student {user.username} schedules: {queryset}")
+            queryset = Schedule.objects.filter(school_class__in=class_objs)
+            logger.debug(f"Student {user.username} schedules.")
             return queryset
         elif user.role == User.PARENT:
             children = user.parent_relations.values_list('child', flat=True)
             class_objs = SchoolClass.objects.filter(students__in=children).distinct()
-            queryset = Schedule.objects.filter(school_class__in=class_objs).select_related('school_class', 'subject', 'teacher')
-            logger.debug(f"Parent {user.username} schedules: {queryset}")
+            queryset = Schedule.objects.filter(school_class__in=class_objs)
+            logger.debug(f"Parent {user.username} schedules.")
             return queryset
         else:
             logger.warning(f"Unknown role for user: {user.username}")
             return Schedule.objects.none()
 
 
-class HomeworkViewSet(viewsets.ModelViewSet):
+class HomeworkViewSet(ConditionalGetMixin, ExpandableQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing homework.
+    Answers conditional GETs with 304 while no homework data has changed.
     """
-    queryset = Homework.objects.select_related('subject', 'school_class', 'teacher').all()
+    conditional_dependencies = [Homework, SchoolClass, ParentChild, Subject]
+    queryset = Homework.objects.all()
     serializer_class = HomeworkSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
@@ -291,6 +481,7 @@ class HomeworkViewSet(viewsets.ModelViewSet):
         try:
             homework = serializer.save(teacher=self.request.user)
             logger.info(f"Created homework: {homework.description} for class {homework.school_class.name}")
+            notify_on_commit(notifications.HOMEWORK, [str(homework.pk)])
         except Exception as e:
             logger.error(f"Error creating homework: {e}")
             raise e
@@ -302,16 +493,16 @@ class HomeworkViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.role == User.TEACHER:
             # Показываем все ДЗ, где teacher = текущий пользователь
-            queryset = Homework.objects.filter(teacher=user).select_related('subject', 'school_class', 'teacher')
+            queryset = Homework.objects.filter(teacher=user)
             logger.debug(f"Teacher {user.username} accessing homework they created.")
             return queryset
         elif user.role == User.STUDENT:
-            queryset = Homework.objects.filter(school_class__in=user.classes.all()).select_related('subject', 'school_class', 'teacher')
+            queryset = Homework.objects.filter(school_class__in=user.classes.all())
             logger.debug(f"Student {user.username} accessing homework for their classes.")
             return queryset
         elif user.role == User.PARENT:
             children = user.parent_relations.values_list('child', flat=True)
-            queryset = Homework.objects.filter(school_class__students__in=children).distinct().select_related('subject', 'school_class', 'teacher')
+            queryset = Homework.objects.filter(school_class__students__in=children).distinct()
             logger.debug(f"Parent {user.username} accessing homework for their children.")
             return queryset
         else:
@@ -319,18 +510,23 @@ class HomeworkViewSet(viewsets.ModelViewSet):
             return Homework.objects.none()
 
 
-class SubmittedHomeworkViewSet(viewsets.ModelViewSet):
+class SubmittedHomeworkViewSet(ExpandableQuerysetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing submitted homework.
+    Supports keyset pagination with ?pagination=cursor.
+    Files are uploaded as multipart/form-data and streamed to storage by
+    ``uploads.HashingUploadHandler``; identical files are stored once.
     """
-    queryset = SubmittedHomework.objects.select_related('homework', 'student').all()
+    queryset = SubmittedHomework.objects.all()
     serializer_class = SubmittedHomeworkSerializer
     permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser]
     pagination_class = StandardResultsSetPagination
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['homework__subject__name', 'student__username']
     ordering_fields = ['submitted_at', 'status']
     ordering = ['-submitted_at']
+    keyset_ordering = ('-submitted_at', '-id')
 
     def get_queryset(self):
         """
@@ -340,22 +536,59 @@ class SubmittedHomeworkViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
         if user.role == User.TEACHER:
-            queryset = SubmittedHomework.objects.filter(homework__teacher=user).select_related('homework', 'student')
+            queryset = SubmittedHomework.objects.filter(homework__teacher=user)
             logger.debug(f"Teacher {user.username} accessing submitted homework for their own homeworks.")
             return queryset
         elif user.role == User.STUDENT:
-            queryset = SubmittedHomework.objects.filter(student=user).select_related('homework', 'student')
+            queryset = SubmittedHomework.objects.filter(student=user)
             logger.debug(f"Student {user.username} accessing their submitted homework.")
             return queryset
         elif user.role == User.PARENT:
             children_ids = user.parent_relations.values_list('child__id', flat=True)
-            queryset = SubmittedHomework.objects.filter(student__id__in=children_ids).select_related('homework', 'student')
+            queryset = SubmittedHomework.objects.filter(student__id__in=children_ids)
             logger.debug(f"Parent {user.username} accessing submitted homework for their children.")
             return queryset
         else:
             logger.warning(f"User {user.username} with unknown role trying to access submitted homework.")
             return SubmittedHomework.objects.none()
 
+    def initialize_request(self, request, *args, **kwargs):
+        # Must be set before the body is parsed
+        request.upload_handlers = [uploads.HashingUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Staged files of rejected or duplicate uploads are not kept
+        uploads.discard_unstored(request)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_identical_submission(self, request):
+        """
+        Returns the student's submission for the posted homework if it has
+        the same content as the uploaded file, otherwise None.
+        """
+        upload = request.data.get('submission_file')
+        if not isinstance(upload, uploads.HashedUpload):
+            return None
+        try:
+            return SubmittedHomework.objects.filter(
+                homework_id=request.data.get('homework'), student=request.user, content_hash=upload.sha256,
+            ).first()
+        except (ValueError, DjangoValidationError):
+            return None
+
+    def create(self, request, *args, **kwargs):
+        """
+        Resubmitting the same file for the same homework returns the existing
+        submission instead of failing on the one-submission-per-homework
+        constraint.
+        """
+        submitted_homework = self.get_identical_submission(request)
+        if submitted_homework is not None:
+            logger.info(f"Student {request.user.username} resubmitted an identical file for homework {submitted_homework.homework_id}.")
+            return Response(self.get_serializer(submitted_homework).data, status=status.HTTP_200_OK)
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         try:
             submitted_homework = serializer.save(student=self.request.user)
@@ -373,11 +606,14 @@ class SubmittedHomeworkViewSet(viewsets.ModelViewSet):
             raise e
 
 
-class GradeViewSet(viewsets.ModelViewSet):
+class GradeViewSet(ConditionalGetMixin, ExpandableQuerysetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing grades.
+    Answers conditional GETs with 304 while no grade data has changed.
+    Supports keyset pagination with ?pagination=cursor.
     """
-    queryset = Grade.objects.select_related('student', 'subject', 'teacher').all()
+    conditional_dependencies = [Grade, ParentChild, Subject, USER_DISPLAY_TAG]
+    queryset = Grade.objects.all()
     serializer_class = GradeSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
@@ -385,6 +621,7 @@ class GradeViewSet(viewsets.ModelViewSet):
     search_fields = ['student__username', 'subject__name', 'teacher__username']
     ordering_fields = ['date', 'grade']
     ordering = ['-date']
+    keyset_ordering = ('-date', '-id')
 
     def get_queryset(self):
         """
@@ -394,16 +631,16 @@ class GradeViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
         if user.role == User.TEACHER:
-            queryset = Grade.objects.filter(teacher=user).select_related('student', 'subject', 'teacher')
+            queryset = Grade.objects.filter(teacher=user)
             logger.debug(f"Teacher {user.username} accessing their assigned grades.")
             return queryset
         elif user.role == User.STUDENT:
-            queryset = Grade.objects.filter(student=user).select_related('student', 'subject', 'teacher')
+            queryset = Grade.objects.filter(student=user)
             logger.debug(f"Student {user.username} accessing their grades.")
             return queryset
         elif user.role == User.PARENT:
             children_ids = user.parent_relations.values_list('child__id', flat=True)
-            queryset = Grade.objects.filter(student__id__in=children_ids).select_related('student', 'subject', 'teacher')
+            queryset = Grade.objects.filter(student__id__in=children_ids)
             logger.debug(f"Parent {user.username} accessing grades for their children.")
             return queryset
         else:
@@ -414,17 +651,121 @@ class GradeViewSet(viewsets.ModelViewSet):
         try:
             grade = serializer.save(teacher=self.request.user)
             logger.info(f"Teacher {self.request.user.username} assigned grade {grade.grade} to student {grade.student.username} for subject {grade.subject.name}")
+            notify_on_commit(notifications.GRADE, [grade.pk])
         except Exception as e:
             logger.error(f"Error assigning grade by teacher {self.request.user.username}: {e}")
             raise e
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the grades visible to the user as CSV or XLSX.
+        Filters: school, school_class, date_from, date_to; format: file_format=csv|xlsx.
+        """
+        params = ExportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        queryset = self.get_queryset()
+        if 'school' in data:
+            queryset = queryset.filter(student__school_id=data['school'])
+        if 'school_class' in data:
+            queryset = queryset.filter(student__classes__id=data['school_class'])
+        if 'date_from' in data:
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if 'date_to' in data:
+            queryset = queryset.filter(date__lte=data['date_to'])
+
+        logger.info(f"User {request.user.username} exported grades as {data['file_format']}.")
+        return exports.export_response(
+            queryset.order_by('date', 'id'), exports.GRADE_COLUMNS, data['file_format'], 'grades',
+        )
+
+    @action(detail=False, methods=['post'], permission_classes=[IsTeacher])
+    def bulk(self, request):
+        """
+        Enter grades for a whole class at once.
+        Every referenced student and subject is validated with one query per
+        kind and the valid rows are written with a single bulk insert.
+        Invalid rows are reported by index without aborting the batch.
+        """
+        user = request.user
+        header = BulkGradeSerializer(data=request.data)
+        header.is_valid(raise_exception=True)
+        data = header.validated_data
+        class_id = data['school_class']
+
+        if not SchoolClass.objects.filter(pk=class_id, teachers=user).exists():
+            logger.warning(f"Teacher {user.username} attempted bulk grading for class {class_id} they do not teach.")
+            return Response({"error": "You do not teach this class."}, status=status.HTTP_403_FORBIDDEN)
+
+        default_date = data.get('date') or localtime(now()).date()
+        errors = []
+        rows = []
+        for index, raw in enumerate(data['grades']):
+            row = BulkGradeRowSerializer(data=raw)
+            if not row.is_valid():
+                errors.append({'index': index, 'errors': row.errors})
+                continue
+            values = row.validated_data
+            values.setdefault('subject', data.get('subject'))
+            if values['subject'] is None:
+                errors.append({'index': index, 'errors': {'subject': ['This field is required.']}})
+                continue
+            rows.append((index, values))
+
+        student_ids = set(
+            SchoolClass.students.through.objects.filter(
+                schoolclass_id=class_id, user_id__in={values['student'] for _, values in rows}
+            ).values_list('user_id', flat=True)
+        )
+        subject_ids = set(
+            Subject.objects.filter(pk__in={values['subject'] for _, values in rows}).values_list('pk', flat=True)
+        )
+
+        grades = []
+        for index, values in rows:
+            row_errors = {}
+            if values['student'] not in student_ids:
+                row_errors['student'] = ['Student is not in this class.']
+            if values['subject'] not in subject_ids:
+                row_errors['subject'] = ['Subject does not exist.']
+            if row_errors:
+                errors.append({'index': index, 'errors': row_errors})
+                continue
+            grades.append(Grade(
+                student_id=values['student'],
+                subject_id=values['subject'],
+                teacher=user,
+                grade=values['grade'],
+                date=values.get('date') or default_date,
+                comments=values.get('comments'),
+            ))
+
+        if grades:
+            try:
+                with transaction.atomic():
+                    created = Grade.objects.bulk_create(grades)
+                    bulk_write.send(sender=Grade, pks=[grade.pk for grade in created])
+                    refresh_leaderboard_on_commit(Leaderboard.GRADES, [grade.student_id for grade in created])
+                    notify_on_commit(notifications.GRADE, [grade.pk for grade in created])
+            except Exception as e:
+                logger.error(f"Error saving bulk grades by teacher {user.username}: {e}")
+                return Response({"error": "Failed to save grades."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.info(f"Teacher {user.username} entered {len(grades)} grades for class {class_id}.")
+
+        errors.sort(key=lambda error: error['index'])
+        response_status = status.HTTP_201_CREATED if grades else status.HTTP_400_BAD_REQUEST
+        return Response({"created": len(grades), "errors": errors}, status=response_status)
+
 
-class AttendanceViewSet(viewsets.ModelViewSet):
+class AttendanceViewSet(ExpandableQuerysetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing attendance records.
     Includes custom actions for marking attendance based on GPS coordinates.
+    Supports keyset pagination with ?pagination=cursor.
     """
-    queryset = Attendance.objects.select_related('student', 'school_class', 'school').all()
+    queryset = Attendance.objects.all()
     serializer_class = AttendanceSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
@@ -432,6 +773,7 @@ class AttendanceViewSet(viewsets.ModelViewSet):
     search_fields = ['student__username', 'school_class__name', 'status']
     ordering_fields = ['date', 'status']
     ordering = ['-date']
+    keyset_ordering = ('-date', '-id')
 
     def get_queryset(self):
         """
@@ -443,16 +785,16 @@ class AttendanceViewSet(viewsets.ModelViewSet):
 
         if user.role == User.TEACHER:
             teacher_classes = SchoolClass.objects.filter(teachers=user)
-            queryset = Attendance.objects.filter(school_class__in=teacher_classes).select_related('student', 'school_class', 'school')
+            queryset = Attendance.objects.filter(school_class__in=teacher_classes)
             logger.debug(f"Teacher {user.username} accessing attendance for their classes.")
             return queryset
         elif user.role == User.STUDENT:
-            queryset = Attendance.objects.filter(student=user).select_related('student', 'school_class', 'school')
+            queryset = Attendance.objects.filter(student=user)
             logger.debug(f"Student {user.username} accessing their attendance.")
             return queryset
         elif user.role == User.PARENT:
             children_ids = user.parent_relations.values_list('child__id', flat=True)
-            queryset = Attendance.objects.filter(student__id__in=children_ids).select_related('student', 'school_class', 'school')
+            queryset = Attendance.objects.filter(student__id__in=children_ids)
             logger.debug(f"Parent {user.username} accessing attendance for their children.")
             return queryset
         else:
@@ -474,6 +816,12 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                 return Response({"error": "User does not have an assigned school."},
                                 status=status.HTTP_400_BAD_REQUEST)
 
+            geofence = get_geofence(school)
+            if geofence is None:
+                logger.warning(f"School {school.name} has no coordinates set.")
+                return Response({"error": "School coordinates are not set."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
             latitude = request.data.get('latitude')
             longitude = request.data.get('longitude')
             if not latitude or not longitude:
@@ -493,14 +841,8 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         try:
-            # Calculate distance to the school
-            student_coords = (latitude, longitude)
-            school_coords = (float(school.latitude), float(school.longitude))
-            distance = geodesic(student_coords, school_coords).kilometers
-
-            # Determine attendance status (e.g., present if within 100m)
-            proximity_radius = 0.1  # 100 meters
-            status_value = 'present' if distance <= proximity_radius else 'absent'
+            # Determine attendance status from the school's geofence
+            status_value = 'present' if geofence.contains(latitude, longitude) else 'absent'
 
             # Get the student's class
             class_obj = user.classes.first()
@@ -527,46 +869,131 @@ class AttendanceViewSet(viewsets.ModelViewSet):
             else:
                 logger.info(f"Student {user.username} updated attendance to {status_value}.")
 
-            # Invalidate the leaderboard cache since attendance has changed
-            cache.delete('leaderboard_xp_cache')
-            cache.delete('leaderboard_attendance_cache')
-            cache.delete('leaderboard_grades_cache')
-            logger.info("Leaderboard caches invalidated due to attendance update.")
-
-            return Response(AttendanceSerializer(attendance).data, status=status.HTTP_201_CREATED)
+            return Response(self.get_serializer(attendance).data, status=status.HTTP_201_CREATED)
         except Exception as e:
             logger.error(f"Error marking attendance for student {user.username}: {e}")
             return Response({"error": "Failed to mark attendance."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the attendance records visible to the user as CSV or XLSX.
+        Filters: school, school_class, date_from, date_to; format: file_format=csv|xlsx.
+        """
+        params = ExportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        queryset = self.get_queryset()
+        if 'school' in data:
+            queryset = queryset.filter(school_id=data['school'])
+        if 'school_class' in data:
+            queryset = queryset.filter(school_class_id=data['school_class'])
+        if 'date_from' in data:
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if 'date_to' in data:
+            queryset = queryset.filter(date__lte=data['date_to'])
+
+        logger.info(f"User {request.user.username} exported attendance as {data['file_format']}.")
+        return exports.export_response(
+            queryset.order_by('date', 'id'), exports.ATTENDANCE_COLUMNS, data['file_format'], 'attendance',
+        )
+
+    @action(detail=False, methods=['post'], permission_classes=[IsTeacher])
+    def roll_call(self, request):
+        """
+        Mark attendance for a whole class in one request.
+        Class membership of every listed student is checked with one query and
+        all rows of the day are upserted with a single statement on the
+        unique (student, date) constraint.
+        """
+        user = request.user
+        serializer = RollCallSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        class_id = data['school_class']
+        day = data.get('date') or localtime(now()).date()
+        statuses = data['statuses']
+
+        school_class = SchoolClass.objects.filter(pk=class_id, teachers=user).values_list('pk', 'school_id').first()
+        if school_class is None:
+            logger.warning(f"Teacher {user.username} attempted a roll call for class {class_id} they do not teach.")
+            return Response({"error": "You do not teach this class."}, status=status.HTTP_403_FORBIDDEN)
+
+        school_id = school_class[1]
+        members = set(
+            SchoolClass.students.through.objects.filter(
+                schoolclass_id=class_id, user_id__in=statuses
+            ).values_list('user_id', flat=True)
+        )
+        errors = {
+            student_id: ["Student is not in this class."]
+            for student_id in statuses if student_id not in members
+        }
+        records = [
+            Attendance(student_id=student_id, school_class_id=class_id, school_id=school_id,
+                       date=day, status=statuses[student_id])
+            for student_id in statuses if student_id in members
+        ]
+
+        if records:
+            try:
+                with transaction.atomic():
+                    Attendance.objects.bulk_create(
+                        records,
+                        update_conflicts=True,
+                        unique_fields=['student', 'date'],
+                        update_fields=['school_class', 'school', 'status'],
+                    )
+                    bulk_write.send(sender=Attendance, dates=[day])
+                    refresh_leaderboard_on_commit(Leaderboard.ATTENDANCE, members)
+                    transaction.on_commit(lambda: events.publish_attendance(records))
+                    notify_on_commit(
+                        notifications.ATTENDANCE,
+                        [record.student_id for record in records if record.status == 'absent'],
+                        date=day.isoformat(),
+                    )
+            except Exception as e:
+                logger.error(f"Error saving roll call by teacher {user.username}: {e}")
+                return Response({"error": "Failed to save attendance."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.info(f"Teacher {user.username} marked {len(records)} students in class {class_id} for {day}.")
+
+        response_status = status.HTTP_200_OK if records else status.HTTP_400_BAD_REQUEST
+        return Response({"marked": len(records), "date": day, "errors": errors}, status=response_status)
+
+    def get_today_queryset(self, user):
+        """
+        Today's attendance records visible to the user, or None for an unknown role.
+        """
+        today_date = localtime(now()).date()
+        if user.role == User.TEACHER:
+            teacher_classes = SchoolClass.objects.filter(teachers=user)
+            logger.info(f"Teacher {user.username} requested today's attendance for their classes.")
+            return Attendance.objects.filter(school_class__in=teacher_classes, date=today_date)
+        elif user.role == User.STUDENT:
+            logger.info(f"Student {user.username} requested their attendance for today.")
+            return Attendance.objects.filter(student=user, date=today_date)
+        elif user.role == User.PARENT:
+            children_ids = user.parent_relations.values_list('child__id', flat=True)
+            logger.info(f"Parent {user.username} requested today's attendance for their children.")
+            return Attendance.objects.filter(student__id__in=children_ids, date=today_date)
+        logger.warning(f"User {user.username} with unknown role attempted to access today's attendance.")
+        return None
+
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def today(self, request):
         """
         Retrieve today's attendance records for the current user.
         """
         user = request.user
-        today_date = localtime(now()).date()
 
         try:
-            if user.role == User.TEACHER:
-                teacher_classes = SchoolClass.objects.filter(teachers=user)
-                attendance_records = Attendance.objects.filter(
-                    school_class__in=teacher_classes,
-                    date=today_date
-                ).select_related('student', 'school_class', 'school')
-                logger.info(f"Teacher {user.username} requested today's attendance for their classes.")
-            elif user.role == User.STUDENT:
-                attendance_records = Attendance.objects.filter(student=user, date=today_date).select_related('student', 'school_class', 'school')
-                logger.info(f"Student {user.username} requested their attendance for today.")
-            elif user.role == User.PARENT:
-                children_ids = user.parent_relations.values_list('child__id', flat=True)
-                attendance_records = Attendance.objects.filter(student__id__in=children_ids, date=today_date).select_related('student', 'school_class', 'school')
-                logger.info(f"Parent {user.username} requested today's attendance for their children.")
-            else:
-                logger.warning(f"User {user.username} with unknown role attempted to access today's attendance.")
+            attendance_records = self.get_today_queryset(user)
+            if attendance_records is None:
                 return Response({"error": "You do not have access to this endpoint."},
                                 status=status.HTTP_403_FORBIDDEN)
 
-            serializer = AttendanceSerializer(attendance_records, many=True)
+            serializer = self.get_serializer(self.expand_queryset(attendance_records), many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Error retrieving today's attendance for user {user.username}: {e}")
@@ -628,10 +1055,17 @@ class UserProfileViewSet(viewsets.ModelViewSet):
             raise e
 
 
+# Models whose changes invalidate cached leaderboard pages
+LEADERBOARD_CACHE_DEPENDENCIES = [Leaderboard, UserProfile, User, Achievement, UserAchievement]
+
+
 class LeaderboardViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ReadOnly ViewSet for displaying leaderboards based on different metrics.
+    Entries are served by the configured leaderboard backend, globally or
+    scoped to a school or class.
     """
+    serializer_class = LeaderboardSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['user_profile__user__username']
@@ -639,72 +1073,185 @@ class LeaderboardViewSet(viewsets.ReadOnlyModelViewSet):
     ordering = ['rank']
     pagination_class = StandardResultsSetPagination
 
-    def get_queryset(self):
+    def get_metric(self):
         """
-        Returns different querysets based on the 'metric' parameter:
-        - 'xp': Leaderboard based on XP.
-        - 'attendance': Leaderboard based on attendance.
-        - 'grades': Leaderboard based on grades.
+        Returns the 'metric' parameter: 'xp', 'attendance' or 'grades'.
         """
-        metric = self.request.query_params.get('metric', 'xp')
-        logger.debug(f"Fetching leaderboard for metric: {metric}")
-
-        if metric == 'xp':
-            # Пример: суммарный XP за достижения
-            queryset = UserProfile.objects.annotate(
-                total_xp=Sum('userachievement__achievement__xp_reward')
-            ).order_by('-total_xp')[:100]  # Top 100
-            return queryset
-        elif metric == 'attendance':
-            # Количество присутствий
-            queryset = UserProfile.objects.annotate(
-                total_attendance=Count('user__attendances', filter=Q(user__attendances__status='present'))
-            ).order_by('-total_attendance')[:100]
-            return queryset
-        elif metric == 'grades':
-            # Средняя оценка
-            queryset = UserProfile.objects.annotate(
-                average_grade=Avg('user__grades__grade')
-            ).order_by('-average_grade')[:100]
-            return queryset
-        else:
+        metric = self.request.query_params.get('metric', Leaderboard.XP)
+        if not leaderboard.is_valid_metric(metric):
             logger.warning(f"Invalid metric requested: {metric}. Defaulting to XP.")
-            queryset = UserProfile.objects.annotate(
-                total_xp=Sum('userachievement__achievement__xp_reward')
-            ).order_by('-total_xp')[:100]
-            return queryset
+            metric = Leaderboard.XP
+        return metric
 
-    def list(self, request, *args, **kwargs):
+    def get_user_classes(self, user):
         """
-        Override list method to implement caching based on metric.
+        Classes whose leaderboards the user may see: the classes they teach,
+        attend, or (for parents) their children attend.
         """
-        metric = request.query_params.get('metric', 'xp')
-        cache_key = f'leaderboard_{metric}_cache'
-        leaderboard_data = cache.get(cache_key)
+        if user.role == User.TEACHER:
+            return user.teaching_classes.all()
+        if user.role == User.PARENT:
+            children = ParentChild.objects.filter(parent=user).values('child_id')
+            return SchoolClass.objects.filter(students__in=children).distinct()
+        return user.classes.all()
 
-        if leaderboard_data is None:
-            try:
-                queryset = self.get_queryset()
-                serializer = UserProfileSerializer(queryset, many=True)
-                leaderboard_data = serializer.data
-                cache.set(cache_key, leaderboard_data, 300)  # Cache for 5 minutes
-                logger.info(f"Leaderboard data cached for metric: {metric}")
-            except Exception as e:
-                logger.error(f"Error retrieving leaderboard for metric {metric}: {e}")
-                return Response({"error": "Failed to retrieve leaderboard."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def check_scope_access(self, scope, scope_id):
+        """
+        Raises PermissionDenied unless the user belongs to the requested
+        school or class. Staff may read every scope.
+        """
+        user = self.request.user
+        if user.is_staff:
+            return
+        if scope == leaderboard.SCHOOL:
+            if scope_id == user.school_id:
+                return
+            if user.role == User.PARENT and ParentChild.objects.filter(
+                parent=user, child__school_id=scope_id
+            ).exists():
+                return
+        elif scope == leaderboard.CLASS:
+            if self.get_user_classes(user).filter(pk=scope_id).exists():
+                return
         else:
-            logger.info(f"Leaderboard data retrieved from cache for metric: {metric}")
+            return
+        logger.warning(f"User {user.username} was denied the leaderboard of {scope} {scope_id}.")
+        raise PermissionDenied("You do not have access to this leaderboard.")
+
+    def get_scope_key(self):
+        """
+        Resolves the 'scope' ('global', 'school' or 'class') and optional
+        'scope_id' parameters. School and class scopes default to the
+        current user's school and first class; an explicit 'scope_id' must
+        be one of the user's own.
+        """
+        user = self.request.user
+        scope = self.request.query_params.get('scope', leaderboard.GLOBAL)
+        scope_id = self.request.query_params.get('scope_id')
+
+        if scope == leaderboard.SCHOOL and scope_id is None:
+            scope_id = user.school_id
+        elif scope == leaderboard.CLASS and scope_id is None:
+            scope_id = self.get_user_classes(user).order_by('pk').values_list('id', flat=True).first()
+        elif scope_id is not None:
+            try:
+                scope_id = int(scope_id)
+            except ValueError:
+                raise leaderboard.UnsupportedScope("Invalid scope_id.")
+            self.check_scope_access(scope, scope_id)
+        return leaderboard.scope_key(scope, scope_id)
+
+    def get_page_bounds(self):
+        page = int(self.request.query_params.get('page', 1))
+        page_size = int(self.request.query_params.get('page_size', leaderboard.TOP_SIZE))
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), leaderboard.TOP_SIZE)
+        return page, page_size
+
+    def get_queryset(self):
+        metric = self.get_metric()
+        logger.debug(f"Fetching leaderboard for metric: {metric}")
+        return Leaderboard.objects.filter(metric=metric).select_related(
+            'user_profile__user'
+        ).prefetch_related('user_profile__achievements')
+
+    def load_profiles(self, entries):
+        """
+        Loads the profiles of ranked entries with one batched query.
+        """
+        return UserProfile.objects.select_related('user').prefetch_related('achievements').in_bulk(
+            [entry.user_profile_id for entry in entries]
+        )
 
-        # Enhance data with rank
-        for index, user_data in enumerate(leaderboard_data, start=1):
-            user_data['rank'] = index
+    def serialize_entries(self, entries, profiles=None):
+        """
+        Serializes ranked entries as user profiles enhanced with rank and score.
+        """
+        if profiles is None:
+            profiles = self.load_profiles(entries)
+        data = []
+        for entry in entries:
+            profile = profiles.get(entry.user_profile_id)
+            if profile is None:
+                continue
+            user_data = UserProfileSerializer(profile).data
+            user_data['rank'] = entry.rank
+            user_data['score'] = entry.score
+            data.append(user_data)
+        return data
+
+    def get_page_cache_key(self, metric, scope_key, page, page_size):
+        return f'leaderboard:{metric}:{scope_key}:{page}:{page_size}'
+
+    def build_page(self, metric, scope_key, page, page_size):
+        entries = leaderboard.get_backend().page(
+            metric, scope_key, offset=(page - 1) * page_size, limit=page_size
+        )
+        return self.serialize_entries(entries)
+
+    def list(self, request, *args, **kwargs):
+        """
+        Returns a page of the leaderboard ('page', 'page_size', default: top 100).
+        Pages are cached until a leaderboard entry or a displayed profile changes.
+        """
+        metric = self.get_metric()
+        try:
+            scope_key = self.get_scope_key()
+            page, page_size = self.get_page_bounds()
+        except ValueError as e:
+            return Response({"error": str(e) or "Invalid leaderboard parameters."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            leaderboard_data = caching.get_or_set(
+                self.get_page_cache_key(metric, scope_key, page, page_size),
+                lambda: self.build_page(metric, scope_key, page, page_size),
+                depends_on=LEADERBOARD_CACHE_DEPENDENCIES,
+            )
+        except leaderboard.UnsupportedScope as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error retrieving leaderboard for metric {metric}: {e}")
+            return Response({"error": "Failed to retrieve leaderboard."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response(leaderboard_data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'])
+    def me(self, request):
+        """
+        Returns the current user's rank plus up to 'radius' neighbours on each side.
+        """
+        metric = self.get_metric()
+        try:
+            scope_key = self.get_scope_key()
+            radius = min(max(int(request.query_params.get('radius', 5)), 0), 50)
+        except ValueError as e:
+            return Response({"error": str(e) or "Invalid leaderboard parameters."}, status=status.HTTP_400_BAD_REQUEST)
 
-class NotificationViewSet(viewsets.ModelViewSet):
+        profile_id = UserProfile.objects.filter(user=request.user).values_list('pk', flat=True).first()
+        try:
+            entry, above, below = leaderboard.get_backend().around(metric, scope_key, profile_id, radius=radius)
+        except leaderboard.UnsupportedScope as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if entry is None:
+            logger.info(f"User {request.user.username} has no leaderboard entry for metric: {metric}")
+            return Response({"error": "No leaderboard entry for this user."}, status=status.HTTP_404_NOT_FOUND)
+
+        profiles = self.load_profiles(above + [entry] + below)
+        return Response({
+            'metric': metric,
+            'scope': scope_key,
+            'total': leaderboard.get_backend().count(metric, scope_key),
+            'entry': self.serialize_entries([entry], profiles)[0],
+            'above': self.serialize_entries(above, profiles),
+            'below': self.serialize_entries(below, profiles),
+        }, status=status.HTTP_200_OK)
+
+
+class NotificationViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing notifications.
+    Supports keyset pagination with ?pagination=cursor.
     """
     queryset = Notification.objects.select_related('user').all()
     serializer_class = NotificationSerializer
@@ -714,6 +1261,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     search_fields = ['message']
     ordering_fields = ['created_at', 'is_read']
     ordering = ['-created_at']
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         """
@@ -737,6 +1285,56 @@ class NotificationViewSet(viewsets.ModelViewSet):
             logger.error(f"Error creating notification for user {self.request.user.username}: {e}")
             raise e
 
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """
+        Number of unread notifications of the current user, from a cached counter.
+        """
+        return Response({"unread_count": notifications.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        """
+        Mark every notification of the current user as read with one UPDATE.
+        """
+        user = request.user
+        updated = Notification.objects.filter(user=user, is_read=False).update(is_read=True)
+        if updated:
+            bulk_write.send(sender=Notification)
+        transaction.on_commit(lambda: notifications.set_unread_count(user.pk, 0))
+        logger.info(f"User {user.username} marked {updated} notifications as read.")
+        return Response({"updated": updated, "unread_count": 0})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """
+        Mark the listed notifications of the current user as read with one UPDATE.
+        """
+        return self.set_read(request, is_read=True)
+
+    @action(detail=False, methods=['post'])
+    def mark_unread(self, request):
+        """
+        Mark the listed notifications of the current user as unread with one UPDATE.
+        """
+        return self.set_read(request, is_read=False)
+
+    def set_read(self, request, is_read):
+        serializer = NotificationIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+
+        # Only rows whose state changes are updated, so the count is the counter delta
+        updated = Notification.objects.filter(
+            user=user, pk__in=serializer.validated_data['ids'], is_read=not is_read,
+        ).update(is_read=is_read)
+        if updated:
+            bulk_write.send(sender=Notification)
+            delta = -updated if is_read else updated
+            transaction.on_commit(lambda: notifications.adjust_unread_count(user.pk, delta))
+        logger.info(f"User {user.username} marked {updated} notifications as {'read' if is_read else 'unread'}.")
+        return Response({"updated": updated})
+
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])